@@ -0,0 +1,334 @@
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_SOLVERS = [
+    'app.allocation.NearestFillSolver',
+    'app.allocation.GreedySolver',
+    'app.allocation.ExactSolver',
+]
+
+# Trọng số phụ theo tổng km, chỉ để phân định các phương án cùng chi phí
+DISTANCE_TIEBREAK = 1e-3
+
+
+class AllocationProblem:
+    """
+    Bài toán phân bổ một giỏ hàng cho các store.
+      demand:     {variant_id: số lượng cần}
+      candidates: [(store_id, khoảng cách km, {variant_id: tồn kho}), ...]
+    Tồn kho được cắt ở mức nhu cầu; candidates được sắp theo khoảng cách tăng dần
+    nên "vị trí" (position) của store cũng là thứ hạng gần -> xa.
+    """
+
+    def __init__(self, demand: Dict[int, int], candidates: Sequence[Tuple[int, float, Dict[int, int]]]):
+        self.variant_ids = sorted(demand)
+        self.demand = tuple(demand[vid] for vid in self.variant_ids)
+
+        ordered = sorted(candidates, key=lambda c: (c[1], c[0]))
+        self.store_ids = [c[0] for c in ordered]
+        self.distances = [float(c[1]) for c in ordered]
+        self.stock = [
+            tuple(min(c[2].get(vid, 0), need) for vid, need in zip(self.variant_ids, self.demand))
+            for c in ordered
+        ]
+        # các store không có variant nào cần thì bỏ qua hẳn
+        keep = [pos for pos, row in enumerate(self.stock) if any(row)]
+        self.store_ids = [self.store_ids[p] for p in keep]
+        self.distances = [self.distances[p] for p in keep]
+        self.stock = [self.stock[p] for p in keep]
+
+    def __len__(self):
+        return len(self.store_ids)
+
+    def shortage(self) -> Dict[int, int]:
+        """{variant_id: số lượng còn thiếu} khi gộp tồn kho của mọi store."""
+        missing = {}
+        for v, (vid, need) in enumerate(zip(self.variant_ids, self.demand)):
+            have = sum(row[v] for row in self.stock)
+            if have < need:
+                missing[vid] = need - have
+        return missing
+
+    def fill(self, positions) -> Optional[Dict[int, Dict[int, int]]]:
+        """
+        Chia số lượng từng variant cho tập store `positions`, ưu tiên store gần.
+        Trả về {position: {variant_id: số lượng}} (bỏ store không nhận gì),
+        hoặc None nếu tập store không đủ hàng.
+        """
+        ordered = sorted(positions)
+        plan = {}
+        for v, (vid, need) in enumerate(zip(self.variant_ids, self.demand)):
+            remaining = need
+            for pos in ordered:
+                if not remaining:
+                    break
+                take = min(self.stock[pos][v], remaining)
+                if take:
+                    plan.setdefault(pos, {})[vid] = take
+                    remaining -= take
+            if remaining:
+                return None
+        return plan
+
+
+class CostModel:
+    """
+    Chi phí của một phương án gồm nhiều chuyến (shipment):
+        phí ship theo chuyến xa nhất                (như phí ship tính cho đơn)
+      + shipment_cost × số chuyến
+      + DISTANCE_TIEBREAK × tổng km                (chỉ để phân định)
+    `fee_for_distances` nhận mảng km và trả về danh sách phí tương ứng.
+    """
+
+    def __init__(self, fee_for_distances: Callable, shipment_cost: float = 10000.0):
+        self.fee_for_distances = fee_for_distances
+        self.shipment_cost = float(shipment_cost)
+
+    def fees(self, distances: Sequence[float]) -> List[float]:
+        if not distances:
+            return []
+        return [float(f) for f in self.fee_for_distances(distances)]
+
+    def cost(self, problem: 'AllocationProblem', fees: Sequence[float], positions) -> float:
+        positions = list(positions)
+        if not positions:
+            return 0.0
+        return (
+            max(fees[p] for p in positions)
+            + self.shipment_cost * len(positions)
+            + DISTANCE_TIEBREAK * sum(problem.distances[p] for p in positions)
+        )
+
+
+class Allocation:
+    """Một phương án đã kiểm tra đủ hàng, kèm chi phí và solver đã tìm ra nó."""
+
+    def __init__(self, problem: AllocationProblem, plan: Dict[int, Dict[int, int]], cost: float, solver: str):
+        self.cost = cost
+        self.solver = solver
+        self.positions = frozenset(plan)
+        self.shipments = [
+            {
+                'store_id': problem.store_ids[pos],
+                'distance': problem.distances[pos],
+                'quantities': plan[pos],
+            }
+            for pos in sorted(plan)
+        ]
+
+
+class AllocationTimeout(Exception):
+    pass
+
+
+class Solver:
+    """
+    Giao diện solver. `solve` trả về tập position của các store được chọn
+    (hoặc None nếu không áp dụng / không tìm được), và phải tôn trọng `deadline`
+    (giá trị `time.perf_counter()`), có thể bằng cách raise AllocationTimeout.
+    `incumbent` là phương án tốt nhất hiện có (có thể None).
+    """
+    name = 'base'
+
+    def solve(self, problem: AllocationProblem, cost_model: CostModel, fees, deadline: float,
+              incumbent: Optional[Allocation]):
+        raise NotImplementedError
+
+
+class NearestFillSolver(Solver):
+    """Lấy hàng lần lượt từ store gần nhất tới khi đủ. O(stores × variants), luôn chạy."""
+    name = 'nearest'
+
+    def solve(self, problem, cost_model, fees, deadline, incumbent):
+        remaining = list(problem.demand)
+        chosen = []
+        for pos, row in enumerate(problem.stock):
+            if any(min(have, need) for have, need in zip(row, remaining)):
+                chosen.append(pos)
+                remaining = [max(0, need - have) for have, need in zip(row, remaining)]
+                if not any(remaining):
+                    return chosen
+        return None
+
+
+class GreedySolver(Solver):
+    """
+    Heuristic set-cover có trọng số: mỗi bước chọn store có tỉ lệ
+    (số đơn vị hàng còn thiếu đáp ứng được) / (chi phí tăng thêm) lớn nhất,
+    sau đó bỏ các store thừa (xét từ xa tới gần).
+    """
+    name = 'greedy'
+
+    def solve(self, problem, cost_model, fees, deadline, incumbent):
+        remaining = list(problem.demand)
+        chosen = []
+        current = 0.0
+        while any(remaining):
+            if time.perf_counter() > deadline:
+                raise AllocationTimeout
+            best = None
+            for pos, row in enumerate(problem.stock):
+                if pos in chosen:
+                    continue
+                units = sum(min(have, need) for have, need in zip(row, remaining))
+                if not units:
+                    continue
+                marginal = cost_model.cost(problem, fees, chosen + [pos]) - current
+                ratio = units / max(marginal, 1e-9)
+                if best is None or ratio > best[0]:
+                    best = (ratio, pos)
+            if best is None:
+                return None
+            pos = best[1]
+            chosen.append(pos)
+            current = cost_model.cost(problem, fees, chosen)
+            remaining = [max(0, need - have) for have, need in zip(problem.stock[pos], remaining)]
+
+        for pos in sorted(chosen, reverse=True):
+            rest = [p for p in chosen if p != pos]
+            if rest and problem.fill(rest) is not None:
+                chosen = rest
+        return chosen
+
+
+class ExactSolver(Solver):
+    """
+    Branch & bound trên các tập store (duyệt store theo khoảng cách tăng dần).
+    Cận dưới: nếu còn thiếu hàng thì cần thêm ít nhất một store, và store đó
+    không gần hơn store đang xét. Chỉ chạy khi số store ứng viên <= max_stores.
+    """
+    name = 'exact'
+
+    def __init__(self, max_stores: Optional[int] = None):
+        if max_stores is None:
+            max_stores = getattr(settings, 'ALLOCATION_EXACT_MAX_STORES', 20)
+        self.max_stores = max_stores
+
+    def solve(self, problem, cost_model, fees, deadline, incumbent):
+        n = len(problem)
+        if n == 0 or n > self.max_stores:
+            return None
+
+        n_vars = len(problem.demand)
+        # suffix[i][v] = tổng tồn kho của variant v từ store i trở đi
+        suffix = [[0] * n_vars for _ in range(n + 1)]
+        for i in range(n - 1, -1, -1):
+            for v in range(n_vars):
+                suffix[i][v] = suffix[i + 1][v] + problem.stock[i][v]
+
+        shipment_cost = cost_model.shipment_cost
+        distances = problem.distances
+        best = {
+            'cost': incumbent.cost if incumbent is not None else float('inf'),
+            'positions': None,
+        }
+        visited = 0
+
+        def dfs(i, chosen, max_fee, dist_sum, remaining):
+            nonlocal visited
+            visited += 1
+            if visited & 0xFF == 0 and time.perf_counter() > deadline:
+                raise AllocationTimeout
+
+            if not any(remaining):
+                cost = max_fee + shipment_cost * len(chosen) + DISTANCE_TIEBREAK * dist_sum
+                if cost < best['cost']:
+                    best['cost'] = cost
+                    best['positions'] = list(chosen)
+                return
+            if i == n:
+                return
+
+            bound = (
+                max(max_fee, fees[i])
+                + shipment_cost * (len(chosen) + 1)
+                + DISTANCE_TIEBREAK * (dist_sum + distances[i])
+            )
+            if bound >= best['cost']:
+                return
+            if any(suffix[i][v] < remaining[v] for v in range(n_vars)):
+                return
+
+            row = problem.stock[i]
+            if any(row[v] and remaining[v] for v in range(n_vars)):
+                chosen.append(i)
+                dfs(
+                    i + 1, chosen, max(max_fee, fees[i]), dist_sum + distances[i],
+                    tuple(max(0, remaining[v] - row[v]) for v in range(n_vars)),
+                )
+                chosen.pop()
+            dfs(i + 1, chosen, max_fee, dist_sum, remaining)
+
+        try:
+            dfs(0, [], 0.0, 0.0, problem.demand)
+        except AllocationTimeout:
+            # trả về phương án tốt nhất tìm được trước khi hết giờ (nếu có)
+            if best['positions'] is None:
+                raise
+        return best['positions']
+
+
+class AllocationEngine:
+    """
+    Chạy lần lượt các solver trong giới hạn thời gian `time_budget_ms` và giữ
+    phương án rẻ nhất. Solver đầu tiên luôn được chạy hết để có phương án khả thi;
+    các solver sau dừng ngay khi quá hạn. Biểu phí thay đổi theo đơn (mã phí,
+    số món, tỉnh / huyện giao tới) nên cost model được dựng cho từng lần allocate.
+    """
+
+    def __init__(self, solvers: Sequence[Solver], time_budget_ms: float = 50, shipment_cost: float = 10000.0):
+        self.solvers = list(solvers)
+        self.time_budget_ms = time_budget_ms
+        self.shipment_cost = float(shipment_cost)
+
+    def allocate(self, problem: AllocationProblem, fee_for_distances: Callable) -> Optional[Allocation]:
+        """`fee_for_distances`: mảng km -> phí ship của đơn (vd fees.fee_schedule)."""
+        cost_model = CostModel(fee_for_distances, self.shipment_cost)
+        deadline = time.perf_counter() + self.time_budget_ms / 1000.0
+        fees = cost_model.fees(problem.distances)
+        best = None
+        for solver in self.solvers:
+            if best is not None and time.perf_counter() > deadline:
+                break
+            try:
+                positions = solver.solve(
+                    problem, cost_model, fees,
+                    deadline if best is not None else float('inf'), best
+                )
+            except AllocationTimeout:
+                break
+            if positions is None:
+                continue
+            plan = problem.fill(positions)
+            if plan is None:
+                continue
+            cost = cost_model.cost(problem, fees, plan)
+            if best is None or cost < best.cost:
+                best = Allocation(problem, plan, cost, solver.name)
+        return best
+
+
+_engine = None
+
+
+def get_allocation_engine() -> AllocationEngine:
+    """
+    Engine mặc định, cấu hình qua settings:
+      ALLOCATION_SOLVERS, ALLOCATION_TIME_BUDGET_MS, ALLOCATION_SHIPMENT_COST,
+      ALLOCATION_EXACT_MAX_STORES
+    """
+    global _engine
+    if _engine is None:
+        solvers = [
+            import_string(path)()
+            for path in getattr(settings, 'ALLOCATION_SOLVERS', DEFAULT_SOLVERS)
+        ]
+        _engine = AllocationEngine(
+            solvers,
+            time_budget_ms=getattr(settings, 'ALLOCATION_TIME_BUDGET_MS', 50),
+            shipment_cost=getattr(settings, 'ALLOCATION_SHIPMENT_COST', 10000),
+        )
+    return _engine
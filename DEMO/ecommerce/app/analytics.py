@@ -0,0 +1,251 @@
+import datetime
+import time
+from datetime import timedelta
+from decimal import Decimal
+from typing import Iterable, List, Optional, Set
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .cache import bump_generation
+from .models import Order, OrderItem, RollupWatermark, SalesRollup
+from .outbox import enqueue_task
+
+ROLLUP_NAME = 'sales'
+# Tăng khi rollup tháng nào đó được ghi lại; mỗi tháng còn có generation riêng
+# (month_generation) để bitmap hoạt động khách (app/retention.py) chỉ nạp lại tháng đổi
+ROLLUP_GENERATION = 'sales-rollups'
+ROLLUP_TASK = 'app.tasks.refresh_sales_rollups'
+
+# Đã hẹn một lần tổng hợp trong cửa sổ ROLLUP_DELAY hiện tại
+ROLLUP_SCHEDULED_KEY = 'sales-rollups:scheduled'
+# Chỉ một tiến trình tổng hợp tại một thời điểm (xoá + ghi lại theo ngày)
+ROLLUP_LOCK_KEY = 'sales-rollups:lock'
+
+# Đơn ở các trạng thái này không tính vào doanh số
+EXCLUDED_STATUSES = ('cancelled',)
+
+# Chiều tổng hợp -> cột của OrderItem; `all` gộp toàn bộ (dimension_id = 0)
+DIMENSIONS = {
+    'all': None,
+    'customer': 'order__customer_id',
+    'store': 'store_id',
+    'category': 'variant__product__productcategory__category_id',
+}
+
+CENT = Decimal('0.01')
+
+
+# ---------------------------------------------------------------------------
+# Ngày / tháng (giờ địa phương)
+# ---------------------------------------------------------------------------
+
+def month_start(day: datetime.date) -> datetime.date:
+    return day.replace(day=1)
+
+
+def add_months(day: datetime.date, months: int) -> datetime.date:
+    """Ngày đầu tháng cách tháng của `day` `months` tháng."""
+    index = day.year * 12 + day.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def month_generation(month: datetime.date) -> str:
+    return f'{ROLLUP_GENERATION}:{month:%Y-%m}'
+
+
+def day_bounds(first: datetime.date, last: datetime.date):
+    """[đầu ngày `first`, đầu ngày sau `last`) theo giờ địa phương, dạng aware datetime."""
+    tz = timezone.get_current_timezone()
+    start = datetime.datetime.combine(first, datetime.time.min, tzinfo=tz)
+    end = datetime.datetime.combine(last + timedelta(days=1), datetime.time.min, tzinfo=tz)
+    return start, end
+
+
+def day_runs(days: Iterable[datetime.date]):
+    """Gom các ngày thành các đoạn liên tiếp [(ngày đầu, ngày cuối)]."""
+    runs = []
+    for day in sorted(set(days)):
+        if runs and runs[-1][1] + timedelta(days=1) == day:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [tuple(run) for run in runs]
+
+
+def _ranges(field: str, runs, to_bounds=False) -> Q:
+    cond = Q()
+    for first, last in runs:
+        if to_bounds:
+            start, end = day_bounds(first, last)
+            cond |= Q(**{f'{field}__gte': start, f'{field}__lt': end})
+        else:
+            cond |= Q(**{f'{field}__range': (first, last)})
+    return cond
+
+
+# ---------------------------------------------------------------------------
+# Tổng hợp
+# ---------------------------------------------------------------------------
+
+def _daily_rows(days: Set[datetime.date]) -> List[SalesRollup]:
+    """
+    Tính lại rollup ngày cho các ngày `days` từ order_items (mỗi chiều một truy vấn
+    GROUP BY, lọc theo khoảng created_at nên dùng được index idx_orders_created_at).
+    """
+    runs = day_runs(days)
+    base = (
+        OrderItem.objects
+        .filter(_ranges('order__created_at', runs, to_bounds=True))
+        .exclude(order__status__in=EXCLUDED_STATUSES)
+        .annotate(day=TruncDate('order__created_at', tzinfo=timezone.get_current_timezone()))
+    )
+    goods = Sum(F('quantity') * F('price'), output_field=DecimalField(max_digits=14, decimal_places=2))
+
+    rows = []
+    for dimension, field in DIMENSIONS.items():
+        group = ['day'] + ([field] if field else [])
+        result = (
+            base.values(*group)
+            .annotate(orders=Count('order_id', distinct=True), qty=Sum('quantity'), goods=goods)
+            .order_by()
+        )
+        for r in result:
+            dimension_id = r[field] if field else 0
+            # dòng hàng không gắn store / sản phẩm không thuộc category nào
+            if dimension_id is None or r['day'] not in days:
+                continue
+            rows.append(SalesRollup(
+                period='day', period_start=r['day'], dimension=dimension, dimension_id=dimension_id,
+                orders_count=r['orders'], items_quantity=r['qty'] or 0, goods_amount=r['goods'] or 0,
+            ))
+    return rows
+
+
+def _monthly_rows(months: Set[datetime.date]) -> List[SalesRollup]:
+    """Rollup tháng = cộng các rollup ngày trong tháng (mỗi đơn thuộc đúng một ngày)."""
+    rows = []
+    for month in sorted(months):
+        result = (
+            SalesRollup.objects
+            .filter(period='day', period_start__gte=month, period_start__lt=add_months(month, 1))
+            .values('dimension', 'dimension_id')
+            .annotate(orders=Sum('orders_count'), qty=Sum('items_quantity'), goods=Sum('goods_amount'))
+            .order_by()
+        )
+        for r in result:
+            rows.append(SalesRollup(
+                period='month', period_start=month, dimension=r['dimension'],
+                dimension_id=r['dimension_id'], orders_count=r['orders'],
+                items_quantity=r['qty'], goods_amount=r['goods'],
+            ))
+    return rows
+
+
+def rebuild_days(days: Iterable[datetime.date]) -> int:
+    """
+    Ghi lại rollup của các ngày `days` và các tháng chứa chúng trong một
+    transaction. Idempotent: chạy lại bao nhiêu lần cũng cho cùng kết quả.
+    Trả về số dòng rollup đã ghi.
+    """
+    days = set(days)
+    if not days:
+        return 0
+    months = {month_start(day) for day in days}
+    with transaction.atomic():
+        daily = _daily_rows(days)
+        SalesRollup.objects.filter(_ranges('period_start', day_runs(days)), period='day').delete()
+        SalesRollup.objects.bulk_create(daily, batch_size=1000)
+
+        monthly = _monthly_rows(months)
+        SalesRollup.objects.filter(period='month', period_start__in=months).delete()
+        SalesRollup.objects.bulk_create(monthly, batch_size=1000)
+        transaction.on_commit(lambda: _bump_months(months))
+    return len(daily) + len(monthly)
+
+
+def _bump_months(months):
+    for month in months:
+        bump_generation(month_generation(month))
+    bump_generation(ROLLUP_GENERATION)
+
+
+def refresh_sales_rollups(rebuild: bool = False) -> Optional[dict]:
+    """
+    Tổng hợp các đơn mới / vừa đổi kể từ watermark (Order.updated_at): chỉ tính
+    lại những ngày có đơn thay đổi. Lùi watermark ROLLUP_WATERMARK_OVERLAP giây
+    để không sót đơn của transaction commit muộn (tính lại một ngày là vô hại).
+    `rebuild` bỏ watermark, tính lại toàn bộ lịch sử.
+    Trả về thống kê, hoặc None nếu tiến trình khác đang tổng hợp.
+    """
+    if not cache.add(ROLLUP_LOCK_KEY, 1, timeout=settings.ROLLUP_LOCK_TIMEOUT):
+        return None
+    # thay đổi từ giờ trở đi sẽ hẹn một lần tổng hợp mới
+    cache.delete(ROLLUP_SCHEDULED_KEY)
+    try:
+        start = time.perf_counter()
+        orders = Order.objects.all()
+        watermark = None if rebuild else RollupWatermark.objects.filter(name=ROLLUP_NAME).first()
+        if watermark is not None:
+            since = watermark.value - timedelta(seconds=settings.ROLLUP_WATERMARK_OVERLAP)
+            orders = orders.filter(updated_at__gte=since)
+        elif rebuild:
+            SalesRollup.objects.all().delete()
+            bump_generation(ROLLUP_GENERATION)
+
+        days = set()
+        latest = None
+        scanned = 0
+        for created_at, updated_at in orders.values_list('created_at', 'updated_at').iterator(chunk_size=5000):
+            days.add(timezone.localtime(created_at).date())
+            if latest is None or updated_at > latest:
+                latest = updated_at
+            scanned += 1
+
+        written = rebuild_days(days)
+        if latest is not None:
+            RollupWatermark.objects.update_or_create(name=ROLLUP_NAME, defaults={'value': latest})
+        return {
+            'orders': scanned,
+            'days': len(days),
+            'rows': written,
+            'seconds': round(time.perf_counter() - start, 4),
+        }
+    finally:
+        cache.delete(ROLLUP_LOCK_KEY)
+
+
+def schedule_rollup():
+    """
+    Hẹn một lần tổng hợp sau ROLLUP_DELAY giây (mỗi cửa sổ chỉ hẹn một lần);
+    gọi khi đơn được tạo hoặc đổi trạng thái.
+    """
+    if cache.add(ROLLUP_SCHEDULED_KEY, 1, timeout=settings.ROLLUP_DELAY):
+        enqueue_task(ROLLUP_TASK, countdown=settings.ROLLUP_DELAY)
+
+
+# ---------------------------------------------------------------------------
+# Báo cáo (chỉ đọc rollup)
+# ---------------------------------------------------------------------------
+
+def monthly_aov(year: int) -> List[dict]:
+    """Giá trị trung bình đơn (tiền hàng) theo tháng của năm `year`."""
+    rows = (
+        SalesRollup.objects
+        .filter(period='month', dimension='all', dimension_id=0,
+                period_start__gte=datetime.date(year, 1, 1), period_start__lt=datetime.date(year + 1, 1, 1))
+        .order_by('period_start')
+    )
+    return [
+        {
+            'month': r.period_start.month,
+            'orders': r.orders_count,
+            'goods_amount': r.goods_amount,
+            'avg_order_value': (r.goods_amount / r.orders_count).quantize(CENT) if r.orders_count else None,
+        }
+        for r in rows
+    ]
@@ -0,0 +1,215 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from .bulk import upsert
+from .cache import bump_generation, catalog_cache
+from .inventory import pairs_q, sharded_keys_for, sharded_stock
+from .models import Inventory, ProductVariant, Province, RegionalAvailability, Store
+from .search import SEARCH_GENERATION, tokenize
+
+# Tiền tố hành chính bỏ đi khi so tên tỉnh ("TP. Hồ Chí Minh" ~ "Hồ Chí Minh")
+PROVINCE_PREFIXES = (('thanh', 'pho'), ('tp',), ('tinh',))
+
+# Số variant mỗi lượt tính lại (giới hạn kích thước IN (...))
+REFRESH_BATCH = 1000
+
+
+# ---------------------------------------------------------------------------
+# Store.location -> Province
+# ---------------------------------------------------------------------------
+
+def province_key(name: str) -> Tuple[str, ...]:
+    """Tên tỉnh dạng token không dấu, bỏ tiền tố: "Thành phố Hà Nội" -> ('ha', 'noi')."""
+    tokens = tuple(tokenize(name))
+    for prefix in PROVINCE_PREFIXES:
+        if tokens[:len(prefix)] == prefix and len(tokens) > len(prefix):
+            return tokens[len(prefix):]
+    return tokens
+
+
+def province_keys() -> Dict[Tuple[str, ...], int]:
+    return {province_key(name): pid for pid, name in Province.objects.values_list('id', 'name')}
+
+
+def match_province(location: Optional[str], keys: Optional[Dict[Tuple[str, ...], int]] = None) -> Optional[int]:
+    """
+    Id tỉnh có tên xuất hiện trong `location` (không phân biệt dấu / hoa thường),
+    vd "Hà Nội, Quận Hoàn Kiếm" -> Hà Nội. Nhiều tỉnh khớp thì lấy tên dài nhất,
+    rồi tới tên xuất hiện trước. Không khớp tỉnh nào thì trả về None.
+    """
+    tokens = tuple(tokenize(location or ''))
+    if not tokens:
+        return None
+    if keys is None:
+        keys = province_keys()
+    best = None
+    for key, pid in keys.items():
+        n = len(key)
+        if not n:
+            continue
+        for pos in range(len(tokens) - n + 1):
+            if tokens[pos:pos + n] == key:
+                rank = (-n, pos)
+                if best is None or rank < best[0]:
+                    best = (rank, pid)
+                break
+    return best[1] if best else None
+
+
+def assign_store_province(store: Store, location_changed: bool = True):
+    """Gán Store.province từ location (giữ nguyên nếu location không khớp tỉnh nào)."""
+    if store.province_id is not None and not location_changed:
+        return
+    matched = match_province(store.location)
+    if matched is not None:
+        store.province_id = matched
+
+
+# ---------------------------------------------------------------------------
+# Duy trì RegionalAvailability
+# ---------------------------------------------------------------------------
+
+def compute_availability(variant_ids: Iterable[int]):
+    """
+    RegionalAvailability (chưa lưu) của các variant: một truy vấn gộp nhóm.
+    Cặp (store, variant) đang chia shard lấy tồn kho từ tổng shard (thêm 3 truy
+    vấn, chỉ khi có cặp như vậy) vì Inventory.quantity của chúng không bị trừ
+    khi đặt hàng.
+    """
+    variant_ids = set(variant_ids)
+    hot = sharded_keys_for(variant_ids)
+    rows = Inventory.objects.filter(variant_id__in=variant_ids, quantity__gt=0, store__province__isnull=False)
+    if hot:
+        rows = rows.exclude(pairs_q(hot))
+
+    grouped = (
+        rows.values('variant_id', 'variant__product_id', 'store__province_id')
+        .annotate(total=Sum('quantity'), stores=Count('store_id'))
+        .order_by()
+    )
+    # (variant, tỉnh) -> [product_id, tổng tồn kho, số store]
+    found = {}
+    for r in grouped:
+        found[(r['variant_id'], r['store__province_id'])] = [r['variant__product_id'], r['total'], r['stores']]
+
+    if hot:
+        totals = {key: qty for key, qty in sharded_stock(hot).items() if qty > 0}
+        provinces = dict(
+            Store.objects.filter(id__in={sid for sid, _ in totals}, province__isnull=False)
+            .values_list('id', 'province_id')
+        )
+        products = dict(
+            ProductVariant.objects.filter(id__in={vid for _, vid in totals}).values_list('id', 'product_id')
+        )
+        for (sid, vid), qty in totals.items():
+            if sid not in provinces:
+                continue
+            entry = found.setdefault((vid, provinces[sid]), [products[vid], 0, 0])
+            entry[1] += qty
+            entry[2] += 1
+
+    return [
+        RegionalAvailability(
+            variant_id=vid, province_id=pid, product_id=product_id, quantity=total, store_count=stores,
+        )
+        for (vid, pid), (product_id, total, stores) in found.items()
+    ]
+
+
+def refresh_availability(variant_ids: Iterable[int]) -> int:
+    """
+    Tính lại tồn kho theo tỉnh cho các variant: ghi các (variant, tỉnh) mới
+    hoặc đổi số lượng, xoá các cặp đã hết hàng. Bộ lọc province_id chỉ phụ
+    thuộc việc cặp có tồn tại hay không, nên cache catalog chỉ mất hiệu lực
+    (sau commit) khi có cặp được thêm / xoá; đổi số lượng thì giữ cache.
+    Trả về số dòng còn hàng sau khi cập nhật.
+    """
+    ids = sorted(set(variant_ids))
+    if not ids:
+        return 0
+    written = 0
+    presence_changed = False
+    for start in range(0, len(ids), REFRESH_BATCH):
+        batch = ids[start:start + REFRESH_BATCH]
+        with transaction.atomic():
+            rows = compute_availability(batch)
+            current = {
+                (vid, pid): (pk, values)
+                for pk, vid, pid, *values in
+                RegionalAvailability.objects.filter(variant_id__in=batch)
+                .values_list('id', 'variant_id', 'province_id', 'product_id', 'quantity', 'store_count')
+            }
+            keep = {(r.variant_id, r.province_id) for r in rows}
+            stale = [pk for pair, (pk, _) in current.items() if pair not in keep]
+            if stale:
+                RegionalAvailability.objects.filter(id__in=stale).delete()
+            dirty = [
+                r for r in rows
+                if (r.variant_id, r.province_id) not in current
+                or current[(r.variant_id, r.province_id)][1] != [r.product_id, r.quantity, r.store_count]
+            ]
+            if dirty:
+                upsert(RegionalAvailability, dirty, unique_fields=['variant', 'province'],
+                       update_fields=['product', 'quantity', 'store_count'])
+        presence_changed = presence_changed or bool(stale) or not keep <= current.keys()
+        written += len(rows)
+    if presence_changed:
+        transaction.on_commit(catalog_cache.invalidate)
+    return written
+
+
+def refresh_store_availability(store_ids: Iterable[int]) -> int:
+    """
+    Store đổi tỉnh: tính lại mọi variant đang có tồn kho ở các store đó, rồi
+    (sau commit) báo index tìm kiếm dựng lại — nhiều sản phẩm đổi tập tỉnh còn
+    hàng cùng lúc.
+    """
+    store_ids = set(store_ids)
+    if not store_ids:
+        return 0
+    variant_ids = (
+        Inventory.objects
+        .filter(store_id__in=store_ids)
+        .values_list('variant_id', flat=True)
+        .distinct()
+    )
+    written = refresh_availability(variant_ids)
+    transaction.on_commit(lambda: bump_generation(SEARCH_GENERATION))
+    return written
+
+
+def rebuild_availability(batch_size: int = REFRESH_BATCH) -> int:
+    """
+    Gán tỉnh cho các store chưa có tỉnh, rồi dựng lại toàn bộ bảng theo từng lô
+    variant. Trả về số dòng còn hàng.
+    """
+    keys = province_keys()
+    for store in Store.objects.filter(province__isnull=True).exclude(location__isnull=True):
+        matched = match_province(store.location, keys)
+        if matched is not None:
+            Store.objects.filter(id=store.id).update(province_id=matched)
+
+    # variant không còn dòng tồn kho nào thì vòng dưới không đi qua
+    RegionalAvailability.objects.exclude(variant_id__in=Inventory.objects.values('variant_id')).delete()
+    done = 0
+    last = 0
+    while True:
+        ids = list(
+            Inventory.objects.filter(variant_id__gt=last).order_by('variant_id')
+            .values_list('variant_id', flat=True).distinct()[:batch_size]
+        )
+        if not ids:
+            break
+        done += refresh_availability(ids)
+        last = ids[-1]
+    # tập sản phẩm còn hàng theo tỉnh trong index tìm kiếm và các response đã cache
+    bump_generation(SEARCH_GENERATION)
+    catalog_cache.invalidate()
+    return done
+
+
+def in_stock_product_ids(province_id: int):
+    """Subquery id sản phẩm còn hàng ở ít nhất một store trong tỉnh (dùng cho id__in)."""
+    return RegionalAvailability.objects.filter(province_id=province_id).values('product_id')
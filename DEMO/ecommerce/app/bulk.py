@@ -0,0 +1,21 @@
+from django.db import connections, router
+
+
+def upsert(model, objs, unique_fields, update_fields, batch_size=1000):
+    """
+    INSERT ... ON CONFLICT/ON DUPLICATE KEY UPDATE qua `bulk_create(update_conflicts=True)`.
+    MySQL không nhận `unique_fields` (tự dùng mọi unique key) nên chỉ truyền
+    khi backend hỗ trợ.
+    """
+    objs = list(objs)
+    if not objs:
+        return objs
+    connection = connections[router.db_for_write(model)]
+    kwargs = {
+        'update_conflicts': True,
+        'update_fields': update_fields,
+        'batch_size': batch_size,
+    }
+    if connection.features.supports_update_conflicts_with_target:
+        kwargs['unique_fields'] = unique_fields
+    return model.objects.bulk_create(objs, **kwargs)
@@ -0,0 +1,190 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from django.conf import settings
+from django.core.cache import cache, caches
+
+
+def _generation_key(name: str) -> str:
+    return f'app:generation:{name}'
+
+
+def get_generation(name: str) -> int:
+    """
+    Số thế hệ (generation) hiện tại của một nhóm dữ liệu.
+    Các index/bộ nhớ đệm trong tiến trình so sánh số này để biết khi nào cần dựng lại.
+    Lưu trên Django cache nên dùng chung được giữa các worker khi cache là Redis.
+    """
+    return cache.get_or_set(_generation_key(name), 1, timeout=None)
+
+
+def get_generations(names) -> dict:
+    """get_generation() cho nhiều nhóm trong một lượt đọc cache: {name: generation}."""
+    keys = {_generation_key(name): name for name in names}
+    found = cache.get_many(list(keys))
+    return {
+        name: found[key] if key in found else get_generation(name)
+        for key, name in keys.items()
+    }
+
+
+def bump_generation(name: str) -> int:
+    """
+    Tăng số thế hệ của một nhóm dữ liệu, đánh dấu mọi bản sao trong bộ nhớ là cũ.
+    """
+    key = _generation_key(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # key chưa tồn tại (hoặc đã bị evict)
+        cache.add(key, 1, timeout=None)
+        return cache.incr(key)
+
+
+class LRUCache:
+    """
+    Tầng cache trong tiến trình: LRU giới hạn số phần tử, mỗi key có TTL riêng.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """Trả về (có_trong_cache, giá_trị)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class ReadThroughCache:
+    """
+    Cache đọc xuyên (read-through) hai tầng có đánh version:
+      1. LRU trong tiến trình
+      2. tầng dùng chung (một alias trong settings.CACHES, ví dụ Redis), tuỳ chọn
+    Key thật = `<namespace>:v<generation>:<key>`; `invalidate()` tăng generation
+    nên mọi entry cũ tự động không còn được đọc tới (LRU/TTL sẽ dọn dần).
+    """
+
+    def __init__(self, namespace: str, max_entries: int = 1024, default_ttl: float = 300,
+                 shared_alias: Optional[str] = None):
+        self.namespace = namespace
+        self.default_ttl = default_ttl
+        self.shared_alias = shared_alias
+        self.local = LRUCache(max_entries)
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {
+                'local_hits': 0,
+                'shared_hits': 0,
+                'misses': 0,
+                'hit_seconds': 0.0,
+                'miss_seconds': 0.0,
+            }
+
+    def _versioned(self, key: str) -> str:
+        return f'{self.namespace}:v{get_generation(self.namespace)}:{key}'
+
+    def _record(self, kind: str, seconds: float):
+        with self._stats_lock:
+            self._stats[kind] += 1
+            if kind == 'misses':
+                self._stats['miss_seconds'] += seconds
+            else:
+                self._stats['hit_seconds'] += seconds
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: Optional[float] = None):
+        """
+        Đọc `key`; nếu chưa có thì gọi `compute()` và lưu kết quả vào cả hai tầng.
+        `ttl` (giây) ghi đè TTL mặc định cho riêng key này.
+        """
+        start = time.perf_counter()
+        ttl = self.default_ttl if ttl is None else ttl
+        full_key = self._versioned(key)
+
+        hit, value = self.local.get(full_key)
+        if hit:
+            self._record('local_hits', time.perf_counter() - start)
+            return value
+
+        shared = self.shared
+        if shared is not None:
+            value = shared.get(full_key, _MISSING)
+            if value is not _MISSING:
+                self.local.set(full_key, value, ttl)
+                self._record('shared_hits', time.perf_counter() - start)
+                return value
+
+        value = compute()
+        self.local.set(full_key, value, ttl)
+        if shared is not None:
+            shared.set(full_key, value, ttl)
+        self._record('misses', time.perf_counter() - start)
+        return value
+
+    def invalidate(self):
+        bump_generation(self.namespace)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            s = dict(self._stats)
+        hits = s['local_hits'] + s['shared_hits']
+        lookups = hits + s['misses']
+        return {
+            'namespace': self.namespace,
+            'generation': get_generation(self.namespace),
+            'entries': len(self.local),
+            'max_entries': self.local.max_entries,
+            'lookups': lookups,
+            'local_hits': s['local_hits'],
+            'shared_hits': s['shared_hits'],
+            'misses': s['misses'],
+            'hit_ratio': round(hits / lookups, 4) if lookups else None,
+            'avg_hit_ms': round(s['hit_seconds'] * 1000 / hits, 3) if hits else None,
+            'avg_miss_ms': round(s['miss_seconds'] * 1000 / s['misses'], 3) if s['misses'] else None,
+        }
+
+
+_MISSING = object()
+
+_catalog_config = getattr(settings, 'CATALOG_CACHE', {})
+
+# Cache cho các response catalog (category/product), xem CachedCatalogMixin trong views.py
+catalog_cache = ReadThroughCache(
+    'catalog',
+    max_entries=_catalog_config.get('MAX_ENTRIES', 1024),
+    default_ttl=_catalog_config.get('TTL', 300),
+    shared_alias=_catalog_config.get('SHARED_ALIAS'),
+)
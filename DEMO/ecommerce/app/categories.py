@@ -0,0 +1,164 @@
+import threading
+from typing import Dict, List, Optional
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
+
+from .cache import get_generation
+from .models import Category, ProductCategory
+
+CATEGORIES_GENERATION = 'categories'
+
+
+# ---------------------------------------------------------------------------
+# Duy trì path / depth
+# ---------------------------------------------------------------------------
+
+def expected_path(category: Category) -> str:
+    parent_path = ''
+    if category.parent_id:
+        parent_path = (
+            Category.objects.filter(id=category.parent_id).values_list('path', flat=True).first() or ''
+        )
+    return f"{parent_path or '/'}{category.id}/"
+
+
+def check_parent(category: Category):
+    """
+    Không cho đặt parent là chính nó hoặc một category con cháu của nó.
+    Raise ValidationError gắn vào trường `parent` (Category.clean() dùng hàm này,
+    nên form / admin hiện lỗi ngay trên trường).
+    """
+    if not category.pk or not category.parent_id:
+        return
+    if category.parent_id == category.pk:
+        raise ValidationError({'parent': "Category không thể là cha của chính nó"})
+    if not category.path:
+        return
+    parent_path = Category.objects.filter(id=category.parent_id).values_list('path', flat=True).first()
+    if parent_path and parent_path.startswith(category.path):
+        raise ValidationError({'parent': "Không thể chuyển category vào cây con của chính nó"})
+
+
+def sync_path(category: Category):
+    """
+    Cập nhật path/depth của category sau khi lưu; nếu category bị chuyển sang
+    nhánh khác thì viết lại path của cả cây con bằng một câu UPDATE.
+    Dùng queryset.update() nên không phát lại signal.
+    """
+    old_path = category.path
+    new_path = expected_path(category)
+    if new_path == old_path:
+        return
+    new_depth = new_path.count('/') - 2
+
+    if old_path:
+        (
+            Category.objects
+            .filter(path__startswith=old_path)
+            .exclude(id=category.id)
+            .update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (new_depth - category.depth),
+            )
+        )
+    Category.objects.filter(id=category.id).update(path=new_path, depth=new_depth)
+    category.path = new_path
+    category.depth = new_depth
+
+
+# ---------------------------------------------------------------------------
+# Truy vấn theo cây
+# ---------------------------------------------------------------------------
+
+def path_ids(path: str) -> List[int]:
+    return [int(x) for x in path.strip('/').split('/') if x]
+
+
+def breadcrumbs(category: Category) -> List[Category]:
+    """Chuỗi category từ gốc tới `category` (1 truy vấn)."""
+    return list(Category.objects.filter(id__in=path_ids(category.path)).order_by('depth'))
+
+
+def subtree_product_ids(category: Category, descendants: bool = True):
+    """
+    Subquery id sản phẩm thuộc category (và cả cây con nếu `descendants`).
+    Dùng dạng `id IN (subquery)` nên không nhân dòng, không cần DISTINCT.
+    """
+    links = ProductCategory.objects.all()
+    if descendants and category.path:
+        links = links.filter(category__path__startswith=category.path)
+    else:
+        links = links.filter(category=category)
+    return links.values('product_id')
+
+
+# ---------------------------------------------------------------------------
+# Ảnh chụp toàn bộ cây trong bộ nhớ
+# ---------------------------------------------------------------------------
+
+class CategoryTree:
+    """
+    Ảnh chụp cây category: `rows` (dict theo thứ tự id), `children` theo cha,
+    `roots`. Dựng bằng 1 truy vấn.
+    """
+
+    def __init__(self, categories):
+        self.rows: Dict[int, dict] = {}
+        self.children: Dict[Optional[int], List[int]] = {}
+        for cid, name, description, parent_id, path, depth in categories:
+            self.rows[cid] = {
+                'id': cid,
+                'name': name,
+                'description': description,
+                'parent': parent_id,
+                'path': path,
+                'depth': depth,
+            }
+        for cid, row in self.rows.items():
+            parent = row['parent'] if row['parent'] in self.rows else None
+            self.children.setdefault(parent, []).append(cid)
+        self.roots = self.children.get(None, [])
+
+    def flat(self) -> List[dict]:
+        return list(self.rows.values())
+
+    def nested(self, root_id: Optional[int] = None) -> List[dict]:
+        def build(cid):
+            node = dict(self.rows[cid])
+            node['children'] = [build(child) for child in self.children.get(cid, [])]
+            return node
+        ids = self.roots if root_id is None else [root_id]
+        return [build(cid) for cid in ids if cid in self.rows]
+
+    def descendant_ids(self, category_id: int) -> List[int]:
+        """id của category và toàn bộ con cháu."""
+        row = self.rows.get(category_id)
+        if row is None:
+            return [category_id]
+        prefix = row['path']
+        return [cid for cid, r in self.rows.items() if r['path'].startswith(prefix)]
+
+
+_tree_lock = threading.Lock()
+_tree: Optional[CategoryTree] = None
+_tree_generation = None
+
+
+def get_category_tree() -> CategoryTree:
+    """Ảnh chụp cây dùng chung trong tiến trình, dựng lại khi Category thay đổi."""
+    global _tree, _tree_generation
+    generation = get_generation(CATEGORIES_GENERATION)
+    if _tree is not None and _tree_generation == generation:
+        return _tree
+
+    with _tree_lock:
+        if _tree is None or _tree_generation != generation:
+            _tree = CategoryTree(
+                Category.objects.order_by('id').values_list(
+                    'id', 'name', 'description', 'parent_id', 'path', 'depth'
+                )
+            )
+            _tree_generation = generation
+        return _tree
@@ -0,0 +1,346 @@
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .availability import refresh_availability
+from .emails import enqueue_order_confirmation
+from .fees import fee_schedule, get_fee_engine, shipping_fee
+from .inventory import reserve_stock
+from .models import (
+    CheckoutIntent,
+    Order,
+    OrderFee,
+    OrderItem,
+    OrderVoucher,
+    Payment,
+    UserAddress,
+)
+from .outbox import enqueue_task
+from .services import resolve_variants, select_stores_for_order
+from .summaries import refresh_product_summaries
+from .vouchers import evaluate_vouchers, redeem_vouchers
+
+ALLOCATE_TASK = 'app.tasks.allocate_checkout'
+COMMIT_TASK = 'app.tasks.commit_checkout'
+
+
+# ---------------------------------------------------------------------------
+# Các bước của checkout (dùng chung cho đặt hàng đồng bộ và bất đồng bộ)
+# ---------------------------------------------------------------------------
+
+class StockChanged(ValidationError):
+    """Tồn kho thay đổi giữa lúc chọn store và lúc trừ kho."""
+
+
+class IntentSuperseded(Exception):
+    """Worker khác đã nhận lại intent (quá CHECKOUT_STAGE_TIMEOUT): bỏ kết quả của lượt này."""
+
+
+def check_coordinates(addr: UserAddress):
+    # chọn store theo khoảng cách: địa chỉ chưa geocode thì không giao được
+    if addr.latitude is None or addr.longitude is None:
+        raise ValidationError("Địa chỉ giao hàng chưa có toạ độ")
+
+
+def get_address(customer_id: int, addr_id: int) -> UserAddress:
+    try:
+        addr = UserAddress.objects.get(id=addr_id, customer_id=customer_id)
+    except UserAddress.DoesNotExist:
+        raise ValidationError("Địa chỉ giao hàng không tồn tại")
+    check_coordinates(addr)
+    return addr
+
+
+def check_fee_type(fee_code: str):
+    # tra trong bảng giá đã biên dịch, không truy vấn DB
+    if fee_code not in get_fee_engine():
+        raise ValidationError("Mã phí vận chuyển không hợp lệ")
+
+
+def resolve_items(raw_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Chuyển raw_items thành items chứa variant, quantity, price
+    (tra toàn bộ bộ ba product_id/color/size bằng 1 truy vấn).
+    """
+    keys = []
+    for i, raw in enumerate(raw_items, start=1):
+        prod_id = raw.get('product_id')
+        color   = raw.get('color')
+        size    = raw.get('size')
+        qty     = raw.get('quantity', 0)
+
+        if not (prod_id and color is not None and size is not None):
+            raise ValidationError(f"Item #{i} thiếu thông tin product_id/color/size")
+        if qty <= 0:
+            raise ValidationError(f"Số lượng của item #{i} phải lớn hơn 0")
+        keys.append((prod_id, color, size))
+
+    variants = resolve_variants(keys)
+
+    items = []
+    for (prod_id, color, size), raw in zip(keys, raw_items):
+        variant = variants.get((prod_id, color, size))
+        if not variant:
+            raise ValidationError(
+                f"Không tìm thấy variant cho sản phẩm {prod_id} "
+                f"(color={color}, size={size})"
+            )
+
+        items.append({
+            'variant': variant,
+            'quantity': raw.get('quantity', 0),
+            'price': variant.price,
+        })
+    return items
+
+
+def allocate(items: List[Dict[str, Any]], addr: UserAddress, fee_code: str) -> List[Dict[str, Any]]:
+    """
+    Chọn store(s) cho giỏ hàng, tối ưu theo biểu phí `fee_code` của địa chỉ
+    giao. Trả về phương án dạng JSON được (lưu vào CheckoutIntent):
+    [{'store_id', 'distance', 'quantities': {variant_id: qty}}].
+    """
+    fees = fee_schedule(
+        fee_code, sum(it['quantity'] for it in items), addr.province_id, addr.district_id
+    )
+    return [
+        {
+            'store_id': alloc['store'].id,
+            'distance': alloc['distance'],
+            'quantities': dict(alloc['quantities']),
+        }
+        for alloc in select_stores_for_order(items, addr.latitude, addr.longitude, fees)
+    ]
+
+
+def create_order(customer_id: int, addr: UserAddress, items: List[Dict[str, Any]],
+                 plan: List[Dict[str, Any]], method: str, fee_code: str, voucher_codes) -> Order:
+    """
+    Tạo Order theo phương án `plan`: OrderItem, trừ tồn kho, phí ship, voucher,
+    Payment. Phải chạy trong transaction.atomic() của người gọi.
+    """
+    max_dist = max(a['distance'] for a in plan)
+
+    # 1. Tạo Order mới
+    order = Order.objects.create(
+        customer_id=customer_id,
+        status='pending',
+        total_amount=Decimal('0.00'),
+        nearest_store_distance_km=round(max_dist, 3)
+    )
+
+    # 2. Tạo OrderItem & cập nhật tồn kho, tính tổng tiền hàng
+    #    (mỗi store một dòng, vì một variant có thể lấy từ nhiều store)
+    by_variant = {it['variant'].id: it for it in items}
+    order_items = []
+    lines = []
+    for alloc in plan:
+        for vid, qty in alloc['quantities'].items():
+            vid = int(vid)
+            it = by_variant[vid]
+            order_items.append(OrderItem(
+                order=order,
+                store_id=alloc['store_id'],
+                variant=it['variant'],
+                quantity=qty,
+                price=it['price']
+            ))
+            lines.append((alloc['store_id'], vid, qty))
+    OrderItem.objects.bulk_create(order_items)
+    total = sum((oi.quantity * oi.price for oi in order_items), Decimal('0.00'))
+
+    if not reserve_stock(lines):
+        raise StockChanged("Tồn kho vừa thay đổi, vui lòng đặt lại đơn hàng")
+
+    # tồn kho bị trừ bằng UPDATE (không có signal) nên tự cập nhật
+    # ProductSummary và tồn kho theo tỉnh, sau commit để không giữ thêm khoá
+    # trong transaction
+    product_ids = {it['variant'].product_id for it in items}
+    variant_ids = {vid for _, vid, _ in lines}
+    transaction.on_commit(lambda: refresh_product_summaries(product_ids))
+    transaction.on_commit(lambda: refresh_availability(variant_ids))
+
+    # 3. Tính phí vận chuyển theo bảng giá của FeeType (khoảng cách, số món, địa chỉ)
+    ship_amt = shipping_fee(
+        fee_code, max_dist,
+        quantity=sum(it['quantity'] for it in items),
+        province_id=addr.province_id,
+        district_id=addr.district_id,
+    )
+
+    OrderFee.objects.create(order=order, fee_type_id=fee_code, amount=ship_amt)
+
+    # 4. Áp voucher: tối đa 1 voucher giảm tiền hàng và 1 voucher giảm phí ship
+    #    (tra index voucher trong bộ nhớ + 1 truy vấn UserVoucher cho cả đơn)
+    applied = evaluate_vouchers(voucher_codes, customer_id, total, ship_amt)
+    total += ship_amt
+    if applied:
+        redeem_vouchers(customer_id, applied)
+        OrderVoucher.objects.bulk_create([
+            OrderVoucher(order=order, voucher_id=a.voucher.id, discount_amount=a.discount)
+            for a in applied
+        ])
+        total -= sum(a.discount for a in applied)
+
+    # 5. Cập nhật tổng tiền và tạo bản ghi thanh toán
+    order.total_amount = total
+    order.save()
+
+    Payment.objects.create(
+        order=order,
+        is_online=True,
+        method=method,
+        status='pending',
+        amount=total
+    )
+
+    return order
+
+
+def place_order(customer_id: int, addr_id: int, raw_items, method: str, fee_code: str,
+                voucher_codes) -> Order:
+    """Đặt hàng đồng bộ: mọi bước trong một transaction."""
+    with transaction.atomic():
+        addr = get_address(customer_id, addr_id)
+        items = resolve_items(raw_items)
+        plan = allocate(items, addr, fee_code)
+        return create_order(customer_id, addr, items, plan, method, fee_code, voucher_codes)
+
+
+# ---------------------------------------------------------------------------
+# Checkout bất đồng bộ: CheckoutIntent + pipeline Celery
+# ---------------------------------------------------------------------------
+
+def submit_checkout(payload: Dict[str, Any]) -> CheckoutIntent:
+    """
+    Kiểm tra nhanh (địa chỉ, mã phí, variant — không khoá gì) rồi lưu intent
+    `pending` và xếp bước allocate vào outbox trong cùng transaction.
+    """
+    get_address(payload['customer'], payload['shipping_address_id'])
+    check_fee_type(payload['shipping_fee_type'])
+    resolve_items(payload['items'])
+
+    with transaction.atomic():
+        intent = CheckoutIntent.objects.create(customer_id=payload['customer'], payload=payload)
+        enqueue_task(ALLOCATE_TASK, args=[intent.id])
+    return intent
+
+
+def _claim(intent_id: int, stage: str) -> Optional[CheckoutIntent]:
+    """
+    Nhận intent để chạy `stage`. Trả về None nếu bước này đã chạy xong hoặc
+    đang có worker khác chạy (message bị giao lại) — nhờ vậy mỗi bước idempotent.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.CHECKOUT_STAGE_TIMEOUT)
+    claimed = (
+        CheckoutIntent.objects
+        .filter(id=intent_id, stage=stage)
+        .filter(Q(status='pending') | Q(status='processing', updated_at__lt=stale))
+        .update(status='processing', attempts=F('attempts') + 1, updated_at=timezone.now())
+    )
+    if not claimed:
+        return None
+    return CheckoutIntent.objects.select_related('customer').get(id=intent_id)
+
+
+def _owned(intent: CheckoutIntent):
+    """
+    Intent vẫn thuộc lượt claim này: cùng bước, đang processing và chưa bị
+    worker khác nhận lại (attempts tăng mỗi lần claim).
+    """
+    return CheckoutIntent.objects.filter(
+        id=intent.id, stage=intent.stage, status='processing', attempts=intent.attempts
+    )
+
+
+def _fail(intent: CheckoutIntent, error):
+    detail = error.detail if isinstance(error, ValidationError) else str(error)
+    if isinstance(detail, list) and len(detail) == 1:
+        detail = detail[0]
+    _owned(intent).update(
+        status='failed', error=str(detail), updated_at=timezone.now()
+    )
+
+
+def run_allocate_stage(intent_id: int) -> Optional[str]:
+    """
+    Bước 1: tra variant và chọn store (chỉ đọc, không khoá). Lưu phương án vào
+    intent rồi xếp bước commit vào outbox trong cùng transaction.
+    """
+    intent = _claim(intent_id, 'received')
+    if intent is None:
+        return None
+    payload = intent.payload
+    try:
+        addr = get_address(intent.customer_id, payload['shipping_address_id'])
+        plan = allocate(resolve_items(payload['items']), addr, payload['shipping_fee_type'])
+    except ValidationError as exc:
+        _fail(intent, exc)
+        return 'failed'
+
+    with transaction.atomic():
+        CheckoutIntent.objects.filter(id=intent.id).update(
+            plan=plan, stage='allocated', status='pending', updated_at=timezone.now()
+        )
+        enqueue_task(COMMIT_TASK, args=[intent.id])
+    return 'allocated'
+
+
+def run_commit_stage(intent_id: int) -> Optional[str]:
+    """
+    Bước 2: trong MỘT transaction ngắn — trừ kho theo phương án đã lưu, tính
+    phí/voucher, tạo Order và gắn vào intent. Nếu tồn kho vừa đổi thì quay
+    lại bước allocate (tối đa CHECKOUT_MAX_REALLOCATIONS lần).
+    """
+    intent = _claim(intent_id, 'allocated')
+    if intent is None:
+        return None
+    payload = intent.payload
+    try:
+        addr = get_address(intent.customer_id, payload['shipping_address_id'])
+        items = resolve_items(payload['items'])
+        with transaction.atomic():
+            order = create_order(
+                intent.customer_id, addr, items, intent.plan,
+                payload['payment_method'], payload['shipping_fee_type'],
+                (payload.get('voucher_code1'), payload.get('voucher_code2')),
+            )
+            enqueue_order_confirmation(order.id)
+            completed = _owned(intent).update(
+                order=order, stage='completed', status='completed', error='',
+                updated_at=timezone.now(),
+            )
+            if not completed:
+                # worker nhận lại intent đang tạo đơn: huỷ đơn này (rollback kho, voucher)
+                raise IntentSuperseded(intent.id)
+    except IntentSuperseded:
+        return None
+    except StockChanged as exc:
+        if intent.reallocations >= settings.CHECKOUT_MAX_REALLOCATIONS:
+            _fail(intent, exc)
+            return 'failed'
+        with transaction.atomic():
+            if not _owned(intent).update(
+                stage='received', status='pending', plan=None,
+                reallocations=F('reallocations') + 1, updated_at=timezone.now(),
+            ):
+                return None
+            enqueue_task(ALLOCATE_TASK, args=[intent.id])
+        return 'reallocating'
+    except ValidationError as exc:
+        _fail(intent, exc)
+        return 'failed'
+    return 'completed'
+
+
+def release_intent(intent_id: int):
+    """Trả intent về `pending` để chạy lại bước hiện tại (khi worker gặp lỗi bất ngờ)."""
+    CheckoutIntent.objects.filter(id=intent_id, status='processing').update(
+        status='pending', updated_at=timezone.now()
+    )
@@ -0,0 +1,320 @@
+import time
+import uuid
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from .cache import LRUCache, get_generation
+from .fees import delivery_days
+from .models import EmailJob, Order
+from .outbox import enqueue_task
+
+ORDER_CONFIRMATION = 'order_confirmation'
+ORDER_SHIPPED = 'order_shipped'
+ORDER_CANCELLED = 'order_cancelled'
+
+# Loại email -> tiêu đề; nội dung ở app/templates/emails/<loại>.txt / .html
+EMAIL_SUBJECTS = {
+    ORDER_CONFIRMATION: "Xác nhận đơn hàng #{order.id}",
+    ORDER_SHIPPED: "Đơn hàng #{order.id} đang được giao",
+    ORDER_CANCELLED: "Đơn hàng #{order.id} đã bị huỷ",
+}
+
+# Trạng thái đơn -> email gửi khi đơn chuyển sang trạng thái đó
+STATUS_EMAILS = {
+    'shipped': ORDER_SHIPPED,
+    'cancelled': ORDER_CANCELLED,
+}
+
+FRAGMENTS_GENERATION = 'email-fragments'
+FLUSH_TASK = 'app.tasks.flush_email_jobs'
+
+# Đánh dấu đã có một lần flush được hẹn trong cửa sổ gom hiện tại
+FLUSH_SCHEDULED_KEY = 'email-jobs:flush-scheduled'
+# Số job xếp hàng kể từ lần flush gần nhất (đủ EMAIL_BATCH_SIZE thì flush ngay)
+PENDING_COUNTER_KEY = 'email-jobs:pending'
+
+_compiled = {}
+_fragments = LRUCache(settings.EMAIL_FRAGMENT_CACHE_SIZE)
+
+
+# ---------------------------------------------------------------------------
+# Xếp hàng
+# ---------------------------------------------------------------------------
+
+def enqueue_order_email(order_id: int, kind: str = ORDER_CONFIRMATION) -> Optional[EmailJob]:
+    """
+    Ghi một job email `kind` cho đơn và (sau commit) hẹn lần flush gom lô.
+    Đơn đã có job cùng loại đang chờ thì không ghi thêm.
+    """
+    if EmailJob.objects.filter(kind=kind, order_id=order_id, status='pending').exists():
+        return None
+    job = EmailJob.objects.create(kind=kind, order_id=order_id)
+    # cờ trên cache không rollback được: đặt sau commit, nếu không một
+    # transaction bị huỷ sẽ giữ cờ "đã hẹn" mà không có task flush nào
+    transaction.on_commit(schedule_flush)
+    return job
+
+
+def enqueue_order_confirmation(order_id: int) -> Optional[EmailJob]:
+    return enqueue_order_email(order_id, ORDER_CONFIRMATION)
+
+
+def schedule_flush():
+    """
+    Mỗi cửa sổ EMAIL_BATCH_WINDOW giây chỉ hẹn một task flush (cache.add là
+    nguyên tử); gom đủ EMAIL_BATCH_SIZE job thì flush ngay không chờ hết cửa sổ.
+    Gọi sau khi job đã commit; task được ghi vào outbox, relay đẩy lên broker.
+    Job nào lỡ lượt hẹn (tiến trình chết ngay sau commit) được lần flush kế
+    tiếp hoặc lịch celery beat gom.
+    """
+    cache.add(PENDING_COUNTER_KEY, 0, timeout=None)
+    try:
+        pending = cache.incr(PENDING_COUNTER_KEY)
+    except ValueError:
+        pending = 1
+
+    if pending >= settings.EMAIL_BATCH_SIZE:
+        cache.set(PENDING_COUNTER_KEY, 0, timeout=None)
+        enqueue_task(FLUSH_TASK)
+    elif cache.add(FLUSH_SCHEDULED_KEY, 1, timeout=settings.EMAIL_BATCH_WINDOW):
+        enqueue_task(FLUSH_TASK, countdown=settings.EMAIL_BATCH_WINDOW)
+
+
+# ---------------------------------------------------------------------------
+# Dựng nội dung
+# ---------------------------------------------------------------------------
+
+def load_orders(order_ids) -> Dict[int, Order]:
+    """Nạp các đơn của một lô kèm mọi quan hệ cần để dựng email (số truy vấn cố định)."""
+    return (
+        Order.objects
+        .select_related('customer__account')
+        .prefetch_related('orderitem_set__variant__product',
+                          'ordervoucher_set__voucher',
+                          'payment_set')
+        .in_bulk(list(order_ids))
+    )
+
+
+def compiled_template(name: str):
+    """Template đã biên dịch, mỗi tiến trình worker chỉ biên dịch một lần."""
+    template = _compiled.get(name)
+    if template is None:
+        template = _compiled.setdefault(name, get_template(name))
+    return template
+
+
+def variant_fragment(variant, generation: int):
+    """
+    (text, html) mô tả sản phẩm/variant của một dòng hàng. Không phụ thuộc
+    đơn hàng nên cache theo variant id; khoá kèm generation để tự bỏ khi
+    Product/ProductVariant thay đổi (xem signals.py).
+    """
+    key = (generation, variant.id)
+    hit, fragment = _fragments.get(key)
+    if not hit:
+        context = {'product': variant.product, 'variant': variant}
+        fragment = (
+            compiled_template('emails/_variant.txt').render(context).strip(),
+            mark_safe(compiled_template('emails/_variant.html').render(context).strip()),
+        )
+        _fragments.set(key, fragment)
+    return fragment
+
+
+def _money(amount) -> str:
+    return f"{amount:,}"
+
+
+def order_context(order: Order, generation: int) -> dict:
+    """Dữ liệu chung cho mọi template email của đơn (đã định dạng sẵn số tiền)."""
+    items = []
+    for item in order.orderitem_set.all():
+        text, html = variant_fragment(item.variant, generation)
+        items.append({
+            'text': text,
+            'html': html,
+            'quantity': item.quantity,
+            'price': _money(item.price),
+            'line_total': _money(item.quantity * item.price),
+        })
+
+    vouchers = [
+        {'code': ov.voucher.code, 'amount': _money(ov.discount_amount)}
+        for ov in order.ordervoucher_set.all()
+    ]
+
+    # payment_set đã prefetch, lấy bản ghi cuối trong bộ nhớ
+    payments = list(order.payment_set.all())
+    payment = None
+    if payments:
+        last = max(payments, key=lambda p: p.id)
+        payment = {'method': last.method, 'status': last.status, 'amount': _money(last.amount)}
+
+    # cùng quy tắc với báo giá (app/quotes.py)
+    days = delivery_days(order.nearest_store_distance_km)
+
+    return {
+        'order': order,
+        'customer_name': order.customer.full_name or order.customer.account.email,
+        'created_at': f"{timezone.localtime(order.created_at):%d/%m/%Y %H:%M}",
+        'items': items,
+        'vouchers': vouchers,
+        'payment': payment,
+        'eta_days': days,
+        'eta_date': (timezone.localdate() + timedelta(days=days)).isoformat(),
+    }
+
+
+def render_email(kind: str, order: Order, generation: Optional[int] = None) -> EmailMultiAlternatives:
+    """Dựng email `kind` của đơn: phần text + phần HTML từ app/templates/emails/."""
+    if generation is None:
+        generation = get_generation(FRAGMENTS_GENERATION)
+    context = order_context(order, generation)
+    text = compiled_template(f'emails/{kind}.txt').render(context)
+    html = compiled_template(f'emails/{kind}.html').render(context)
+
+    message = EmailMultiAlternatives(
+        EMAIL_SUBJECTS[kind].format(order=order),
+        text,
+        settings.DEFAULT_FROM_EMAIL,
+        [order.customer.account.email],
+    )
+    message.attach_alternative(html, 'text/html')
+    return message
+
+
+# ---------------------------------------------------------------------------
+# Gửi theo lô
+# ---------------------------------------------------------------------------
+
+def release_stale_jobs() -> int:
+    """
+    Trả lại hàng đợi các job kẹt ở trạng thái `sending` (worker chết giữa lô).
+    Khi đang gửi, `available_at` là thời điểm lô được nhận.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.EMAIL_SENDING_TIMEOUT)
+    return (
+        EmailJob.objects
+        .filter(status='sending', available_at__lt=cutoff)
+        .update(status='pending', batch_id='')
+    )
+
+
+def claim_batch(batch_size: int):
+    """
+    Nhận tối đa `batch_size` job đến hạn. UPDATE có điều kiện `status='pending'`
+    nên hai worker chạy song song không nhận trùng job.
+    """
+    now = timezone.now()
+    ids = list(
+        EmailJob.objects
+        .filter(status='pending', available_at__lte=now)
+        .order_by('id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    EmailJob.objects.filter(id__in=ids, status='pending').update(
+        status='sending', batch_id=token, available_at=now
+    )
+    return list(EmailJob.objects.filter(batch_id=token).order_by('id'))
+
+
+def _retry_or_fail(job: EmailJob, error: str) -> str:
+    """Hẹn gửi lại job lỗi, hoặc bỏ hẳn khi quá EMAIL_MAX_ATTEMPTS. Trả về 'retry' / 'failed'."""
+    attempts = job.attempts + 1
+    if attempts >= settings.EMAIL_MAX_ATTEMPTS:
+        status, available_at = 'failed', timezone.now()
+    else:
+        # lùi dần: 1, 2, 4, 8... lần EMAIL_RETRY_DELAY
+        delay = settings.EMAIL_RETRY_DELAY * (2 ** (attempts - 1))
+        status, available_at = 'pending', timezone.now() + timedelta(seconds=delay)
+    EmailJob.objects.filter(id=job.id).update(
+        status=status, attempts=attempts, last_error=error[:1000],
+        batch_id='', available_at=available_at,
+    )
+    return 'retry' if status == 'pending' else 'failed'
+
+
+def send_batch(jobs: List[EmailJob], connection=None) -> dict:
+    """
+    Dựng và gửi một lô job qua MỘT kết nối mail. Mỗi thư gửi riêng trên kết nối
+    đó để một địa chỉ lỗi không làm hỏng cả lô; thư lỗi được hẹn gửi lại.
+    Trả về thống kê lô: số thư gửi được / hẹn lại / bỏ và thông lượng (thư/giây).
+    """
+    start = time.perf_counter()
+    stats = {'claimed': len(jobs), 'sent': 0, 'retry': 0, 'failed': 0}
+
+    orders = load_orders({job.order_id for job in jobs})
+    generation = get_generation(FRAGMENTS_GENERATION)
+    messages = []
+    for job in jobs:
+        order = orders.get(job.order_id)
+        if order is None:
+            stats[_retry_or_fail(job, 'Không tìm thấy đơn hàng')] += 1
+            continue
+        messages.append((job, render_email(job.kind, order, generation)))
+
+    connection = connection or get_connection(fail_silently=False)
+    sent_ids = []
+    try:
+        connection.open()
+        for job, message in messages:
+            try:
+                connection.send_messages([message])
+                sent_ids.append(job.id)
+            except Exception as exc:
+                stats[_retry_or_fail(job, repr(exc))] += 1
+                # kết nối có thể đã hỏng: mở lại cho các thư còn lại
+                connection.close()
+                connection.open()
+    except Exception as exc:
+        # không mở được kết nối: các thư chưa gửi đều hẹn lại
+        done = set(sent_ids)
+        for job, _ in messages:
+            if job.id not in done and EmailJob.objects.filter(id=job.id, status='sending').exists():
+                stats[_retry_or_fail(job, repr(exc))] += 1
+    finally:
+        connection.close()
+
+    if sent_ids:
+        EmailJob.objects.filter(id__in=sent_ids).update(
+            status='sent', sent_at=timezone.now(), attempts=F('attempts') + 1, batch_id='',
+        )
+    stats['sent'] = len(sent_ids)
+
+    elapsed = time.perf_counter() - start
+    stats['seconds'] = round(elapsed, 4)
+    stats['per_second'] = round(stats['sent'] / elapsed, 1) if elapsed > 0 else None
+    return stats
+
+
+def flush_email_jobs(batch_size: Optional[int] = None, max_batches: Optional[int] = None) -> List[dict]:
+    """
+    Gửi hết các job đến hạn, mỗi lần một lô `batch_size` (mặc định
+    EMAIL_BATCH_SIZE). Trả về danh sách thống kê từng lô.
+    """
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    # lần enqueue tiếp theo sẽ hẹn một lần flush mới
+    cache.delete(FLUSH_SCHEDULED_KEY)
+    cache.set(PENDING_COUNTER_KEY, 0, timeout=None)
+    release_stale_jobs()
+
+    results = []
+    while max_batches is None or len(results) < max_batches:
+        jobs = claim_batch(batch_size)
+        if not jobs:
+            break
+        results.append(send_batch(jobs))
+    return results
@@ -0,0 +1,152 @@
+import csv
+import datetime
+import json
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from .analytics import day_bounds
+from .models import Order, OrderVoucher
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+FORMATS = {
+    CSV: 'text/csv; charset=utf-8',
+    NDJSON: 'application/x-ndjson',
+}
+
+# CSV: mỗi dòng hàng một dòng, cột của đơn lặp lại; đơn không có dòng hàng
+# vẫn có một dòng với các cột item_* để trống
+CSV_COLUMNS = [
+    'order_id', 'created_at', 'status', 'customer_id', 'customer_email',
+    'total_amount', 'fees_amount', 'voucher_codes', 'voucher_discount',
+    'payment_method', 'payment_status', 'payment_amount', 'paid_at',
+    'item_id', 'store_id', 'variant_id', 'quantity', 'price', 'line_total',
+]
+
+
+class Echo:
+    """"File" chỉ trả lại chuỗi được ghi, để csv.writer sinh từng dòng cho generator."""
+
+    def write(self, value):
+        return value
+
+
+def export_queryset(date_from: Optional[datetime.date] = None, date_to: Optional[datetime.date] = None,
+                    status: Optional[str] = None):
+    """
+    Đơn cần xuất (lọc theo ngày tạo theo giờ địa phương và trạng thái), kèm
+    khách hàng và các bảng con. Dùng với .iterator(chunk_size): Django nạp
+    các bảng con theo từng chunk nên bộ nhớ không tăng theo số đơn.
+    """
+    qs = (
+        Order.objects
+        .select_related('customer__account')
+        .prefetch_related(
+            'orderitem_set',
+            'orderfee_set',
+            Prefetch('ordervoucher_set', queryset=OrderVoucher.objects.select_related('voucher')),
+            'payment_set',
+        )
+        .order_by('id')
+    )
+    if date_from:
+        qs = qs.filter(created_at__gte=day_bounds(date_from, date_from)[0])
+    if date_to:
+        qs = qs.filter(created_at__lt=day_bounds(date_to, date_to)[1])
+    if status:
+        qs = qs.filter(status=status)
+    return qs
+
+
+def iter_orders(qs, chunk_size: Optional[int] = None) -> Iterator[Order]:
+    # server-side cursor trên PostgreSQL / MySQL; mỗi chunk một lượt prefetch
+    return qs.iterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE)
+
+
+def _time(value) -> Optional[str]:
+    return timezone.localtime(value).isoformat() if value else None
+
+
+def order_record(order: Order) -> dict:
+    """Một đơn kèm mọi bảng con dạng dict (JSON được), đọc từ dữ liệu đã prefetch."""
+    payments = sorted(order.payment_set.all(), key=lambda p: p.id)
+    return {
+        'id': order.id,
+        'created_at': _time(order.created_at),
+        'status': order.status,
+        'customer_id': order.customer_id,
+        'customer_email': order.customer.account.email,
+        'total_amount': order.total_amount,
+        'nearest_store_distance_km': order.nearest_store_distance_km,
+        'items': [
+            {
+                'id': item.id,
+                'store_id': item.store_id,
+                'variant_id': item.variant_id,
+                'quantity': item.quantity,
+                'price': item.price,
+            }
+            for item in sorted(order.orderitem_set.all(), key=lambda i: i.id)
+        ],
+        'fees': [
+            {'fee_type': fee.fee_type_id, 'amount': fee.amount}
+            for fee in order.orderfee_set.all()
+        ],
+        'vouchers': [
+            {'code': ov.voucher.code, 'discount_amount': ov.discount_amount}
+            for ov in order.ordervoucher_set.all()
+        ],
+        'payments': [
+            {
+                'method': p.method,
+                'is_online': p.is_online,
+                'status': p.status,
+                'transaction_id': p.transaction_id,
+                'amount': p.amount,
+                'paid_at': _time(p.paid_at),
+            }
+            for p in payments
+        ],
+    }
+
+
+def csv_rows(record: dict):
+    """Các dòng CSV của một đơn (theo CSV_COLUMNS)."""
+    payment = record['payments'][-1] if record['payments'] else {}
+    head = [
+        record['id'], record['created_at'], record['status'], record['customer_id'],
+        record['customer_email'], record['total_amount'],
+        sum(fee['amount'] for fee in record['fees']),
+        ' '.join(v['code'] for v in record['vouchers']),
+        sum(v['discount_amount'] for v in record['vouchers']),
+        payment.get('method'), payment.get('status'), payment.get('amount'), payment.get('paid_at'),
+    ]
+    if not record['items']:
+        yield head + [None] * 6
+    for item in record['items']:
+        yield head + [
+            item['id'], item['store_id'], item['variant_id'], item['quantity'], item['price'],
+            item['quantity'] * item['price'],
+        ]
+
+
+def stream_orders(fmt: str, qs, chunk_size: Optional[int] = None) -> Iterator[str]:
+    """
+    Sinh nội dung export từng đơn một (CSV: header rồi các dòng hàng;
+    NDJSON: mỗi đơn một dòng JSON). Dùng cho StreamingHttpResponse và lệnh export_orders.
+    """
+    if fmt == CSV:
+        writer = csv.writer(Echo())
+        yield writer.writerow(CSV_COLUMNS)
+        for order in iter_orders(qs, chunk_size):
+            yield ''.join(writer.writerow(row) for row in csv_rows(order_record(order)))
+    elif fmt == NDJSON:
+        encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+        for order in iter_orders(qs, chunk_size):
+            yield encoder.encode(order_record(order)) + '\n'
+    else:
+        raise ValueError(f"Định dạng export không hỗ trợ: {fmt}")
@@ -0,0 +1,206 @@
+import bisect
+import threading
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from rest_framework.exceptions import ValidationError
+
+from .cache import get_generation
+from .models import FeeRate, FeeType
+from .services import SHIPPING_FEE_BANDS, SHIPPING_FEE_OVER_LAST_BAND
+
+FEES_GENERATION = 'fees'
+
+# Thời gian giao dự kiến: tới ETA_NEAR_KM thì 2 ngày, xa hơn 3 ngày
+ETA_NEAR_KM = 100
+ETA_NEAR_DAYS = 2
+ETA_FAR_DAYS = 3
+
+# Khoá phạm vi trong bảng đã biên dịch
+DEFAULT_SCOPE = ('default', None)
+
+
+class RateTable:
+    """
+    Bảng giá đã biên dịch của một FeeType trong một phạm vi:
+      tiers: [(min_quantity, cận trên các khung km, phí từng khung, phí ngoài khung cuối)]
+    Tra bậc số lượng và khung khoảng cách đều bằng bisect.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[Optional[Decimal], int, Decimal]]):
+        by_tier: Dict[int, List[Tuple[Optional[Decimal], Decimal]]] = {}
+        for max_km, min_qty, amount in rows:
+            by_tier.setdefault(min_qty, []).append((max_km, amount))
+
+        self.tier_mins: List[int] = sorted(by_tier)
+        self.tiers = []
+        for min_qty in self.tier_mins:
+            bands = sorted((float(km), amount) for km, amount in by_tier[min_qty] if km is not None)
+            open_ended = [amount for km, amount in by_tier[min_qty] if km is None]
+            edges = [km for km, _ in bands]
+            fees = [amount for _, amount in bands]
+            # không có dòng "xa hơn": để None, engine thử phạm vi rộng hơn
+            over = open_ended[0] if open_ended else None
+            self.tiers.append((edges, np.array(edges, dtype=np.float64), fees + [over]))
+
+    def _tier(self, quantity: int):
+        t = bisect.bisect_right(self.tier_mins, quantity) - 1
+        return self.tiers[t] if t >= 0 else None
+
+    def fee(self, distance: float, quantity: int = 1) -> Optional[Decimal]:
+        tier = self._tier(quantity)
+        if tier is None:
+            return None
+        edges, _, fees = tier
+        # cận trên đóng: đúng 50km vẫn thuộc khung "<= 50"
+        return fees[bisect.bisect_left(edges, float(distance))]
+
+    def last_fee(self, quantity: int = 1) -> Optional[Decimal]:
+        """Phí của khung xa nhất (dùng khi không phạm vi nào có khung cho quãng đường này)."""
+        tier = self._tier(quantity)
+        if tier is None:
+            return None
+        fees = tier[2]
+        return fees[-1] if fees[-1] is not None else (fees[-2] if len(fees) > 1 else None)
+
+    def fees(self, distances, quantity: int = 1) -> List[Optional[Decimal]]:
+        tier = self._tier(quantity)
+        if tier is None:
+            return [None] * len(distances)
+        _, edges, fees = tier
+        idx = np.searchsorted(edges, np.asarray(distances, dtype=np.float64), side='left')
+        return [fees[i] for i in idx.tolist()]
+
+
+DEFAULT_TABLE = RateTable(
+    [(Decimal(edge), 1, fee) for edge, fee in SHIPPING_FEE_BANDS]
+    + [(None, 1, SHIPPING_FEE_OVER_LAST_BAND)]
+)
+
+
+class FeeEngine:
+    """
+    Mọi bảng giá đã biên dịch: {fee_code: {(loại phạm vi, id): RateTable}}.
+    FeeType chưa có dòng FeeRate mặc định (không gắn tỉnh/huyện) dùng khung
+    SHIPPING_FEE_BANDS làm mặc định.
+    """
+
+    def __init__(self, fee_codes: Iterable[str], rates):
+        self.tables: Dict[str, Dict[tuple, RateTable]] = {code: {} for code in fee_codes}
+        grouped: Dict[str, Dict[tuple, list]] = {}
+        for code, province_id, district_id, max_km, min_qty, amount in rates:
+            if district_id is not None:
+                scope = ('district', district_id)
+            elif province_id is not None:
+                scope = ('province', province_id)
+            else:
+                scope = DEFAULT_SCOPE
+            grouped.setdefault(code, {}).setdefault(scope, []).append((max_km, min_qty, amount))
+        for code, scopes in grouped.items():
+            self.tables[code] = {scope: RateTable(rows) for scope, rows in scopes.items()}
+
+    def __contains__(self, fee_code):
+        return fee_code in self.tables
+
+    def _tables_for(self, fee_code, province_id, district_id) -> List[RateTable]:
+        """Các bảng theo thứ tự ưu tiên district > province > mặc định > khung cố định."""
+        scopes = self.tables.get(fee_code, {})
+        chain = []
+        if district_id is not None and ('district', district_id) in scopes:
+            chain.append(scopes[('district', district_id)])
+        if province_id is not None and ('province', province_id) in scopes:
+            chain.append(scopes[('province', province_id)])
+        # FeeType không có dòng mặc định thì khung cố định đóng vai phạm vi mặc định
+        chain.append(scopes.get(DEFAULT_SCOPE, DEFAULT_TABLE))
+        return chain
+
+    def quote(self, fee_code: str, distance: float, quantity: int = 1,
+              province_id: Optional[int] = None, district_id: Optional[int] = None) -> Decimal:
+        """Phí của FeeType `fee_code` cho một quãng đường / số món / địa chỉ."""
+        return self.quote_many(fee_code, [distance], quantity, province_id, district_id)[0]
+
+    def quote_many(self, fee_code: str, distances, quantity: int = 1,
+                   province_id: Optional[int] = None, district_id: Optional[int] = None) -> List[Decimal]:
+        """Như quote() cho cả mảng khoảng cách (vd báo giá nhiều phương án store)."""
+        result: List[Optional[Decimal]] = [None] * len(distances)
+        chain = self._tables_for(fee_code, province_id, district_id)
+        for table in chain:
+            missing = [i for i, fee in enumerate(result) if fee is None]
+            if not missing:
+                break
+            fees = table.fees([distances[i] for i in missing], quantity)
+            for i, fee in zip(missing, fees):
+                result[i] = fee
+        if any(fee is None for fee in result):
+            # xa hơn mọi khung: lấy phí khung xa nhất của phạm vi cụ thể nhất
+            fallback = next(
+                (fee for fee in (t.last_fee(quantity) for t in chain) if fee is not None), None
+            )
+            result = [fallback if fee is None else fee for fee in result]
+        if any(fee is None for fee in result):
+            raise KeyError(f"FeeType `{fee_code}` không có biểu phí cho {quantity} món")
+        return result
+
+
+def build_fee_engine() -> FeeEngine:
+    return FeeEngine(
+        FeeType.objects.values_list('code', flat=True),
+        FeeRate.objects.values_list(
+            'fee_type_id', 'province_id', 'district_id', 'max_distance_km', 'min_quantity', 'amount'
+        ),
+    )
+
+
+_engine_lock = threading.Lock()
+_engine: Optional[FeeEngine] = None
+_engine_generation = None
+
+
+def get_fee_engine() -> FeeEngine:
+    """Bảng giá biên dịch dùng chung trong tiến trình, dựng lại khi FeeType/FeeRate thay đổi."""
+    global _engine, _engine_generation
+    generation = get_generation(FEES_GENERATION)
+    if _engine is not None and _engine_generation == generation:
+        return _engine
+
+    with _engine_lock:
+        if _engine is None or _engine_generation != generation:
+            _engine = build_fee_engine()
+            _engine_generation = generation
+        return _engine
+
+
+def shipping_fee(fee_code: str, distance: float, quantity: int = 1,
+                 province_id: Optional[int] = None, district_id: Optional[int] = None) -> Decimal:
+    """quote() cho checkout: mã phí sai hoặc thiếu biểu phí thì báo lỗi validation."""
+    engine = get_fee_engine()
+    if fee_code not in engine:
+        raise ValidationError("Mã phí vận chuyển không hợp lệ")
+    try:
+        return engine.quote(fee_code, distance, quantity, province_id, district_id)
+    except KeyError as exc:
+        raise ValidationError(exc.args[0])
+
+
+def fee_schedule(fee_code: str, quantity: int = 1, province_id: Optional[int] = None,
+                 district_id: Optional[int] = None) -> Callable[[Sequence[float]], List[Decimal]]:
+    """
+    Hàm mảng km -> phí ship theo đúng biểu phí sẽ tính cho đơn (mã phí, số món,
+    tỉnh / huyện giao tới), dùng làm cost model của allocation engine.
+    """
+    engine = get_fee_engine()
+    if fee_code not in engine:
+        raise ValidationError("Mã phí vận chuyển không hợp lệ")
+
+    def fees(distances):
+        try:
+            return engine.quote_many(fee_code, list(distances), quantity, province_id, district_id)
+        except KeyError as exc:
+            raise ValidationError(exc.args[0])
+    return fees
+
+
+def delivery_days(distance) -> int:
+    """Số ngày giao dự kiến theo khoảng cách tới store xa nhất của đơn (km)."""
+    return ETA_NEAR_DAYS if float(distance or 0) <= ETA_NEAR_KM else ETA_FAR_DAYS
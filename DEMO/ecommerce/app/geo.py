@@ -0,0 +1,211 @@
+import heapq
+import itertools
+import math
+import threading
+from typing import Callable, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .cache import get_generation
+from .models import Store
+
+# Bán kính Trái đất ~ 6_371 km
+EARTH_RADIUS_KM = 6371.0
+
+STORES_GENERATION = 'stores'
+
+
+def to_unit_vector(lat, lon) -> Tuple[float, float, float]:
+    """
+    Đổi toạ độ (độ) sang vector đơn vị 3D.
+    Khoảng cách Euclid (dây cung) giữa hai vector tăng đơn điệu theo khoảng cách
+    mặt cầu, nên tìm láng giềng gần nhất trong 3D cho đúng thứ tự haversine.
+    """
+    phi = math.radians(float(lat))
+    lam = math.radians(float(lon))
+    cos_phi = math.cos(phi)
+    return (cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi))
+
+
+def haversine_matrix(origins, targets) -> np.ndarray:
+    """
+    Khoảng cách haversine (km) theo lô, tính bằng NumPy.
+      origins: (lat, lon) của một điểm, hoặc mảng (N, 2)
+      targets: mảng (M, 2) toạ độ (độ)
+    Trả về mảng (M,) nếu origins là một điểm, ngược lại ma trận (N, M).
+    """
+    o = np.asarray(origins, dtype=np.float64)
+    t = np.asarray(targets, dtype=np.float64).reshape(-1, 2)
+    single = o.ndim == 1
+    o = np.radians(o.reshape(-1, 2))
+    t = np.radians(t)
+
+    phi1 = o[:, 0:1]
+    phi2 = t[:, 0][np.newaxis, :]
+    dphi = phi2 - phi1
+    dlambda = t[:, 1][np.newaxis, :] - o[:, 1:2]
+
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    d = 2 * EARTH_RADIUS_KM * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return d[0] if single else d
+
+
+def chord_to_km(chord: float) -> float:
+    """Đổi độ dài dây cung (trên mặt cầu đơn vị) sang km."""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+class KDTree:
+    """
+    KD-tree tĩnh trên các điểm 3D.
+    `iter_nearest` duyệt best-first nên trả về điểm theo khoảng cách tăng dần,
+    chỉ mở những nhánh cần thiết (trung bình O(log n) cho mỗi điểm lấy ra).
+    """
+    LEAF_SIZE = 8
+
+    def __init__(self, points):
+        self.points = list(points)
+        self.index = list(range(len(self.points)))
+        # node lá:   (-1, None, lo, hi)  -> các điểm self.index[lo:hi]
+        # node trong: (axis, split, left, right)
+        self.nodes = []
+        self.root = self._build(0, len(self.points)) if self.points else None
+
+    def _build(self, lo, hi):
+        if hi - lo <= self.LEAF_SIZE:
+            self.nodes.append((-1, None, lo, hi))
+            return len(self.nodes) - 1
+
+        # chia theo trục có độ trải rộng lớn nhất
+        idx = self.index[lo:hi]
+        axis = max(
+            range(3),
+            key=lambda a: max(self.points[i][a] for i in idx) - min(self.points[i][a] for i in idx)
+        )
+        idx.sort(key=lambda i: self.points[i][axis])
+        self.index[lo:hi] = idx
+        mid = (lo + hi) // 2
+        split = self.points[self.index[mid]][axis]
+
+        left = self._build(lo, mid)
+        right = self._build(mid, hi)
+        self.nodes.append((axis, split, left, right))
+        return len(self.nodes) - 1
+
+    def iter_nearest(self, q) -> Iterator[Tuple[float, int]]:
+        """
+        Sinh (bình phương khoảng cách, vị trí điểm) theo thứ tự tăng dần.
+        """
+        if self.root is None:
+            return
+        tie = itertools.count()
+        # (cận dưới, tie-break, là node?, tham chiếu)
+        heap = [(0.0, next(tie), True, self.root)]
+        points = self.points
+        while heap:
+            bound, _, is_node, ref = heapq.heappop(heap)
+            if not is_node:
+                yield bound, ref
+                continue
+
+            axis, split, a, b = self.nodes[ref]
+            if axis < 0:
+                for i in self.index[a:b]:
+                    p = points[i]
+                    d = (p[0] - q[0]) ** 2 + (p[1] - q[1]) ** 2 + (p[2] - q[2]) ** 2
+                    heapq.heappush(heap, (d, next(tie), False, i))
+                continue
+
+            diff = q[axis] - split
+            near, far = (a, b) if diff <= 0 else (b, a)
+            heapq.heappush(heap, (bound, next(tie), True, near))
+            heapq.heappush(heap, (max(bound, diff * diff), next(tie), True, far))
+
+
+class StoreIndex:
+    """
+    Ảnh chụp toạ độ Store (bỏ qua store thiếu toạ độ):
+      - `coords`: mảng float64 liên tục (M, 2) cho các phép tính khoảng cách theo lô
+      - `tree`:   KD-tree cho truy vấn k store gần nhất
+    """
+
+    def __init__(self, ids: Sequence[int], coords):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64).reshape(-1, 2)
+        self.position = {int(store_id): pos for pos, store_id in enumerate(self.ids)}
+
+        phi = np.radians(self.coords[:, 0])
+        lam = np.radians(self.coords[:, 1])
+        unit = np.column_stack((np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)))
+        self.tree = KDTree(map(tuple, unit.tolist()))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Dựng từ các bộ (store_id, latitude, longitude)."""
+        ids = []
+        coords = []
+        for store_id, lat, lon in rows:
+            if lat is None or lon is None:
+                continue
+            ids.append(store_id)
+            coords.append((float(lat), float(lon)))
+        return cls(ids, coords)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, store_id):
+        return store_id in self.position
+
+    def distances(self, lat, lon, store_ids: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Khoảng cách (km) từ (lat, lon) tới các store, tính theo lô.
+        Mặc định là mọi store trong index (theo thứ tự `self.ids`);
+        truyền `store_ids` để chỉ lấy một tập con (phải có trong index).
+        """
+        coords = self.coords
+        if store_ids is not None:
+            coords = coords[[self.position[sid] for sid in store_ids]]
+        return haversine_matrix((float(lat), float(lon)), coords)
+
+    def nearest(self, lat, lon, k: Optional[int] = None,
+                predicate: Optional[Callable[[int], bool]] = None) -> Iterator[Tuple[int, float]]:
+        """
+        Sinh (store_id, khoảng cách km) theo thứ tự gần -> xa.
+          k:         dừng sau k kết quả (None = duyệt hết)
+          predicate: chỉ nhận store_id thoả điều kiện
+        """
+        if k is not None and k <= 0:
+            return
+        found = 0
+        q = to_unit_vector(lat, lon)
+        for sq_dist, pos in self.tree.iter_nearest(q):
+            store_id = int(self.ids[pos])
+            if predicate is not None and not predicate(store_id):
+                continue
+            yield store_id, chord_to_km(math.sqrt(sq_dist))
+            found += 1
+            if k is not None and found >= k:
+                return
+
+
+_index_lock = threading.Lock()
+_index = None
+_index_generation = None
+
+
+def get_store_index() -> StoreIndex:
+    """
+    StoreIndex (toạ độ + KD-tree) dùng chung trong tiến trình, chỉ dựng lại khi bảng Store thay đổi
+    (signal post_save/post_delete của Store tăng generation `stores`).
+    """
+    global _index, _index_generation
+    generation = get_generation(STORES_GENERATION)
+    if _index is not None and _index_generation == generation:
+        return _index
+
+    with _index_lock:
+        if _index is None or _index_generation != generation:
+            _index = StoreIndex.from_rows(Store.objects.values_list('id', 'latitude', 'longitude'))
+            _index_generation = generation
+        return _index
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+
+# Chờ request trùng đang chạy ở tiến trình khác: hỏi lại cache sau mỗi khoảng này
+POLL_INTERVAL = 0.05
+
+_local_lock = threading.Lock()
+_local_events = {}
+
+
+def fingerprint(request) -> str:
+    """Băm nội dung request (method + path + body chuẩn hoá) để phát hiện dùng lại key cho request khác."""
+    body = json.dumps(request.data, sort_keys=True, separators=(',', ':'), default=str)
+    raw = f'{request.method}:{request.path}:{body}'
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def _cache_key(scope: str, key: str) -> str:
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return f'idem:{scope}:{digest}'
+
+
+class IdempotencyStore:
+    """
+    Kho key -> response gọn trên Django cache (dùng chung giữa các worker khi là Redis).
+    Mỗi entry là một tuple:
+      (IN_FLIGHT, fingerprint)                                 đang xử lý, hết hạn sau in_flight_ttl
+      (DONE, fingerprint, status_code, data, location)         đã xong, hết hạn sau ttl
+    """
+
+    def __init__(self, ttl: Optional[int] = None, in_flight_ttl: Optional[int] = None,
+                 wait_timeout: Optional[float] = None):
+        self.ttl = ttl or settings.IDEMPOTENCY_TTL
+        self.in_flight_ttl = in_flight_ttl or settings.IDEMPOTENCY_IN_FLIGHT_TTL
+        self.wait_timeout = settings.IDEMPOTENCY_WAIT_TIMEOUT if wait_timeout is None else wait_timeout
+
+    def begin(self, cache_key: str, fp: str) -> bool:
+        """Giữ key cho request này; False nếu đã có request cùng key (đang chạy hoặc đã xong)."""
+        return cache.add(cache_key, (IN_FLIGHT, fp), timeout=self.in_flight_ttl)
+
+    def get(self, cache_key: str):
+        return cache.get(cache_key)
+
+    def finish(self, cache_key: str, fp: str, response: Response):
+        location = response.headers.get('Location')
+        cache.set(cache_key, (DONE, fp, response.status_code, response.data, location), timeout=self.ttl)
+
+    def release(self, cache_key: str):
+        cache.delete(cache_key)
+
+    def wait(self, cache_key: str):
+        """
+        Chờ request cùng key đang chạy xong. Cùng tiến trình thì chờ trên Event,
+        khác tiến trình thì hỏi lại cache định kỳ. Trả về entry cuối cùng thấy được.
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        with _local_lock:
+            event = _local_events.get(cache_key)
+        if event is not None:
+            event.wait(self.wait_timeout)
+
+        entry = cache.get(cache_key)
+        while entry is not None and entry[0] == IN_FLIGHT and time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            entry = cache.get(cache_key)
+        return entry
+
+
+def _replay(entry) -> Response:
+    _, _, status_code, data, location = entry
+    headers = {'Idempotent-Replayed': 'true'}
+    if location:
+        headers['Location'] = location
+    return Response(data, status=status_code, headers=headers)
+
+
+def idempotent_response(request, key: str, scope: str, compute: Callable[[], Response],
+                        store: Optional[IdempotencyStore] = None) -> Response:
+    """
+    Chạy `compute()` đúng một lần cho mỗi (scope, Idempotency-Key):
+      - key đã xong: trả lại response đã lưu, không chạm tới DB
+      - key đang chạy: chờ request đó xong rồi trả cùng kết quả
+      - cùng key nhưng nội dung request khác: 422
+    Chỉ lưu response 2xx; lỗi (validation, 5xx) thì nhả key để client thử lại.
+    """
+    store = store or IdempotencyStore()
+    cache_key = _cache_key(scope, key)
+    fp = fingerprint(request)
+
+    if not store.begin(cache_key, fp):
+        entry = store.get(cache_key)
+        if entry is not None and entry[1] != fp:
+            return Response(
+                {'detail': "Idempotency-Key đã được dùng cho một request khác"},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        if entry is not None and entry[0] == IN_FLIGHT:
+            entry = store.wait(cache_key)
+        if entry is not None and entry[0] == DONE:
+            return _replay(entry)
+        if entry is not None:
+            return Response(
+                {'detail': "Request cùng Idempotency-Key đang được xử lý, vui lòng thử lại sau"},
+                status=status.HTTP_409_CONFLICT,
+            )
+        # request trước đã lỗi và nhả key: chạy lại như request mới
+        if not store.begin(cache_key, fp):
+            return idempotent_response(request, key, scope, compute, store)
+
+    event = threading.Event()
+    with _local_lock:
+        _local_events[cache_key] = event
+    try:
+        response = compute()
+        if 200 <= response.status_code < 300:
+            store.finish(cache_key, fp, response)
+        else:
+            store.release(cache_key)
+        return response
+    except BaseException:
+        store.release(cache_key)
+        raise
+    finally:
+        with _local_lock:
+            _local_events.pop(cache_key, None)
+        event.set()
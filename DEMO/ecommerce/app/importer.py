@@ -0,0 +1,508 @@
+import csv
+import io
+import json
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, InvalidOperation
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.db import connections, transaction
+from django.db.models import Count, Q
+
+from .availability import match_province, province_keys, refresh_availability, refresh_store_availability
+from .bulk import upsert
+from .cache import bump_generation, catalog_cache
+from .emails import FRAGMENTS_GENERATION
+from .geo import STORES_GENERATION
+from .inventory import get_sharded_keys
+from .models import (
+    Category,
+    Inventory,
+    InventoryShard,
+    Product,
+    ProductCategory,
+    ProductVariant,
+    Store,
+)
+from .search import SEARCH_GENERATION
+from .summaries import refresh_product_summaries
+
+# Thứ tự chạy: mỗi bước chỉ phụ thuộc các bước trước nó
+STAGES = ('stores', 'products', 'variants', 'inventory')
+
+
+class RowError(ValueError):
+    """Một dòng dữ liệu không hợp lệ (bị bỏ qua và ghi vào báo cáo lỗi)."""
+
+
+# ---------------------------------------------------------------------------
+# Đọc file
+# ---------------------------------------------------------------------------
+
+def read_rows(path: str, fmt: Optional[str] = None) -> Iterator[Tuple[int, dict]]:
+    """
+    Đọc lần lượt từng dòng (số dòng, dict) từ CSV có header hoặc NDJSON
+    (mỗi dòng một object JSON). `path` là '-' thì đọc stdin.
+    """
+    if fmt is None:
+        fmt = 'ndjson' if path.endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+    stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8') if path == '-' else \
+        open(path, encoding='utf-8', newline='')
+    try:
+        if fmt == 'csv':
+            reader = csv.DictReader(stream)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_no, line in enumerate(stream, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as exc:
+                    yield line_no, RowError(f"JSON không hợp lệ: {exc}")
+                    continue
+                yield line_no, row
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _text(row: dict, field: str, required: bool = False) -> Optional[str]:
+    value = row.get(field)
+    value = str(value).strip() if value is not None else ''
+    if not value:
+        if required:
+            raise RowError(f"thiếu `{field}`")
+        return None
+    return value
+
+
+def _int(row: dict, field: str, required: bool = False, minimum: Optional[int] = None) -> Optional[int]:
+    value = _text(row, field, required)
+    if value is None:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise RowError(f"`{field}` phải là số nguyên")
+    if minimum is not None and number < minimum:
+        raise RowError(f"`{field}` phải >= {minimum}")
+    return number
+
+
+def _decimal(row: dict, field: str, required: bool = False) -> Optional[Decimal]:
+    value = _text(row, field, required)
+    if value is None:
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise RowError(f"`{field}` phải là số")
+    if not number.is_finite():
+        raise RowError(f"`{field}` phải là số")
+    return number
+
+
+# ---------------------------------------------------------------------------
+# Bảng tra khoá ngoại trong bộ nhớ
+# ---------------------------------------------------------------------------
+
+class LookupMaps:
+    """
+    Khoá tự nhiên -> id, nạp một lần cho mỗi lần import (và cập nhật khi tạo mới):
+      stores:   tên -> id
+      products: tên -> id
+      variants: (product_id, color, size) -> id
+    Trùng khoá thì lấy id nhỏ nhất (giống resolve_variants).
+    """
+
+    def __init__(self):
+        self.stores: Dict[str, int] = {}
+        self.store_ids = set()
+        self.products: Dict[str, int] = {}
+        self.product_ids = set()
+        self.variants: Dict[Tuple[int, Optional[str], Optional[str]], int] = {}
+        self.variant_products: Dict[int, int] = {}
+        self.categories: Dict[str, int] = {}
+        self.provinces: Dict[Tuple[str, ...], int] = {}
+
+    def load(self, stages: Iterable[str]):
+        stages = set(stages)
+        if stages & {'stores', 'inventory'}:
+            self.add_stores(Store.objects.values_list('name', 'id'))
+        if 'stores' in stages:
+            self.provinces = province_keys()
+        if stages & {'products', 'variants', 'inventory'}:
+            self.add_products(Product.objects.values_list('name', 'id'))
+        if 'products' in stages:
+            self.categories = dict(Category.objects.values_list('name', 'id'))
+        if stages & {'variants', 'inventory'}:
+            self.add_variants(ProductVariant.objects.values_list('product_id', 'color', 'size', 'id'))
+        return self
+
+    def add_stores(self, rows):
+        for name, store_id in sorted(rows, key=lambda r: r[1]):
+            self.stores.setdefault(name, store_id)
+            self.store_ids.add(store_id)
+
+    def add_products(self, rows):
+        for name, product_id in sorted(rows, key=lambda r: r[1]):
+            self.products.setdefault(name, product_id)
+            self.product_ids.add(product_id)
+
+    def add_variants(self, rows):
+        for product_id, color, size, variant_id in sorted(rows, key=lambda r: r[3]):
+            self.variants.setdefault((product_id, color or None, size or None), variant_id)
+            self.variant_products[variant_id] = product_id
+
+    def store_id(self, row: dict) -> int:
+        store_id = _int(row, 'store_id')
+        if store_id is not None:
+            if store_id not in self.store_ids:
+                raise RowError(f"store_id {store_id} không tồn tại")
+            return store_id
+        name = _text(row, 'store', required=True)
+        if name not in self.stores:
+            raise RowError(f"store `{name}` không tồn tại")
+        return self.stores[name]
+
+    def product_id(self, row: dict) -> int:
+        product_id = _int(row, 'product_id')
+        if product_id is not None:
+            if product_id not in self.product_ids:
+                raise RowError(f"product_id {product_id} không tồn tại")
+            return product_id
+        name = _text(row, 'product', required=True)
+        if name not in self.products:
+            raise RowError(f"sản phẩm `{name}` không tồn tại")
+        return self.products[name]
+
+    def variant_key(self, row: dict) -> Tuple[int, Optional[str], Optional[str]]:
+        return self.product_id(row), _text(row, 'color'), _text(row, 'size')
+
+    def variant_id(self, row: dict) -> int:
+        variant_id = _int(row, 'variant_id')
+        if variant_id is not None:
+            if variant_id not in self.variant_products:
+                raise RowError(f"variant_id {variant_id} không tồn tại")
+            return variant_id
+        key = self.variant_key(row)
+        if key not in self.variants:
+            raise RowError(f"không có variant {key[1]}/{key[2]} của sản phẩm {key[0]}")
+        return self.variants[key]
+
+
+# ---------------------------------------------------------------------------
+# Ghi từng chunk (mỗi chunk một transaction: dừng giữa chừng thì các chunk
+# đã commit vẫn đúng, chạy lại import cho cùng kết quả)
+# ---------------------------------------------------------------------------
+
+def write_stores(rows: List[dict], maps: LookupMaps) -> int:
+    by_name = {r['name']: r for r in rows}
+    existing = [Store(id=maps.stores[name], **r) for name, r in by_name.items() if name in maps.stores]
+    new = [Store(**r) for name, r in by_name.items() if name not in maps.stores]
+    with transaction.atomic():
+        # bulk_update / bulk_create không phát signal: tự gán tỉnh theo location
+        # (location không khớp tỉnh nào thì giữ tỉnh cũ, như khi lưu qua model)
+        previous = dict(Store.objects.filter(id__in=[s.id for s in existing]).values_list('id', 'province_id'))
+        for store in existing + new:
+            matched = match_province(store.location, maps.provinces)
+            store.province_id = matched if matched is not None else previous.get(store.id)
+        Store.objects.bulk_update(existing, ['location', 'province', 'latitude', 'longitude'], batch_size=1000)
+        Store.objects.bulk_create(new, batch_size=1000)
+        refresh_store_availability(s.id for s in existing if previous.get(s.id) != s.province_id)
+    if new:
+        maps.add_stores(Store.objects.filter(name__in=[s.name for s in new]).values_list('name', 'id'))
+    return len(by_name)
+
+
+def write_products(rows: List[dict], maps: LookupMaps) -> int:
+    by_name = {r['name']: r for r in rows}
+    existing = [
+        Product(id=maps.products[name], name=name, description=r['description'])
+        for name, r in by_name.items() if name in maps.products
+    ]
+    new = [Product(name=name, description=r['description']) for name, r in by_name.items()
+           if name not in maps.products]
+    with transaction.atomic():
+        Product.objects.bulk_update(existing, ['description'], batch_size=1000)
+        Product.objects.bulk_create(new, batch_size=1000)
+        if new:
+            maps.add_products(Product.objects.filter(name__in=[p.name for p in new]).values_list('name', 'id'))
+        links = [
+            ProductCategory(product_id=maps.products[name], category_id=category_id)
+            for name, r in by_name.items() for category_id in r['categories']
+        ]
+        ProductCategory.objects.bulk_create(links, batch_size=1000, ignore_conflicts=True)
+    return len(by_name)
+
+
+def write_variants(rows: List[dict], maps: LookupMaps) -> int:
+    by_key = {r['key']: r['price'] for r in rows}
+    existing = [
+        ProductVariant(id=maps.variants[key], price=price)
+        for key, price in by_key.items() if key in maps.variants
+    ]
+    new = [
+        ProductVariant(product_id=key[0], color=key[1], size=key[2], price=price)
+        for key, price in by_key.items() if key not in maps.variants
+    ]
+    with transaction.atomic():
+        ProductVariant.objects.bulk_update(existing, ['price'], batch_size=1000)
+        ProductVariant.objects.bulk_create(new, batch_size=1000)
+        product_ids = {key[0] for key in by_key}
+        if new:
+            maps.add_variants(
+                ProductVariant.objects
+                .filter(product_id__in={v.product_id for v in new})
+                .values_list('product_id', 'color', 'size', 'id')
+            )
+        refresh_product_summaries(product_ids)
+    return len(by_key)
+
+
+def reset_shards(quantities: Dict[Tuple[int, int], int]) -> int:
+    """
+    Cặp (store, variant) đang chia shard: chia lại tồn kho mới đều cho các shard
+    hiện có (giữ số shard), vì tồn kho thật của cặp đó là tổng shard.
+    """
+    keys = set(quantities) & get_sharded_keys()
+    if not keys:
+        return 0
+    cond = Q()
+    for store_id, variant_id in keys:
+        cond |= Q(store_id=store_id, variant_id=variant_id)
+    counts = {
+        (r['store_id'], r['variant_id']): r['n']
+        for r in InventoryShard.objects.filter(cond).values('store_id', 'variant_id').annotate(n=Count('id'))
+    }
+    InventoryShard.objects.filter(cond).delete()
+    shards = []
+    for key, n in counts.items():
+        base, extra = divmod(max(quantities[key], 0), n)
+        shards.extend(
+            InventoryShard(store_id=key[0], variant_id=key[1], shard=k, quantity=base + (1 if k < extra else 0))
+            for k in range(n)
+        )
+    InventoryShard.objects.bulk_create(shards)
+    return len(counts)
+
+
+def write_inventory(rows: List[Tuple[int, int, int, int]]) -> int:
+    """
+    Upsert một chunk tồn kho (store_id, variant_id, product_id, quantity) trong
+    MỘT transaction cùng shard, ProductSummary và tồn kho theo tỉnh liên quan.
+    Chạy được trong tiến trình con của process pool (chỉ nhận tuple).
+    """
+    quantities = {(store_id, variant_id): qty for store_id, variant_id, _, qty in rows}
+    with transaction.atomic():
+        upsert(
+            Inventory,
+            (Inventory(store_id=s, variant_id=v, quantity=q) for (s, v), q in quantities.items()),
+            unique_fields=['store', 'variant'],
+            update_fields=['quantity'],
+        )
+        reset_shards(quantities)
+        refresh_product_summaries({product_id for _, _, product_id, _ in rows})
+        refresh_availability({variant_id for _, variant_id in quantities})
+    return len(quantities)
+
+
+# ---------------------------------------------------------------------------
+# Kiểm tra dòng
+# ---------------------------------------------------------------------------
+
+def parse_store(row: dict, maps: LookupMaps) -> dict:
+    return {
+        'name': _text(row, 'name', required=True),
+        'location': _text(row, 'location'),
+        'latitude': _decimal(row, 'latitude'),
+        'longitude': _decimal(row, 'longitude'),
+    }
+
+
+def parse_product(row: dict, maps: LookupMaps) -> dict:
+    categories = []
+    for name in (_text(row, 'categories') or '').split('|'):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in maps.categories:
+            raise RowError(f"category `{name}` không tồn tại")
+        categories.append(maps.categories[name])
+    return {
+        'name': _text(row, 'name', required=True),
+        'description': _text(row, 'description'),
+        'categories': categories,
+    }
+
+
+def parse_variant(row: dict, maps: LookupMaps) -> dict:
+    price = _decimal(row, 'price', required=True)
+    if price < 0:
+        raise RowError("`price` phải >= 0")
+    return {'key': maps.variant_key(row), 'price': price}
+
+
+def parse_inventory(row: dict, maps: LookupMaps) -> Tuple[int, int, int, int]:
+    store_id = maps.store_id(row)
+    variant_id = maps.variant_id(row)
+    quantity = _int(row, 'quantity', required=True, minimum=0)
+    return store_id, variant_id, maps.variant_products[variant_id], quantity
+
+
+PARSERS = {
+    'stores': parse_store,
+    'products': parse_product,
+    'variants': parse_variant,
+    'inventory': parse_inventory,
+}
+
+
+# ---------------------------------------------------------------------------
+# Chạy import
+# ---------------------------------------------------------------------------
+
+class StageReport:
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.read = 0
+        self.written = 0
+        self.errors: List[Tuple[int, str]] = []
+        self.error_count = 0
+        self.seconds = 0.0
+
+    @property
+    def per_second(self) -> Optional[float]:
+        return round(self.read / self.seconds, 1) if self.seconds > 0 else None
+
+    def error(self, line_no: int, message: str, keep: int):
+        self.error_count += 1
+        if len(self.errors) < keep:
+            self.errors.append((line_no, message))
+
+
+def _validated_chunks(rows, parser: Callable, maps: LookupMaps, report: StageReport,
+                      chunk_size: int, keep_errors: int):
+    """Kiểm tra và tra khoá ngoại theo từng chunk; dòng lỗi bị bỏ qua và ghi vào báo cáo."""
+    for chunk in chunked(rows, chunk_size):
+        valid = []
+        for line_no, row in chunk:
+            report.read += 1
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                if not isinstance(row, dict):
+                    raise RowError("mỗi dòng phải là một object")
+                valid.append(parser(row, maps))
+            except RowError as exc:
+                report.error(line_no, str(exc), keep_errors)
+        if valid:
+            yield valid
+
+
+def _close_connections():
+    connections.close_all()
+
+
+def _write_parallel(chunks, workers: int, chunk_size: int, report: StageReport):
+    """
+    Ghi tồn kho song song trên process pool (fork). Dòng được chia vào `workers`
+    làn theo product_id và mỗi làn chỉ có một chunk đang ghi, nên:
+      - cùng (store, variant) luôn ghi theo đúng thứ tự trong file (dòng sau thắng)
+      - hai tiến trình không cùng cập nhật ProductSummary của một sản phẩm
+    Kết nối DB được đóng trước khi fork để tiến trình con tự mở kết nối riêng;
+    bộ nhớ tối đa ~2 x workers x chunk_size dòng dù file lớn đến đâu.
+    """
+    _close_connections()
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_close_connections) as pool:
+        # tạo đủ tiến trình con ngay (khi chưa có kết nối DB nào) rồi mới đọc file
+        pool.submit(int).result()
+        lanes: List[list] = [[] for _ in range(workers)]
+        running: List = [None] * workers
+
+        def flush(lane: int):
+            if running[lane] is not None:
+                report.written += running[lane].result()
+            running[lane] = pool.submit(write_inventory, lanes[lane])
+            lanes[lane] = []
+
+        try:
+            for chunk in chunks:
+                for row in chunk:
+                    lane = row[2] % workers
+                    lanes[lane].append(row)
+                    if len(lanes[lane]) >= chunk_size:
+                        flush(lane)
+            for lane in range(workers):
+                if lanes[lane]:
+                    flush(lane)
+            for lane, future in enumerate(running):
+                if future is not None:
+                    running[lane] = None
+                    report.written += future.result()
+        except BaseException:
+            for future in running:
+                if future is not None:
+                    future.cancel()
+            raise
+
+
+def run_stage(stage: str, path: str, maps: LookupMaps, fmt: Optional[str] = None,
+              chunk_size: int = 5000, workers: int = 1, dry_run: bool = False,
+              keep_errors: int = 100) -> StageReport:
+    report = StageReport(stage)
+    start = time.perf_counter()
+    try:
+        chunks = _validated_chunks(read_rows(path, fmt), PARSERS[stage], maps, report,
+                                   chunk_size, keep_errors)
+        if dry_run:
+            for chunk in chunks:
+                pass
+        elif stage == 'inventory' and workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            _write_parallel(chunks, workers, chunk_size, report)
+        else:
+            writer = {
+                'stores': write_stores,
+                'products': write_products,
+                'variants': write_variants,
+                'inventory': lambda rows, maps: write_inventory(rows),
+            }[stage]
+            for chunk in chunks:
+                report.written += writer(chunk, maps)
+    finally:
+        report.seconds = time.perf_counter() - start
+        if not dry_run and report.written:
+            invalidate_after(stage)
+    return report
+
+
+def invalidate_after(stage: str):
+    """
+    bulk_create / bulk_update không phát signal: tự báo các cache / index
+    trong tiến trình là dữ liệu đã đổi.
+    """
+    bump_generation(SEARCH_GENERATION)
+    if stage == 'stores':
+        # store đổi tỉnh làm đổi tập sản phẩm còn hàng theo tỉnh trong index tìm kiếm
+        bump_generation(STORES_GENERATION)
+        return
+    catalog_cache.invalidate()
+    if stage in ('products', 'variants'):
+        bump_generation(FRAGMENTS_GENERATION)
@@ -0,0 +1,249 @@
+import random
+import threading
+from typing import Dict, Iterable, Tuple
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .cache import bump_generation, get_generation
+from .models import Inventory, InventoryShard
+
+SHARDS_GENERATION = 'inventory_shards'
+
+
+# ---------------------------------------------------------------------------
+# Danh sách (store, variant) đang chia shard, cache trong tiến trình
+# ---------------------------------------------------------------------------
+
+_keys_lock = threading.Lock()
+_sharded_keys = frozenset()
+_sharded_generation = None
+
+
+def get_sharded_keys() -> frozenset:
+    """Tập (store_id, variant_id) đang dùng bộ đếm shard."""
+    global _sharded_keys, _sharded_generation
+    generation = get_generation(SHARDS_GENERATION)
+    if _sharded_generation == generation:
+        return _sharded_keys
+
+    with _keys_lock:
+        if _sharded_generation != generation:
+            _sharded_keys = frozenset(
+                InventoryShard.objects.values_list('store_id', 'variant_id').distinct()
+            )
+            _sharded_generation = generation
+        return _sharded_keys
+
+
+def pairs_q(keys: Iterable[Tuple[int, int]]) -> Q:
+    """Điều kiện OR theo các cặp (store_id, variant_id)."""
+    cond = Q()
+    for store_id, variant_id in keys:
+        cond |= Q(store_id=store_id, variant_id=variant_id)
+    return cond
+
+
+def sharded_stock(keys: Iterable[Tuple[int, int]]) -> Dict[Tuple[int, int], int]:
+    """Tồn kho thật (tổng các shard) của các cặp (store_id, variant_id), 1 truy vấn."""
+    cond = pairs_q(keys)
+    if not cond:
+        return {}
+    rows = (
+        InventoryShard.objects
+        .filter(cond)
+        .values('store_id', 'variant_id')
+        .annotate(total=Sum('quantity'))
+    )
+    return {(r['store_id'], r['variant_id']): r['total'] or 0 for r in rows}
+
+
+def sharded_keys_for(variant_ids: Iterable[int]) -> set:
+    """
+    Các cặp đang chia shard của những variant này: Inventory.quantity của chúng
+    chỉ được đồng bộ định kỳ (sync_sharded_inventory), tồn kho thật phải đọc
+    bằng sharded_stock().
+    """
+    variant_ids = set(variant_ids)
+    return {key for key in get_sharded_keys() if key[1] in variant_ids}
+
+
+# ---------------------------------------------------------------------------
+# Giữ hàng (reservation)
+# ---------------------------------------------------------------------------
+
+def decrement_inventory(lines) -> bool:
+    """
+    Trừ tồn kho cho nhiều dòng (store_id, variant_id, quantity) bằng MỘT câu
+    UPDATE có điều kiện:
+        UPDATE inventory SET quantity = quantity - CASE ... END
+         WHERE (store_id, variant_id) = (...) AND quantity >= n OR ...
+    Trả về False nếu có dòng không đủ hàng (khi đó caller phải rollback
+    transaction, vì các dòng khác đã bị trừ).
+    """
+    if not lines:
+        return True
+
+    cond = Q()
+    whens = []
+    for store_id, variant_id, qty in lines:
+        cond |= Q(store_id=store_id, variant_id=variant_id, quantity__gte=qty)
+        whens.append(When(store_id=store_id, variant_id=variant_id, then=Value(qty)))
+
+    updated = Inventory.objects.filter(cond).update(
+        quantity=F('quantity') - Case(*whens, default=Value(0), output_field=IntegerField())
+    )
+    return updated == len(lines)
+
+
+def _take_from_shards(store_id: int, variant_id: int, qty: int) -> bool:
+    """
+    Trừ `qty` khỏi các shard của một cặp (store, variant).
+    Đọc số lượng các shard trước (không khoá) để chọn cách trừ:
+    1. Có shard đủ một mình: trừ trọn trên MỘT shard chọn ngẫu nhiên trong số
+       đó (các giao dịch song song rải đều trên nhiều dòng). Nếu shard vừa bị
+       giao dịch khác trừ hụt thì trả về False luôn: UPDATE hụt vẫn giữ khoá
+       dòng (InnoDB không nhả khoá khi rollback savepoint), khoá thêm shard
+       khác trong cùng transaction có thể khoá chéo. Caller rollback (nhả
+       khoá) rồi thử lại / phân bổ lại như khi thiếu hàng.
+    2. Không shard nào đủ một mình: khoá mọi shard theo thứ tự `shard`
+       (SELECT ... FOR UPDATE là thao tác khoá đầu tiên trên các shard) rồi gom
+       dần. Mọi giao dịch đều khoá shard theo thứ tự tăng dần -> không deadlock.
+    """
+    shards = InventoryShard.objects.filter(store_id=store_id, variant_id=variant_id)
+    snapshot = dict(shards.values_list('shard', 'quantity'))
+    if not snapshot or sum(snapshot.values()) < qty:
+        return False
+
+    candidates = [k for k, available in snapshot.items() if available >= qty]
+    if candidates:
+        k = random.choice(candidates)
+        return bool(shards.filter(shard=k, quantity__gte=qty).update(quantity=F('quantity') - qty))
+
+    locked = list(shards.select_for_update().filter(quantity__gt=0).order_by('shard'))
+    if sum(s.quantity for s in locked) < qty:
+        return False
+    remaining = qty
+    for s in locked:
+        take = min(s.quantity, remaining)
+        shards.filter(pk=s.pk).update(quantity=F('quantity') - take)
+        remaining -= take
+        if not remaining:
+            break
+    return True
+
+
+def reserve_stock(lines) -> bool:
+    """
+    Giữ (trừ) tồn kho cho các dòng (store_id, variant_id, quantity) của một đơn.
+    Phải gọi trong transaction.atomic(); trả về False nếu thiếu hàng, khi đó
+    caller rollback.
+
+    - Các dòng được xử lý theo thứ tự (store_id, variant_id) cố định, nên hai
+      đơn tranh cùng các dòng Inventory luôn khoá theo cùng thứ tự -> không
+      deadlock.
+    - Dòng thường: khoá đúng các dòng cần (SELECT ... FOR UPDATE ORDER BY)
+      rồi trừ bằng một UPDATE có điều kiện `quantity >= n` -> không oversell.
+    - Dòng "hot" đã chia shard: trừ trên shard, không chạm vào dòng Inventory.
+    """
+    merged = {}
+    for store_id, variant_id, qty in lines:
+        merged[(store_id, variant_id)] = merged.get((store_id, variant_id), 0) + qty
+    ordered = sorted(merged.items())
+
+    hot = get_sharded_keys()
+    plain = [(sid, vid, qty) for (sid, vid), qty in ordered if (sid, vid) not in hot]
+    sharded = [(sid, vid, qty) for (sid, vid), qty in ordered if (sid, vid) in hot]
+
+    if plain:
+        cond = Q()
+        for store_id, variant_id, _ in plain:
+            cond |= Q(store_id=store_id, variant_id=variant_id)
+        list(
+            Inventory.objects.select_for_update()
+            .filter(cond)
+            .order_by('store_id', 'variant_id')
+            .values_list('id', flat=True)
+        )
+        if not decrement_inventory(plain):
+            return False
+
+    for store_id, variant_id, qty in sharded:
+        if not _take_from_shards(store_id, variant_id, qty):
+            return False
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Quản lý shard
+# ---------------------------------------------------------------------------
+
+def enable_sharding(store_id: int, variant_id: int, shards: int) -> int:
+    """
+    Chia tồn kho của một cặp (store, variant) thành `shards` bộ đếm đều nhau.
+    Gọi lại trên cặp đã chia shard để cân bằng lại / đổi số shard.
+    Trả về tổng tồn kho sau khi chia.
+    """
+    if shards < 1:
+        raise ValueError("shards phải >= 1")
+
+    with transaction.atomic():
+        inv = Inventory.objects.select_for_update().get(store_id=store_id, variant_id=variant_id)
+        existing = InventoryShard.objects.select_for_update().filter(
+            store_id=store_id, variant_id=variant_id
+        ).order_by('shard')
+        rows = list(existing)
+        total = sum(s.quantity for s in rows) if rows else inv.quantity
+        existing.delete()
+
+        base, extra = divmod(max(total, 0), shards)
+        InventoryShard.objects.bulk_create([
+            InventoryShard(
+                store_id=store_id, variant_id=variant_id, shard=k,
+                quantity=base + (1 if k < extra else 0)
+            )
+            for k in range(shards)
+        ])
+        inv.quantity = total
+        inv.save(update_fields=['quantity'])
+
+    bump_generation(SHARDS_GENERATION)
+    return total
+
+
+def disable_sharding(store_id: int, variant_id: int) -> int:
+    """Gộp các shard về lại Inventory.quantity và xoá shard. Trả về tổng tồn kho."""
+    with transaction.atomic():
+        inv = Inventory.objects.select_for_update().get(store_id=store_id, variant_id=variant_id)
+        existing = InventoryShard.objects.select_for_update().filter(
+            store_id=store_id, variant_id=variant_id
+        )
+        rows = list(existing)
+        if rows:
+            inv.quantity = sum(s.quantity for s in rows)
+            inv.save(update_fields=['quantity'])
+            existing.delete()
+
+    bump_generation(SHARDS_GENERATION)
+    return inv.quantity
+
+
+def sync_sharded_inventory() -> int:
+    """
+    Đồng bộ Inventory.quantity = tổng shard cho mọi cặp đang chia shard
+    (một câu UPDATE với subquery). Trả về số dòng đã cập nhật.
+    """
+    shard_total = (
+        InventoryShard.objects
+        .filter(store_id=OuterRef('store_id'), variant_id=OuterRef('variant_id'))
+        .values('store_id', 'variant_id')
+        .annotate(total=Sum('quantity'))
+        .values('total')
+    )
+    keys = get_sharded_keys()
+    if not keys:
+        return 0
+    return Inventory.objects.filter(pairs_q(keys)).update(
+        quantity=Coalesce(Subquery(shard_total), Value(0))
+    )
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import Customer, Voucher
+from app.vouchers import assign_voucher
+
+
+class Command(BaseCommand):
+    help = "Phát một voucher cho nhiều khách hàng (bulk_create theo chunk)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('code', help='Mã voucher')
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('--all', action='store_true', help='Phát cho mọi khách hàng')
+        group.add_argument('--customers', help='Danh sách id khách, cách nhau bởi dấu phẩy')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--allow-duplicates', action='store_true',
+                            help='Không bỏ qua khách đã có voucher này chưa dùng')
+
+    def handle(self, *args, **options):
+        try:
+            voucher = Voucher.objects.get(code=options['code'])
+        except Voucher.DoesNotExist:
+            raise CommandError(f"Không tìm thấy voucher `{options['code']}`")
+
+        if options['all']:
+            customer_ids = (
+                Customer.objects.order_by('id').values_list('id', flat=True)
+                .iterator(chunk_size=options['chunk_size'])
+            )
+        else:
+            try:
+                customer_ids = [int(x) for x in options['customers'].split(',') if x.strip()]
+            except ValueError:
+                raise CommandError("--customers phải là danh sách id")
+
+        start = time.perf_counter()
+        created = assign_voucher(
+            voucher.id, customer_ids,
+            chunk_size=options['chunk_size'],
+            skip_existing=not options['allow_duplicates'],
+        )
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"Đã phát `{voucher.code}` cho {created} khách trong {elapsed:.2f}s "
+            f"({created / elapsed if elapsed else 0:.0f} dòng/giây)"
+        )
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import emails
+from app.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Đo số email dựng được mỗi giây trong một worker (template đã biên dịch, "
+        "có / không có cache đoạn mô tả variant)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=100, help='Số đơn mới nhất dùng để dựng')
+        parser.add_argument('--repeat', type=int, default=5, help='Số vòng dựng toàn bộ các đơn')
+        parser.add_argument('--kind', default=emails.ORDER_CONFIRMATION, choices=sorted(emails.EMAIL_SUBJECTS))
+
+    def handle(self, *args, **options):
+        order_ids = list(Order.objects.order_by('-id').values_list('id', flat=True)[:options['orders']])
+        if not order_ids:
+            raise CommandError("Chưa có đơn hàng nào để dựng email")
+        orders = list(emails.load_orders(order_ids).values())
+        kind = options['kind']
+        repeat = max(options['repeat'], 1)
+
+        # biên dịch template (chỉ tốn ở lần đầu của mỗi tiến trình)
+        emails._compiled.clear()
+        start = time.perf_counter()
+        for suffix in ('txt', 'html'):
+            emails.compiled_template(f'emails/{kind}.{suffix}')
+            emails.compiled_template(f'emails/_variant.{suffix}')
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        def run(clear_fragments):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for order in orders:
+                    if clear_fragments:
+                        emails._fragments.clear()
+                    emails.render_email(kind, order, generation=0)
+            return repeat * len(orders) / (time.perf_counter() - start)
+
+        cold = run(clear_fragments=True)
+        emails._fragments.clear()
+        warm = run(clear_fragments=False)
+
+        self.stdout.write(f"Biên dịch template: {compile_ms:.1f} ms")
+        self.stdout.write(f"{len(orders)} đơn x {repeat} vòng, loại `{kind}`")
+        self.stdout.write(f"  không cache đoạn variant: {cold:>10.1f} email/giây")
+        self.stdout.write(f"  có cache đoạn variant:    {warm:>10.1f} email/giây")
@@ -0,0 +1,85 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app.analytics import add_months, month_start
+from app.retention import ActivityIndex, churn, cohorts, repeat_purchase
+
+
+class Command(BaseCommand):
+    help = (
+        "Đo thời gian tính churn / cohort / tỷ lệ mua lại trên bitmap hoạt động "
+        "với dữ liệu giả lập (không đọc DB)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=2_000_000)
+        parser.add_argument('--months', type=int, default=24)
+        parser.add_argument('--active-rate', type=float, default=0.1,
+                            help='Tỷ lệ khách có mua trong một tháng')
+        parser.add_argument('--multi-rate', type=float, default=0.2,
+                            help='Tỷ lệ khách mua từ 2 đơn trong tháng (trên số khách có mua)')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--compare-sets', action='store_true',
+                            help='Tính churn thêm bằng set Python để so sánh')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        customers = options['customers']
+        last = month_start(timezone.localdate())
+        months = [add_months(last, -k) for k in range(options['months'] - 1, -1, -1)]
+
+        index = ActivityIndex()
+        raw = {}
+        start = time.perf_counter()
+        for month in months:
+            active = np.flatnonzero(rng.random(customers) < options['active_rate']) + 1
+            multi = active[rng.random(active.size) < options['multi_rate']]
+            index.set_month(month, active, multi)
+            if options['compare_sets']:
+                raw[month] = active
+        build = time.perf_counter() - start
+        memory = sum(a.nbytes + m.nbytes for a, m in index.months.values())
+        self.stdout.write(
+            f"{customers:,} khách × {len(months)} tháng: dựng bitmap {build:.2f}s, "
+            f"{memory / 1024 / 1024:.1f}MB"
+        )
+
+        repeat = max(options['repeat'], 1)
+
+        def timed(label, fn):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                result = fn()
+            ms = (time.perf_counter() - start) * 1000 / repeat
+            self.stdout.write(f"  {label:<28} {ms:9.2f} ms")
+            return result
+
+        result = timed('churn 6 tháng', lambda: churn(window_months=6, index=index))
+        self.stdout.write(f"    -> {result['churned_customers']:,}/{result['previous_customers']:,} "
+                          f"({result['churn_rate_percent']}%)")
+        timed('churn 12 tháng', lambda: churn(window_months=12, index=index))
+        timed('cohort 12 tháng', lambda: cohorts(add_months(last, -11), 12, index=index))
+        result = timed('mua lại 12 tháng', lambda: repeat_purchase(add_months(last, -11), last, index=index))
+        self.stdout.write(f"    -> {result['repeat_customers']:,}/{result['customers']:,} "
+                          f"({result['repeat_rate_percent']}%)")
+
+        if options['compare_sets']:
+            recent = set(months[-6:])
+            previous = set(months[-12:-6])
+
+            def with_sets():
+                prev_ids = set()
+                recent_ids = set()
+                for month, ids in raw.items():
+                    if month in previous:
+                        prev_ids.update(ids.tolist())
+                    elif month in recent:
+                        recent_ids.update(ids.tolist())
+                return len(prev_ids - recent_ids), len(prev_ids)
+
+            churned, total = timed('churn 6 tháng (set Python)', with_sets)
+            self.stdout.write(f"    -> {churned:,}/{total:,}")
@@ -0,0 +1,118 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from app.models import Inventory, Product, ProductVariant, Store
+from app.services import build_coverage_matrix, covered_variants
+
+
+class _Rollback(Exception):
+    pass
+
+
+def legacy_store_cover(items_data):
+    """
+    Cách cũ: mỗi cặp (store, item) một truy vấn `.exists()`.
+    Giữ lại ở đây chỉ để so sánh trong benchmark.
+    """
+    store_cover = {}
+    for store in Store.objects.all():
+        covered = set()
+        for item in items_data:
+            if Inventory.objects.filter(
+                store=store,
+                variant=item['variant'],
+                quantity__gte=item['quantity']
+            ).exists():
+                covered.add(item['variant'].id)
+        if covered:
+            store_cover[store.id] = covered
+    return store_cover
+
+
+def matrix_store_cover(items_data):
+    demand, stores, stock = build_coverage_matrix(items_data)
+    store_cover = {}
+    for store_id, row in stock.items():
+        covered = covered_variants(row, demand)
+        if covered:
+            store_cover[store_id] = covered
+    return store_cover
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark số truy vấn và độ trễ khi dựng độ phủ tồn kho cho một giỏ hàng "
+        "theo số lượng store (dữ liệu giả lập, rollback sau khi chạy)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stores', default='10,50,100,300',
+                            help='Danh sách số store, cách nhau bởi dấu phẩy')
+        parser.add_argument('--items', type=int, default=6, help='Số dòng trong giỏ hàng')
+        parser.add_argument('--repeat', type=int, default=3, help='Số lần lặp mỗi phép đo')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        counts = [int(x) for x in options['stores'].split(',') if x.strip()]
+        rnd = random.Random(options['seed'])
+
+        self.stdout.write(
+            f"{'stores':>7} | {'legacy q':>9} {'legacy ms':>10} | {'matrix q':>9} {'matrix ms':>10}"
+        )
+        for n_stores in counts:
+            try:
+                with transaction.atomic():
+                    items = self._seed(n_stores, options['items'], rnd)
+                    legacy = self._measure(legacy_store_cover, items, options['repeat'])
+                    matrix = self._measure(matrix_store_cover, items, options['repeat'])
+                    if legacy[2] != matrix[2]:
+                        self.stderr.write(self.style.ERROR(
+                            f"Kết quả độ phủ khác nhau với {n_stores} store"
+                        ))
+                    raise _Rollback
+            except _Rollback:
+                pass
+            self.stdout.write(
+                f"{n_stores:>7} | {legacy[0]:>9} {legacy[1]:>10.2f} | {matrix[0]:>9} {matrix[1]:>10.2f}"
+            )
+
+    def _seed(self, n_stores, n_items, rnd):
+        product = Product.objects.create(name='bench-coverage')
+        ProductVariant.objects.bulk_create([
+            ProductVariant(product=product, color=f'c{i}', size='M', price=Decimal('100000'))
+            for i in range(n_items)
+        ])
+        # MySQL không trả pk sau bulk_create nên nạp lại từ DB
+        variants = list(ProductVariant.objects.filter(product=product).order_by('id'))
+        Store.objects.bulk_create([
+            Store(
+                name=f'bench-{i}',
+                latitude=Decimal(str(round(rnd.uniform(8.5, 23.0), 6))),
+                longitude=Decimal(str(round(rnd.uniform(102.0, 109.5), 6))),
+            )
+            for i in range(n_stores)
+        ])
+        stores = list(Store.objects.filter(name__startswith='bench-').order_by('id'))
+        Inventory.objects.bulk_create([
+            Inventory(store=s, variant=v, quantity=rnd.randint(0, 5))
+            for s in stores for v in variants
+        ], batch_size=1000)
+        return [{'variant': v, 'quantity': rnd.randint(1, 3)} for v in variants]
+
+    def _measure(self, fn, items, repeat):
+        best = None
+        result = None
+        n_queries = 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                result = fn(items)
+                elapsed = (time.perf_counter() - start) * 1000
+            n_queries = len(ctx.captured_queries)
+            best = elapsed if best is None else min(best, elapsed)
+        return n_queries, best, result
@@ -0,0 +1,36 @@
+import datetime
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import exports
+from app.models import Order
+
+
+def parse_date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Ngày không hợp lệ: {value} (cần YYYY-MM-DD)")
+
+
+class Command(BaseCommand):
+    help = "Xuất đơn hàng (kèm dòng hàng, phí, voucher, thanh toán) ra CSV hoặc NDJSON, ghi dần từng đơn."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default=exports.CSV)
+        parser.add_argument('--output', '-o', help="File đích (mặc định stdout)")
+        parser.add_argument('--from', dest='date_from', type=parse_date)
+        parser.add_argument('--to', dest='date_to', type=parse_date)
+        parser.add_argument('--status', choices=[value for value, _ in Order.STATUS_CHOICES])
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        qs = exports.export_queryset(options['date_from'], options['date_to'], options['status'])
+        out = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        try:
+            for chunk in exports.stream_orders(options['format'], qs, options['chunk_size']):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
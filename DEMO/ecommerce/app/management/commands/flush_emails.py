@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from app.emails import ORDER_CONFIRMATION, flush_email_jobs
+from app.models import EmailJob, Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Gửi các email đang chờ theo lô và in thông lượng từng lô; "
+        "--requeue-orders N để xếp lại email xác nhận của N đơn mới nhất (đo thử)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--requeue-orders', type=int, default=0,
+                            help='Xếp email xác nhận cho N đơn mới nhất trước khi gửi')
+
+    def handle(self, *args, **options):
+        n = options['requeue_orders']
+        if n:
+            order_ids = Order.objects.order_by('-id').values_list('id', flat=True)[:n]
+            EmailJob.objects.bulk_create([
+                EmailJob(kind=ORDER_CONFIRMATION, order_id=oid) for oid in order_ids
+            ])
+
+        results = flush_email_jobs(options['batch_size'])
+        if not results:
+            self.stdout.write("Không có email nào đến hạn gửi.")
+            return
+
+        self.stdout.write(f"{'lô':>4} {'nhận':>6} {'gửi':>6} {'hẹn lại':>8} {'lỗi':>5} {'giây':>8} {'thư/giây':>9}")
+        for i, s in enumerate(results, start=1):
+            self.stdout.write(
+                f"{i:>4} {s['claimed']:>6} {s['sent']:>6} {s['retry']:>8} {s['failed']:>5} "
+                f"{s['seconds']:>8.3f} {s['per_second'] or 0:>9.1f}"
+            )
+        self.stdout.write(
+            f"Tổng: {sum(s['sent'] for s in results)} gửi, "
+            f"{sum(s['retry'] for s in results)} hẹn lại, {sum(s['failed'] for s in results)} lỗi"
+        )
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app import importer
+
+
+class Command(BaseCommand):
+    help = (
+        "Nạp store / sản phẩm / variant / tồn kho từ file CSV hoặc NDJSON (feed nhà cung cấp). "
+        "Mỗi chunk một transaction và upsert theo khoá tự nhiên nên chạy lại được an toàn. "
+        "Bước inventory chạy song song với --workers > 1 (nên dùng với MySQL/PostgreSQL)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stores', help="name, location, latitude, longitude")
+        parser.add_argument('--products', help="name, description, categories (tên category, ngăn bởi |)")
+        parser.add_argument('--variants', help="product_id | product, color, size, price")
+        parser.add_argument('--inventory', help="store_id | store, variant_id | (product_id | product, color, size), quantity")
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help="Mặc định đoán theo đuôi file (.ndjson/.jsonl/.json, còn lại là CSV)")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=1, help="Số tiến trình ghi tồn kho song song")
+        parser.add_argument('--max-errors', type=int, default=1000,
+                            help="Dừng (lỗi) nếu một bước có nhiều dòng lỗi hơn số này")
+        parser.add_argument('--dry-run', action='store_true', help="Chỉ kiểm tra dữ liệu, không ghi")
+
+    def handle(self, *args, **options):
+        stages = [stage for stage in importer.STAGES if options[stage]]
+        if not stages:
+            raise CommandError("Cần ít nhất một file: --stores / --products / --variants / --inventory")
+        if options['chunk_size'] < 1 or options['workers'] < 1:
+            raise CommandError("--chunk-size và --workers phải >= 1")
+
+        maps = importer.LookupMaps().load(stages)
+        for stage in stages:
+            report = importer.run_stage(
+                stage, options[stage], maps,
+                fmt=options['format'],
+                chunk_size=options['chunk_size'],
+                workers=options['workers'],
+                dry_run=options['dry_run'],
+                keep_errors=20,
+            )
+            self.stdout.write(
+                f"{stage}: đọc {report.read} dòng, ghi {report.written}, lỗi {report.error_count} "
+                f"trong {report.seconds:.2f}s ({report.per_second} dòng/giây)"
+            )
+            for line_no, message in report.errors:
+                self.stderr.write(f"  {options[stage]}:{line_no}: {message}")
+            if report.error_count > options['max_errors']:
+                raise CommandError(f"{stage}: quá nhiều dòng lỗi ({report.error_count}), dừng import")
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.availability import rebuild_availability
+
+
+class Command(BaseCommand):
+    help = "Dựng lại bảng regional_availability (tồn kho còn hàng theo variant và tỉnh) từ inventory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        done = rebuild_availability(batch_size=options['batch_size'])
+        self.stdout.write(f"Đã ghi {done} dòng (variant, tỉnh) còn hàng trong {time.perf_counter() - start:.2f}s")
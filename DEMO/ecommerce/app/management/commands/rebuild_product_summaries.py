@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.summaries import rebuild_product_summaries
+
+
+class Command(BaseCommand):
+    help = "Dựng lại bảng product_summaries (giá min/max, tồn kho) cho toàn bộ sản phẩm."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        done = rebuild_product_summaries(batch_size=options['batch_size'])
+        self.stdout.write(f"Đã cập nhật {done} sản phẩm trong {time.perf_counter() - start:.2f}s")
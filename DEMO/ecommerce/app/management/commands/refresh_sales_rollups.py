@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.analytics import refresh_sales_rollups
+
+
+class Command(BaseCommand):
+    help = "Tổng hợp doanh số (sales_rollups) cho các đơn mới / đổi trạng thái kể từ watermark."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Bỏ watermark, tính lại toàn bộ lịch sử")
+
+    def handle(self, *args, **options):
+        stats = refresh_sales_rollups(rebuild=options['rebuild'])
+        if stats is None:
+            raise CommandError("Đang có tiến trình khác tổng hợp doanh số")
+        self.stdout.write(
+            f"Đã xử lý {stats['orders']} đơn, {stats['days']} ngày, "
+            f"ghi {stats['rows']} dòng rollup trong {stats['seconds']:.2f}s"
+        )
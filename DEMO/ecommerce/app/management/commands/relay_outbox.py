@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from app.outbox import relay_outbox, run_relay
+
+
+class Command(BaseCommand):
+    help = (
+        "Đẩy các task trong outbox lên broker Celery theo lô. "
+        "--loop để chạy như tiến trình relay thường trực."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Chạy liên tục (thoát bằng Ctrl+C)')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help='Chu kỳ quét khi không có tín hiệu wake (giây)')
+
+    def report(self, results):
+        for stats in results:
+            self.stdout.write(
+                f"lô {stats['claimed']} message: {stats['sent']} gửi, {stats['retry']} hẹn lại, "
+                f"{stats['failed']} lỗi trong {stats['seconds']:.3f}s"
+            )
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            results = relay_outbox(options['batch_size'])
+            self.report(results)
+            if not results:
+                self.stdout.write("Outbox trống.")
+            return
+
+        try:
+            for results in run_relay(options['poll_interval'], options['batch_size']):
+                self.report(results)
+        except KeyboardInterrupt:
+            self.stdout.write("Dừng relay.")
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from app.models import Product
+from app.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Dựng lại inverted index tìm kiếm sản phẩm (mọi worker sẽ dựng lại ở request kế tiếp); "
+        "tuỳ chọn benchmark so với cách tìm icontains cũ."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--benchmark', default='',
+                            help='Các từ khoá cần đo, cách nhau bởi dấu phẩy (vd "giay,nike air")')
+        parser.add_argument('--repeat', type=int, default=20, help='Số lần lặp mỗi từ khoá')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        index = rebuild_index()
+        elapsed = (time.perf_counter() - start) * 1000
+        self.stdout.write(
+            f"Đã dựng index: {len(index)} sản phẩm, {len(index.postings)} term, {elapsed:.1f} ms"
+        )
+
+        queries = [q.strip() for q in options['benchmark'].split(',') if q.strip()]
+        if not queries:
+            return
+
+        repeat = max(options['repeat'], 1)
+        self.stdout.write(
+            f"{'query':<20} | {'icontains':>9} {'ms':>8} | {'index':>7} {'ms':>8}"
+        )
+        for q in queries:
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                legacy = list(
+                    Product.objects.filter(Q(name__icontains=q) | Q(description__icontains=q))
+                    .values_list('id', flat=True)
+                )
+            legacy_ms = (time.perf_counter() - t0) * 1000 / repeat
+
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                ranked = index.search(q)
+            index_ms = (time.perf_counter() - t0) * 1000 / repeat
+
+            self.stdout.write(
+                f"{q[:20]:<20} | {len(legacy):>9} {legacy_ms:>8.3f} | {len(ranked):>7} {index_ms:>8.3f}"
+            )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.inventory import disable_sharding, enable_sharding
+from app.models import Inventory
+
+
+class Command(BaseCommand):
+    help = "Bật/tắt bộ đếm tồn kho chia shard cho một cặp (store, variant) bán chạy."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store', type=int, required=True)
+        parser.add_argument('--variant', type=int, required=True)
+        parser.add_argument('--shards', type=int, default=8, help='Số shard (mặc định 8)')
+        parser.add_argument('--disable', action='store_true', help='Gộp shard về Inventory')
+
+    def handle(self, *args, **options):
+        try:
+            if options['disable']:
+                total = disable_sharding(options['store'], options['variant'])
+                self.stdout.write(f"Đã gộp shard, tồn kho = {total}")
+            else:
+                total = enable_sharding(options['store'], options['variant'], options['shards'])
+                self.stdout.write(f"Đã chia {options['shards']} shard, tồn kho = {total}")
+        except Inventory.DoesNotExist:
+            raise CommandError("Không có dòng tồn kho cho cặp store/variant này")
+        except ValueError as exc:
+            raise CommandError(str(exc))
@@ -0,0 +1,115 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+from django.db.models import Sum
+
+from app.inventory import disable_sharding, enable_sharding, reserve_stock
+from app.models import Inventory, InventoryShard, Product, ProductVariant, Store
+
+
+class Command(BaseCommand):
+    help = (
+        "Stress test giữ hàng song song trên một SKU: kiểm tra không oversell và "
+        "đo throughput theo số writer. Tạo dữ liệu tạm (đã commit) và xoá khi xong."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', default='1,2,4,8',
+                            help='Danh sách số writer song song, cách nhau bởi dấu phẩy')
+        parser.add_argument('--stock', type=int, default=500, help='Tồn kho ban đầu')
+        parser.add_argument('--qty', type=int, default=1, help='Số lượng mỗi đơn')
+        parser.add_argument('--shards', type=int, default=0,
+                            help='Số shard cho SKU (0 = không chia shard)')
+
+    def handle(self, *args, **options):
+        writers = [int(x) for x in options['writers'].split(',') if x.strip()]
+        stock, qty, shards = options['stock'], options['qty'], options['shards']
+        if qty <= 0 or stock <= 0:
+            raise CommandError("--stock và --qty phải > 0")
+
+        store = Store.objects.create(name='stress-inventory')
+        product = Product.objects.create(name='stress-inventory')
+        variant = ProductVariant.objects.create(product=product, color='-', size='-', price=Decimal('1'))
+        inv = Inventory.objects.create(store=store, variant=variant, quantity=stock)
+
+        self.stdout.write(
+            f"{'writers':>7} | {'orders':>6} {'sold':>6} {'left':>6} {'retries':>7} | "
+            f"{'orders/s':>9} | check"
+        )
+        failed = False
+        try:
+            for n in writers:
+                if shards:
+                    disable_sharding(store.id, variant.id)
+                Inventory.objects.filter(pk=inv.pk).update(quantity=stock)
+                if shards:
+                    enable_sharding(store.id, variant.id, shards)
+
+                orders, retries, elapsed = self._run(n, inv, qty, shards)
+                left = self._stock_left(inv, shards)
+                sold = orders * qty
+                ok = left >= 0 and sold + left == stock and sold <= stock
+                failed = failed or not ok
+                self.stdout.write(
+                    f"{n:>7} | {orders:>6} {sold:>6} {left:>6} {retries:>7} | "
+                    f"{orders / elapsed if elapsed else 0:>9.1f} | {'OK' if ok else 'OVERSOLD'}"
+                )
+        finally:
+            product.delete()
+            store.delete()
+
+        if failed:
+            raise CommandError("Phát hiện oversell hoặc lệch tồn kho")
+
+    def _stock_left(self, inv, shards):
+        if shards:
+            return InventoryShard.objects.filter(
+                store_id=inv.store_id, variant_id=inv.variant_id
+            ).aggregate(total=Sum('quantity'))['total'] or 0
+        return Inventory.objects.get(pk=inv.pk).quantity
+
+    def _run(self, n_writers, inv, qty, shards):
+        store_id, variant_id = inv.store_id, inv.variant_id
+        counts = {'orders': 0, 'retries': 0}
+        lock = threading.Lock()
+        barrier = threading.Barrier(n_writers + 1)
+
+        def writer():
+            orders = retries = 0
+            try:
+                barrier.wait()
+                while True:
+                    try:
+                        with transaction.atomic():
+                            ok = reserve_stock([(store_id, variant_id, qty)])
+                            if not ok:
+                                transaction.set_rollback(True)
+                    except OperationalError:
+                        # lock timeout / deadlock / database is locked: thử lại
+                        retries += 1
+                        continue
+                    if not ok:
+                        # shard vừa bị trừ hụt (nhánh nhanh trả False): còn hàng thì thử lại
+                        if shards and self._stock_left(inv, shards) >= qty:
+                            retries += 1
+                            continue
+                        break
+                    orders += 1
+            finally:
+                with lock:
+                    counts['orders'] += orders
+                    counts['retries'] += retries
+                connection.close()
+
+        threads = [threading.Thread(target=writer) for _ in range(n_writers)]
+        for t in threads:
+            t.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        return counts['orders'], counts['retries'], elapsed
@@ -0,0 +1,146 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+
+from app.models import Account, Customer, UserVoucher, Voucher
+from app.vouchers import assign_voucher, claim_user_voucher
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test dùng voucher song song: (1) nhiều luồng tranh cùng một UserVoucher — "
+        "mỗi lượt chỉ được đúng 1 luồng thắng; (2) voucher chiến dịch phát cho nhiều khách, "
+        "các luồng cùng dùng — đo throughput. Tạo dữ liệu tạm (đã commit) và xoá khi xong."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--redeemers', default='1,2,4,8',
+                            help='Danh sách số luồng song song, cách nhau bởi dấu phẩy')
+        parser.add_argument('--rounds', type=int, default=50, help='Số lượt tranh một UserVoucher')
+        parser.add_argument('--customers', type=int, default=2000,
+                            help='Số khách nhận voucher chiến dịch')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        redeemers = [int(x) for x in options['redeemers'].split(',') if x.strip()]
+        n_customers = options['customers']
+        if n_customers <= 0 or options['rounds'] <= 0:
+            raise CommandError("--customers và --rounds phải > 0")
+
+        tag = uuid.uuid4().hex[:8]
+        voucher = Voucher.objects.create(code=f'STRESS-{tag}', voucher_type='discount')
+        Account.objects.bulk_create([
+            Account(email=f'stress-{tag}-{i}@example.com', password_hash='-', role='customer')
+            for i in range(n_customers)
+        ], batch_size=options['chunk_size'])
+        accounts = list(Account.objects.filter(email__startswith=f'stress-{tag}-').values_list('id', flat=True))
+        Customer.objects.bulk_create([
+            Customer(account_id=aid, full_name='stress', phone=f'st{tag}{i}')
+            for i, aid in enumerate(accounts)
+        ], batch_size=options['chunk_size'])
+        customer_ids = list(Customer.objects.filter(account_id__in=accounts).order_by('id').values_list('id', flat=True))
+
+        failed = False
+        try:
+            # 1. Tranh cùng một UserVoucher
+            self.stdout.write("Tranh một UserVoucher:")
+            self.stdout.write(f"{'luồng':>7} | {'lượt':>5} {'thắng':>6} {'lỗi':>5} | check")
+            for n in redeemers:
+                wins, errors = self._race(n, options['rounds'], voucher.id, customer_ids[0])
+                ok = wins == options['rounds']
+                failed = failed or not ok
+                self.stdout.write(
+                    f"{n:>7} | {options['rounds']:>5} {wins:>6} {errors:>5} | "
+                    f"{'OK' if ok else 'DOUBLE-REDEEMED'}"
+                )
+
+            # 2. Voucher chiến dịch
+            self.stdout.write("Voucher chiến dịch:")
+            self.stdout.write(f"{'luồng':>7} | {'phát/s':>8} | {'dùng':>6} {'dùng/s':>8} | check")
+            for n in redeemers:
+                UserVoucher.objects.filter(voucher=voucher).delete()
+                start = time.perf_counter()
+                assign_voucher(voucher.id, customer_ids, chunk_size=options['chunk_size'])
+                assign_rate = n_customers / (time.perf_counter() - start)
+
+                redeemed, elapsed = self._campaign(n, voucher.id, customer_ids)
+                used = UserVoucher.objects.filter(voucher=voucher, used=True).count()
+                ok = redeemed == used == n_customers
+                failed = failed or not ok
+                self.stdout.write(
+                    f"{n:>7} | {assign_rate:>8.0f} | {redeemed:>6} {redeemed / elapsed if elapsed else 0:>8.1f} | "
+                    f"{'OK' if ok else 'MISMATCH'}"
+                )
+        finally:
+            voucher.delete()
+            Account.objects.filter(id__in=accounts).delete()
+
+        if failed:
+            raise CommandError("Voucher bị dùng nhiều lần hoặc số lượt dùng bị lệch")
+
+    def _threads(self, n, target):
+        barrier = threading.Barrier(n + 1)
+
+        def run(i):
+            try:
+                barrier.wait()
+                target(i)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+        for t in threads:
+            t.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - start
+
+    def _claim(self, customer_id, voucher_id):
+        while True:
+            try:
+                with transaction.atomic():
+                    return claim_user_voucher(customer_id, voucher_id)
+            except OperationalError:
+                # lock timeout / database is locked: thử lại
+                continue
+
+    def _race(self, n, rounds, voucher_id, customer_id):
+        wins = errors = 0
+        for _ in range(rounds):
+            UserVoucher.objects.filter(user_id=customer_id, voucher_id=voucher_id).delete()
+            UserVoucher.objects.create(user_id=customer_id, voucher_id=voucher_id)
+            results = []
+            lock = threading.Lock()
+
+            def target(i):
+                try:
+                    won = self._claim(customer_id, voucher_id) is not None
+                except Exception:
+                    won = None
+                with lock:
+                    results.append(won)
+
+            self._threads(n, target)
+            wins += sum(1 for r in results if r)
+            errors += sum(1 for r in results if r is None)
+        return wins, errors
+
+    def _campaign(self, n, voucher_id, customer_ids):
+        counts = {'redeemed': 0}
+        lock = threading.Lock()
+
+        def target(i):
+            done = 0
+            for cid in customer_ids[i::n]:
+                if self._claim(cid, voucher_id) is not None:
+                    done += 1
+            with lock:
+                counts['redeemed'] += done
+
+        elapsed = self._threads(n, target)
+        return counts['redeemed'], elapsed
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_orderitem_store'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.store')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.productvariant')),
+            ],
+            options={
+                'db_table': 'inventory_shards',
+                'unique_together': {('store', 'variant', 'shard')},
+            },
+        ),
+    ]
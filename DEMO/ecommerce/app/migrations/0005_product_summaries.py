@@ -0,0 +1,50 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def populate_summaries(apps, schema_editor):
+    Product = apps.get_model('app', 'Product')
+    ProductVariant = apps.get_model('app', 'ProductVariant')
+    Inventory = apps.get_model('app', 'Inventory')
+    ProductSummary = apps.get_model('app', 'ProductSummary')
+
+    summaries = {pid: ProductSummary(product_id=pid) for pid in Product.objects.values_list('id', flat=True)}
+    for r in ProductVariant.objects.values('product_id').annotate(pmin=Min('price'), pmax=Max('price'), n=Count('id')):
+        s = summaries[r['product_id']]
+        s.min_price, s.max_price, s.variant_count = r['pmin'], r['pmax'], r['n']
+    for r in (Inventory.objects.filter(quantity__gt=0)
+              .values('variant__product_id').annotate(total=Sum('quantity'))):
+        s = summaries[r['variant__product_id']]
+        s.total_stock = r['total'] or 0
+        s.in_stock = s.total_stock > 0
+    ProductSummary.objects.bulk_create(summaries.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_inventory_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSummary',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='app.product')),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('total_stock', models.IntegerField(default=0)),
+                ('in_stock', models.BooleanField(default=False)),
+                ('variant_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'product_summaries',
+                'indexes': [models.Index(fields=['min_price'], name='idx_summary_min_price'), models.Index(fields=['max_price'], name='idx_summary_max_price'), models.Index(fields=['in_stock', 'min_price'], name='idx_summary_stock_price')],
+            },
+        ),
+        migrations.RunPython(populate_summaries, migrations.RunPython.noop),
+    ]
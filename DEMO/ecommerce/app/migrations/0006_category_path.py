@@ -0,0 +1,45 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:31
+
+from django.db import migrations, models
+
+
+def populate_paths(apps, schema_editor):
+    Category = apps.get_model('app', 'Category')
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+
+    def chain(cid):
+        ids = []
+        seen = set()
+        while cid is not None and cid not in seen:
+            seen.add(cid)
+            ids.append(cid)
+            cid = parents.get(cid)
+        return list(reversed(ids))
+
+    for cid in parents:
+        ids = chain(cid)
+        Category.objects.filter(id=cid).update(
+            path='/' + '/'.join(str(i) for i in ids) + '/',
+            depth=len(ids) - 1,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_product_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
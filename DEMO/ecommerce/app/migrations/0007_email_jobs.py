@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:34
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_category_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailJob',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('order_confirmation', 'order_confirmation')], max_length=30)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('sending', 'sending'), ('sent', 'sent'), ('failed', 'failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('batch_id', models.CharField(blank=True, default='', max_length=32)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.order')),
+            ],
+            options={
+                'db_table': 'email_jobs',
+                'indexes': [models.Index(fields=['status', 'available_at'], name='idx_email_jobs_status'), models.Index(fields=['batch_id'], name='idx_email_jobs_batch')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_email_jobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='emailjob',
+            name='kind',
+            field=models.CharField(choices=[('order_confirmation', 'order_confirmation'), ('order_shipped', 'order_shipped'), ('order_cancelled', 'order_cancelled')], max_length=30),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:40
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckoutIntent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('token', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('payload', models.JSONField()),
+                ('plan', models.JSONField(blank=True, null=True)),
+                ('stage', models.CharField(choices=[('received', 'received'), ('allocated', 'allocated'), ('completed', 'completed')], default='received', max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('processing', 'processing'), ('completed', 'completed'), ('failed', 'failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('reallocations', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.customer')),
+                ('order', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='checkout_intent', to='app.order')),
+            ],
+            options={
+                'db_table': 'checkout_intents',
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_checkout_intents'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='uservoucher',
+            index=models.Index(fields=['user', 'voucher', 'used'], name='idx_user_vouchers_lookup'),
+        ),
+    ]
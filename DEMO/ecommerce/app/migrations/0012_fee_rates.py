@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_user_voucher_lookup_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeeRate',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('max_distance_km', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True)),
+                ('min_quantity', models.PositiveIntegerField(default=1)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('district', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='app.district')),
+                ('fee_type', models.ForeignKey(db_column='fee_type', on_delete=django.db.models.deletion.CASCADE, related_name='rates', to='app.feetype')),
+                ('province', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='app.province')),
+            ],
+            options={
+                'db_table': 'fee_rates',
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_fee_rates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'rollup_watermarks',
+            },
+        ),
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('period', models.CharField(choices=[('day', 'day'), ('month', 'month')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('dimension', models.CharField(choices=[('all', 'all'), ('customer', 'customer'), ('store', 'store'), ('category', 'category')], max_length=10)),
+                ('dimension_id', models.IntegerField(default=0)),
+                ('orders_count', models.PositiveIntegerField(default=0)),
+                ('items_quantity', models.PositiveIntegerField(default=0)),
+                ('goods_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'db_table': 'sales_rollups',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='idx_orders_created_at'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated_at'], name='idx_orders_updated_at'),
+        ),
+        migrations.AddIndex(
+            model_name='salesrollup',
+            index=models.Index(fields=['dimension', 'dimension_id', 'period', 'period_start'], name='idx_sales_rollups_member'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='salesrollup',
+            unique_together={('period', 'dimension', 'period_start', 'dimension_id')},
+        ),
+    ]
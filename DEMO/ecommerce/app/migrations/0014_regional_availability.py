@@ -0,0 +1,91 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:57
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+PREFIXES = (('thanh', 'pho'), ('tp',), ('tinh',))
+
+
+def tokens(text):
+    text = unicodedata.normalize('NFD', text or '')
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    return tuple(re.findall(r'\w+', text.replace('đ', 'd').replace('Đ', 'D').lower()))
+
+
+def province_key(name):
+    key = tokens(name)
+    for prefix in PREFIXES:
+        if key[:len(prefix)] == prefix and len(key) > len(prefix):
+            return key[len(prefix):]
+    return key
+
+
+def populate_regions(apps, schema_editor):
+    Province = apps.get_model('app', 'Province')
+    Store = apps.get_model('app', 'Store')
+    Inventory = apps.get_model('app', 'Inventory')
+    RegionalAvailability = apps.get_model('app', 'RegionalAvailability')
+
+    keys = {province_key(name): pid for pid, name in Province.objects.values_list('id', 'name')}
+    for store_id, location in Store.objects.values_list('id', 'location'):
+        words = tokens(location)
+        best = None
+        for key, pid in keys.items():
+            for pos in range(len(words) - len(key) + 1):
+                if key and words[pos:pos + len(key)] == key:
+                    if best is None or (-len(key), pos) < best[0]:
+                        best = ((-len(key), pos), pid)
+                    break
+        if best:
+            Store.objects.filter(id=store_id).update(province_id=best[1])
+
+    rows = (
+        Inventory.objects
+        .filter(quantity__gt=0, store__province__isnull=False)
+        .values('variant_id', 'variant__product_id', 'store__province_id')
+        .annotate(total=Sum('quantity'), stores=Count('store_id'))
+        .order_by()
+    )
+    RegionalAvailability.objects.bulk_create([
+        RegionalAvailability(
+            variant_id=r['variant_id'], province_id=r['store__province_id'],
+            product_id=r['variant__product_id'], quantity=r['total'], store_count=r['stores'],
+        )
+        for r in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='province',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='app.province'),
+        ),
+        migrations.CreateModel(
+            name='RegionalAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(default=0)),
+                ('store_count', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.product')),
+                ('province', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.province')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.productvariant')),
+            ],
+            options={
+                'db_table': 'regional_availability',
+                'indexes': [models.Index(fields=['province', 'product'], name='idx_regional_avail_product')],
+                'unique_together': {('variant', 'province')},
+            },
+        ),
+        migrations.RunPython(populate_regions, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,7 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
 
 class Province(models.Model):
     id = models.AutoField(primary_key=True)
@@ -83,21 +86,34 @@ class Store(models.Model):
     id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=150)
     location = models.CharField(max_length=255, null=True, blank=True)
+    # Tỉnh/thành của store, tự suy ra từ `location` khi lưu (app/availability.py)
+    province = models.ForeignKey(Province, null=True, blank=True, on_delete=models.SET_NULL)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
 
     class Meta:
         db_table = 'stores'
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='idx_stores_lat_lon'),
+        ]
 
 class Category(models.Model):
     id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(null=True, blank=True)
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL)
+    # Đường dẫn vật chất hoá từ gốc, vd "/1/5/12/" (duy trì bởi app/categories.py):
+    # cây con của category X = mọi category có path bắt đầu bằng X.path
+    path = models.CharField(max_length=255, default='', blank=True, db_index=True)
+    depth = models.PositiveSmallIntegerField(default=0)
 
     class Meta:
         db_table = 'categories'
 
+    def clean(self):
+        from .categories import check_parent
+        check_parent(self)
+
 class Product(models.Model):
     id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=200)
@@ -106,6 +122,26 @@ class Product(models.Model):
     class Meta:
         db_table = 'products'
 
+class ProductSummary(models.Model):
+    # Bảng tóm tắt giá / tồn kho theo sản phẩm, duy trì bởi app/summaries.py,
+    # để lọc & sắp xếp danh sách sản phẩm mà không phải join variant/inventory.
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='summary')
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    total_stock = models.IntegerField(default=0)
+    in_stock = models.BooleanField(default=False)
+    variant_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'product_summaries'
+        indexes = [
+            models.Index(fields=['min_price'], name='idx_summary_min_price'),
+            models.Index(fields=['max_price'], name='idx_summary_max_price'),
+            models.Index(fields=['in_stock', 'min_price'], name='idx_summary_stock_price'),
+        ]
+
 class ProductCategory(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
@@ -133,6 +169,37 @@ class Inventory(models.Model):
         db_table = 'inventory'
         unique_together = (('store', 'variant'),)
 
+class InventoryShard(models.Model):
+    # Bộ đếm tồn kho chia nhỏ cho các (store, variant) bán rất chạy.
+    # Khi một cặp có shard thì tồn kho thật = tổng quantity các shard,
+    # còn Inventory.quantity chỉ là bản sao được đồng bộ định kỳ.
+    store = models.ForeignKey(Store, on_delete=models.CASCADE)
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'inventory_shards'
+        unique_together = (('store', 'variant', 'shard'),)
+
+class RegionalAvailability(models.Model):
+    # Tồn kho còn hàng theo (variant, tỉnh), duy trì bởi app/availability.py từ
+    # Inventory + Store.province. Chỉ có dòng khi quantity > 0, nên "còn hàng
+    # ở tỉnh X" là một lookup trên index (province, product).
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE)
+    province = models.ForeignKey(Province, on_delete=models.CASCADE)
+    # lặp lại variant.product_id để lọc sản phẩm không phải join product_variants
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.IntegerField(default=0)
+    store_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'regional_availability'
+        unique_together = (('variant', 'province'),)
+        indexes = [
+            models.Index(fields=['province', 'product'], name='idx_regional_avail_product'),
+        ]
+
 class FeeType(models.Model):
     code = models.CharField(max_length=50, primary_key=True)
     name = models.CharField(max_length=100)
@@ -141,6 +208,25 @@ class FeeType(models.Model):
     class Meta:
         db_table = 'fee_types'
 
+class FeeRate(models.Model):
+    """
+    Một dòng trong bảng giá của FeeType (biên dịch bởi app/fees.py):
+      - khung khoảng cách: áp cho quãng đường <= max_distance_km
+        (null = mọi quãng đường xa hơn khung cuối)
+      - bậc số lượng: áp khi tổng số món trong đơn >= min_quantity
+      - phạm vi: district > province > mặc định (cả hai null)
+    """
+    id = models.AutoField(primary_key=True)
+    fee_type = models.ForeignKey(FeeType, on_delete=models.CASCADE, db_column='fee_type', related_name='rates')
+    province = models.ForeignKey(Province, null=True, blank=True, on_delete=models.CASCADE)
+    district = models.ForeignKey(District, null=True, blank=True, on_delete=models.CASCADE)
+    max_distance_km = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+    min_quantity = models.PositiveIntegerField(default=1)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        db_table = 'fee_rates'
+
 class Order(models.Model):
     id = models.AutoField(primary_key=True)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
@@ -159,10 +245,16 @@ class Order(models.Model):
 
     class Meta:
         db_table = 'orders'
+        indexes = [
+            # rollup doanh số (app/analytics.py): quét theo khoảng ngày / watermark
+            models.Index(fields=['created_at'], name='idx_orders_created_at'),
+            models.Index(fields=['updated_at'], name='idx_orders_updated_at'),
+        ]
 
 class OrderItem(models.Model):
     id = models.AutoField(primary_key=True)
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    store = models.ForeignKey(Store, null=True, blank=True, on_delete=models.SET_NULL)
     variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE)
     quantity = models.IntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -205,6 +297,10 @@ class UserVoucher(models.Model):
 
     class Meta:
         db_table = 'user_vouchers'
+        indexes = [
+            # tra voucher chưa dùng của khách khi checkout / khi phát voucher hàng loạt
+            models.Index(fields=['user', 'voucher', 'used'], name='idx_user_vouchers_lookup'),
+        ]
 
 class OrderVoucher(models.Model):
     id = models.AutoField(primary_key=True)
@@ -233,3 +329,147 @@ class Payment(models.Model):
 
     class Meta:
         db_table = 'payments'
+
+class EmailJob(models.Model):
+    """
+    Hàng đợi email giao dịch. Mỗi đơn chỉ ghi một dòng; worker gom theo lô
+    (app/emails.py) và gửi qua một kết nối SMTP dùng lại.
+    """
+    KIND_CHOICES = [
+        ('order_confirmation', 'order_confirmation'),
+        ('order_shipped', 'order_shipped'),
+        ('order_cancelled', 'order_cancelled'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'pending'),
+        ('sending', 'sending'),
+        ('sent', 'sent'),
+        ('failed', 'failed'),
+    ]
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    batch_id = models.CharField(max_length=32, blank=True, default='')
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'email_jobs'
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='idx_email_jobs_status'),
+            models.Index(fields=['batch_id'], name='idx_email_jobs_batch'),
+        ]
+
+class OutboxMessage(models.Model):
+    """
+    Outbox: task Celery cần gửi, ghi cùng transaction với dữ liệu nghiệp vụ.
+    Relay (app/outbox.py) đọc theo lô và đẩy lên broker sau khi commit,
+    nên request không phải chờ broker và không mất task khi broker lỗi.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'pending'),
+        ('sending', 'sending'),
+        ('sent', 'sent'),
+        ('failed', 'failed'),
+    ]
+    id = models.BigAutoField(primary_key=True)
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    batch_id = models.CharField(max_length=32, blank=True, default='')
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'outbox_messages'
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='idx_outbox_status'),
+            models.Index(fields=['batch_id'], name='idx_outbox_batch'),
+        ]
+
+class CheckoutIntent(models.Model):
+    """
+    Yêu cầu đặt hàng bất đồng bộ (app/checkout.py). Pipeline Celery đi qua các
+    bước received -> allocated -> completed; phương án chọn store lưu ở `plan`
+    để mỗi bước chạy lại được mà không làm lại bước trước.
+    """
+    STAGE_CHOICES = [
+        ('received', 'received'),
+        ('allocated', 'allocated'),
+        ('completed', 'completed'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'pending'),
+        ('processing', 'processing'),
+        ('completed', 'completed'),
+        ('failed', 'failed'),
+    ]
+    id = models.BigAutoField(primary_key=True)
+    # id công khai trong URL tra trạng thái (không đoán được như id tăng dần)
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    payload = models.JSONField()
+    plan = models.JSONField(null=True, blank=True)
+    stage = models.CharField(max_length=10, choices=STAGE_CHOICES, default='received')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    reallocations = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    order = models.OneToOneField(Order, null=True, blank=True, on_delete=models.SET_NULL,
+                                 related_name='checkout_intent')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'checkout_intents'
+
+class SalesRollup(models.Model):
+    """
+    Doanh số tổng hợp sẵn theo ngày / tháng và theo chiều: toàn bộ, khách hàng,
+    store, category (app/analytics.py). Ngày/tháng là giờ địa phương (TIME_ZONE).
+    Không tính đơn đã huỷ.
+    """
+    PERIOD_CHOICES = [
+        ('day', 'day'),
+        ('month', 'month'),
+    ]
+    DIMENSION_CHOICES = [
+        ('all', 'all'),
+        ('customer', 'customer'),
+        ('store', 'store'),
+        ('category', 'category'),
+    ]
+    id = models.BigAutoField(primary_key=True)
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    # id của khách / store / category; 0 với chiều `all`
+    dimension_id = models.IntegerField(default=0)
+    orders_count = models.PositiveIntegerField(default=0)
+    items_quantity = models.PositiveIntegerField(default=0)
+    goods_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = 'sales_rollups'
+        unique_together = (('period', 'dimension', 'period_start', 'dimension_id'),)
+        indexes = [
+            models.Index(fields=['dimension', 'dimension_id', 'period', 'period_start'],
+                         name='idx_sales_rollups_member'),
+        ]
+
+class RollupWatermark(models.Model):
+    """Mốc `Order.updated_at` đã được tổng hợp tới (mỗi loại rollup một dòng)."""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'rollup_watermarks'
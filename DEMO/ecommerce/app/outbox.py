@@ -0,0 +1,228 @@
+import time
+import uuid
+from datetime import timedelta
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxMessage
+
+# Cờ "có message mới" do on_commit đặt; relay thấy cờ thì chạy ngay không chờ hết chu kỳ
+WAKE_KEY = 'outbox:wake'
+
+
+# ---------------------------------------------------------------------------
+# Publisher: nơi relay đẩy message tới
+# ---------------------------------------------------------------------------
+
+class CeleryPublisher:
+    """Đẩy message lên broker Celery, cả lô dùng chung một producer / kết nối."""
+
+    def __init__(self, app=None):
+        if app is None:
+            from celery import current_app as app
+        self.app = app
+        self._producer = None
+
+    def __enter__(self):
+        self._ctx = self.app.producer_or_acquire()
+        self._producer = self._ctx.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self._producer = None
+        return self._ctx.__exit__(*exc)
+
+    def publish(self, message: OutboxMessage):
+        self.app.send_task(
+            message.task,
+            args=message.args,
+            kwargs=message.kwargs,
+            task_id=f'outbox-{message.id}',
+            producer=self._producer,
+        )
+
+
+class InMemoryPublisher:
+    """Publisher giữ message trong bộ nhớ, dùng để kiểm thử relay không cần broker."""
+
+    def __init__(self, fail_tasks: Iterable[str] = ()):
+        self.published = []
+        self.fail_tasks = set(fail_tasks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def publish(self, message: OutboxMessage):
+        if message.task in self.fail_tasks:
+            raise ConnectionError(f"broker từ chối {message.task}")
+        self.published.append((message.id, message.task, list(message.args), dict(message.kwargs)))
+
+
+class EagerPublisher:
+    """Chạy task ngay trong tiến trình (CELERY_TASK_ALWAYS_EAGER, test cục bộ)."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def publish(self, message: OutboxMessage):
+        # tên task của shared_task chính là đường dẫn import
+        import_string(message.task).apply(args=message.args, kwargs=message.kwargs)
+
+
+def get_publisher():
+    if getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False):
+        return EagerPublisher()
+    return import_string(settings.OUTBOX_PUBLISHER)()
+
+
+# ---------------------------------------------------------------------------
+# Ghi vào outbox
+# ---------------------------------------------------------------------------
+
+def enqueue_task(task: str, args=None, kwargs=None, countdown: Optional[float] = None) -> OutboxMessage:
+    """
+    Ghi một task vào outbox trong transaction hiện tại. Task chỉ được gửi
+    nếu transaction commit; `countdown` (giây) lùi thời điểm relay gửi.
+    """
+    available_at = timezone.now()
+    # chế độ eager không có relay chạy nền để gửi message hẹn giờ về sau
+    if countdown and not getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False):
+        available_at += timedelta(seconds=countdown)
+    message = OutboxMessage.objects.create(
+        task=task, args=list(args or []), kwargs=dict(kwargs or {}), available_at=available_at,
+    )
+    transaction.on_commit(wake_relay)
+    return message
+
+
+def wake_relay():
+    """
+    Gợi ý cho relay sau commit: chỉ đặt một cờ trên cache, không gọi broker
+    trong request. Ở chế độ eager (không có relay chạy nền) thì relay luôn tại chỗ.
+    """
+    if getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False):
+        relay_outbox()
+    else:
+        cache.set(WAKE_KEY, 1, timeout=None)
+
+
+# ---------------------------------------------------------------------------
+# Relay
+# ---------------------------------------------------------------------------
+
+def release_stale_messages() -> int:
+    """Trả lại hàng đợi các message kẹt ở `sending` (relay chết giữa lô)."""
+    cutoff = timezone.now() - timedelta(seconds=settings.OUTBOX_SENDING_TIMEOUT)
+    return (
+        OutboxMessage.objects
+        .filter(status='sending', available_at__lt=cutoff)
+        .update(status='pending', batch_id='')
+    )
+
+
+def claim_batch(batch_size: int) -> List[OutboxMessage]:
+    """
+    Nhận tối đa `batch_size` message đến hạn, theo thứ tự ghi. UPDATE có điều kiện
+    `status='pending'` nên nhiều relay chạy song song không nhận trùng.
+    Khi đang gửi, `available_at` là thời điểm lô được nhận.
+    """
+    now = timezone.now()
+    ids = list(
+        OutboxMessage.objects
+        .filter(status='pending', available_at__lte=now)
+        .order_by('id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    OutboxMessage.objects.filter(id__in=ids, status='pending').update(
+        status='sending', batch_id=token, available_at=now
+    )
+    return list(OutboxMessage.objects.filter(batch_id=token).order_by('id'))
+
+
+def _retry_or_fail(message: OutboxMessage, error: str) -> str:
+    attempts = message.attempts + 1
+    if attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        status, available_at = 'failed', timezone.now()
+    else:
+        delay = settings.OUTBOX_RETRY_DELAY * (2 ** (attempts - 1))
+        status, available_at = 'pending', timezone.now() + timedelta(seconds=delay)
+    OutboxMessage.objects.filter(id=message.id).update(
+        status=status, attempts=attempts, last_error=error[:1000],
+        batch_id='', available_at=available_at,
+    )
+    return 'retry' if status == 'pending' else 'failed'
+
+
+def relay_batch(messages: List[OutboxMessage], publisher) -> dict:
+    """
+    Đẩy một lô message qua `publisher`. Gửi thành công mới đánh dấu `sent`
+    (at-least-once: relay chết sau khi gửi mà chưa kịp đánh dấu thì message
+    được gửi lại, task phía nhận cần idempotent).
+    """
+    start = time.perf_counter()
+    stats = {'claimed': len(messages), 'sent': 0, 'retry': 0, 'failed': 0}
+    sent_ids = []
+    with publisher:
+        for message in messages:
+            try:
+                publisher.publish(message)
+                sent_ids.append(message.id)
+            except Exception as exc:
+                stats[_retry_or_fail(message, repr(exc))] += 1
+
+    if sent_ids:
+        OutboxMessage.objects.filter(id__in=sent_ids).update(
+            status='sent', sent_at=timezone.now(), attempts=F('attempts') + 1, batch_id='',
+        )
+    stats['sent'] = len(sent_ids)
+    stats['seconds'] = round(time.perf_counter() - start, 4)
+    return stats
+
+
+def relay_outbox(batch_size: Optional[int] = None, publisher=None,
+                 max_batches: Optional[int] = None) -> List[dict]:
+    """Gửi hết các message đến hạn, mỗi lần một lô. Trả về thống kê từng lô."""
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    cache.delete(WAKE_KEY)
+    release_stale_messages()
+
+    results = []
+    while max_batches is None or len(results) < max_batches:
+        messages = claim_batch(batch_size)
+        if not messages:
+            break
+        results.append(relay_batch(messages, publisher or get_publisher()))
+    return results
+
+
+def run_relay(poll_interval: Optional[float] = None, batch_size: Optional[int] = None,
+              tick: float = 0.05, stop=None):
+    """
+    Vòng lặp relay chạy nền: gửi ngay khi có cờ wake từ on_commit, ngoài ra
+    quét định kỳ mỗi `poll_interval` giây (message hẹn giờ, message gửi lại).
+    Sau mỗi lần quét trả ra (yield) thống kê các lô; `stop()` trả về True thì dừng.
+    """
+    poll_interval = poll_interval or settings.OUTBOX_POLL_INTERVAL
+    last_run = 0.0
+    while not (stop and stop()):
+        now = time.monotonic()
+        if cache.get(WAKE_KEY) or now - last_run >= poll_interval:
+            last_run = now
+            yield relay_outbox(batch_size)
+        else:
+            time.sleep(tick)
@@ -0,0 +1,179 @@
+import base64
+import json
+
+from django.db.models import F, Q
+from django.db.models.expressions import OrderBy
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CatalogPagination(PageNumberPagination):
+    """
+    Phân trang cho các danh sách catalog, ba chế độ:
+      - mặc định:              ?page=N như PageNumberPagination (có `count`)
+      - ?count=false:          vẫn theo số trang nhưng bỏ COUNT(*), lấy thêm
+                               1 dòng để biết còn trang sau hay không
+      - ?pagination=cursor     keyset: lọc `(sort_key, id) > (giá trị dòng cuối)`
+        (hoặc có ?cursor=...)  thay vì OFFSET, nên trang thứ N tốn như trang 1;
+                               chỉ đi tới (`next`), không có `count`.
+    Keyset đọc thứ tự từ `queryset.order_by(...)` (trường cuối phải là `id`,
+    xem `order_products` trong views.py); giá trị NULL được coi là xếp cuối.
+    Với list Python (kết quả search đã xếp hạng) cursor lưu vị trí.
+    """
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size_value = self.get_page_size(request)
+        cursor_mode = (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.cursor_query_param in request.query_params
+        )
+        if cursor_mode:
+            self.mode = 'cursor'
+            if isinstance(queryset, (list, tuple)):
+                return self._paginate_list_cursor(queryset)
+            return self._paginate_keyset(queryset)
+
+        if request.query_params.get(self.count_query_param, '').lower() in ['false', '0']:
+            self.mode = 'nocount'
+            return self._paginate_without_count(queryset)
+
+        self.mode = 'page'
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.mode == 'page':
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.next_link,
+            'previous': self.previous_link,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        schema = super().get_paginated_response_schema(schema)
+        schema['required'] = ['results']
+        return schema
+
+    # --- page number, không COUNT -------------------------------------------
+
+    def _paginate_without_count(self, queryset):
+        size = self.page_size_value
+        try:
+            number = int(self.request.query_params.get(self.page_query_param, 1))
+            if number < 1:
+                raise ValueError
+        except ValueError:
+            raise NotFound("Trang không hợp lệ")
+
+        offset = (number - 1) * size
+        rows = list(queryset[offset:offset + size + 1])
+        url = self.request.build_absolute_uri()
+        self.next_link = replace_query_param(url, self.page_query_param, number + 1) if len(rows) > size else None
+        if number == 1:
+            self.previous_link = None
+        elif number == 2:
+            self.previous_link = remove_query_param(url, self.page_query_param)
+        else:
+            self.previous_link = replace_query_param(url, self.page_query_param, number - 1)
+        return rows[:size]
+
+    # --- cursor ---------------------------------------------------------------
+
+    def _encode(self, payload):
+        raw = json.dumps(payload, default=str, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+
+    def _decode(self, cursor):
+        try:
+            return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        except (ValueError, TypeError):
+            raise NotFound("Cursor không hợp lệ")
+
+    def _cursor_link(self, payload):
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.mode_query_param, 'cursor')
+        return replace_query_param(url, self.cursor_query_param, self._encode(payload))
+
+    def _paginate_list_cursor(self, items):
+        size = self.page_size_value
+        cursor = self.request.query_params.get(self.cursor_query_param)
+        offset = 0
+        if cursor:
+            payload = self._decode(cursor)
+            offset = payload.get('o') if isinstance(payload, dict) else None
+            if not isinstance(offset, int) or offset < 0:
+                raise NotFound("Cursor không hợp lệ")
+        page = list(items[offset:offset + size])
+        self.previous_link = None
+        self.next_link = self._cursor_link({'o': offset + size}) if offset + size < len(items) else None
+        return page
+
+    @staticmethod
+    def _ordering(queryset):
+        """[(tên trường, giảm dần?)] theo order_by của queryset, luôn kết thúc bằng id."""
+        ordering = []
+        for item in queryset.query.order_by:
+            if isinstance(item, OrderBy):
+                ordering.append((item.expression.name, item.descending))
+            else:
+                ordering.append((item.lstrip('-'), item.startswith('-')))
+        ordering = [(('id' if name == 'pk' else name), desc) for name, desc in ordering]
+        if not ordering or ordering[-1][0] != 'id':
+            ordering.append(('id', ordering[-1][1] if ordering else False))
+        return ordering
+
+    @staticmethod
+    def _after(ordering, values):
+        """
+        Điều kiện "đứng sau" bộ giá trị `values` theo thứ tự từ điển của
+        `ordering` (NULL xếp cuối ở cả hai chiều).
+        """
+        cond = Q(pk__in=[])
+        equal = Q()
+        for (field, desc), value in zip(ordering, values):
+            if value is None:
+                after = Q(pk__in=[])
+                same = Q(**{f'{field}__isnull': True})
+            else:
+                after = Q(**{f"{field}__{'lt' if desc else 'gt'}": value})
+                if field != 'id':
+                    after |= Q(**{f'{field}__isnull': True})
+                same = Q(**{field: value})
+            cond |= equal & after
+            equal &= same
+        return cond
+
+    def _paginate_keyset(self, queryset):
+        size = self.page_size_value
+        ordering = self._ordering(queryset)
+        keys = {f'_keyset_{i}': F(field) for i, (field, _) in enumerate(ordering) if field != 'id'}
+        queryset = queryset.annotate(**keys)
+        if not queryset.query.order_by:
+            queryset = queryset.order_by('-id' if ordering[-1][1] else 'id')
+
+        cursor = self.request.query_params.get(self.cursor_query_param)
+        if cursor:
+            payload = self._decode(cursor)
+            values = payload.get('v') if isinstance(payload, dict) else None
+            if not isinstance(values, list) or len(values) != len(ordering):
+                raise NotFound("Cursor không hợp lệ")
+            queryset = queryset.filter(self._after(ordering, values))
+
+        rows = list(queryset[:size + 1])
+        self.previous_link = None
+        self.next_link = None
+        if len(rows) > size:
+            rows = rows[:size]
+            last = rows[-1]
+            values = [
+                last.pk if field == 'id' else getattr(last, f'_keyset_{i}')
+                for i, (field, _) in enumerate(ordering)
+            ]
+            self.next_link = self._cursor_link({'v': values})
+        return rows
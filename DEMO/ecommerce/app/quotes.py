@@ -0,0 +1,185 @@
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .cache import LRUCache, get_generation
+from .checkout import check_coordinates, check_fee_type, resolve_items
+from .fees import delivery_days, fee_schedule, shipping_fee
+from .geo import STORES_GENERATION
+from .inventory import get_sharded_keys, sharded_stock
+from .models import Inventory, Store, UserAddress
+from .services import select_stores_for_order
+
+
+# ---------------------------------------------------------------------------
+# Snapshot tồn kho cho báo giá
+# ---------------------------------------------------------------------------
+
+def load_stock(variant_ids: Iterable[int]) -> Dict[int, Dict[int, int]]:
+    """
+    Tồn kho còn hàng của các variant: {variant_id: {store_id: số lượng}}.
+    Cặp (store, variant) đang chia shard lấy tổng các shard (thêm 1 truy vấn).
+    """
+    ids = set(variant_ids)
+    stock: Dict[int, Dict[int, int]] = {}
+    rows = (
+        Inventory.objects
+        .filter(variant_id__in=ids, quantity__gt=0)
+        .values_list('variant_id', 'store_id', 'quantity')
+    )
+    for vid, sid, qty in rows:
+        stock.setdefault(vid, {})[sid] = qty
+
+    hot = {(sid, vid) for sid, vid in get_sharded_keys() if vid in ids}
+    if hot:
+        for (sid, vid), qty in sharded_stock(hot).items():
+            if qty > 0:
+                stock.setdefault(vid, {})[sid] = qty
+            else:
+                stock.get(vid, {}).pop(sid, None)
+    return stock
+
+
+class StockSnapshot:
+    """
+    Bản chụp tồn kho trong tiến trình, chỉ dùng cho báo giá:
+      - tồn kho theo variant ({store_id: số lượng}), mỗi variant hết hạn sau `ttl` giây
+      - danh sách Store, dựng lại khi generation `stores` đổi
+    Báo giá được phép lệch vài giây so với DB: lúc đặt hàng tồn kho vẫn được
+    trừ bằng UPDATE có điều kiện nên không thể bán quá số còn lại.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.ttl = ttl
+        self.variants = LRUCache(max_entries)
+        self._stores_lock = threading.Lock()
+        self._stores: Dict[int, Store] = {}
+        self._stores_generation = None
+
+    def stock(self, variant_ids: Iterable[int]) -> Dict[int, Dict[int, int]]:
+        result = {}
+        missing = []
+        for vid in set(variant_ids):
+            hit, row = self.variants.get(vid)
+            if hit:
+                result[vid] = row
+            else:
+                missing.append(vid)
+        if missing:
+            loaded = load_stock(missing)
+            for vid in missing:
+                row = loaded.get(vid, {})
+                self.variants.set(vid, row, self.ttl)
+                result[vid] = row
+        return result
+
+    def stores(self) -> Dict[int, Store]:
+        generation = get_generation(STORES_GENERATION)
+        if self._stores_generation != generation:
+            with self._stores_lock:
+                if self._stores_generation != generation:
+                    self._stores = Store.objects.in_bulk()
+                    self._stores_generation = generation
+        return self._stores
+
+    def coverage(self, items: List[Dict[str, Any]]):
+        """Bộ ba (demand, stores, stock) giống build_coverage_matrix, đọc từ snapshot."""
+        demand: Dict[int, int] = {}
+        for item in items:
+            vid = item['variant'].id
+            demand[vid] = demand.get(vid, 0) + item['quantity']
+
+        all_stores = self.stores()
+        stock: Dict[int, Dict[int, int]] = {}
+        for vid, row in self.stock(demand).items():
+            for sid, qty in row.items():
+                if sid in all_stores:
+                    stock.setdefault(sid, {})[vid] = qty
+        return demand, {sid: all_stores[sid] for sid in stock}, stock
+
+
+_snapshot_lock = threading.Lock()
+_snapshot: Optional[StockSnapshot] = None
+
+
+def get_stock_snapshot() -> StockSnapshot:
+    global _snapshot
+    if _snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _snapshot = StockSnapshot(settings.QUOTE_STOCK_CACHE_SIZE, settings.QUOTE_STOCK_TTL)
+    return _snapshot
+
+
+# ---------------------------------------------------------------------------
+# Báo giá
+# ---------------------------------------------------------------------------
+
+def _error_detail(exc: ValidationError) -> str:
+    detail = exc.detail
+    if isinstance(detail, list) and len(detail) == 1:
+        detail = detail[0]
+    return str(detail)
+
+
+def quote_shipping(customer_id: int, address_ids: List[int], raw_items, fee_code: str) -> List[dict]:
+    """
+    Báo giá giỏ hàng cho một hoặc nhiều địa chỉ của khách: phương án lấy hàng,
+    phí ship, thời gian giao. Cùng code chọn store / tính phí với checkout
+    nhưng chỉ đọc (không khoá, không ghi) và tồn kho lấy từ StockSnapshot.
+    Địa chỉ không lấy được hàng có `available = False` kèm `error`.
+    """
+    check_fee_type(fee_code)
+    items = resolve_items(raw_items)
+
+    addresses = UserAddress.objects.filter(customer_id=customer_id, id__in=address_ids).in_bulk()
+    unknown = [addr_id for addr_id in address_ids if addr_id not in addresses]
+    if unknown:
+        raise ValidationError(f"Địa chỉ giao hàng không tồn tại: {', '.join(map(str, unknown))}")
+
+    coverage = get_stock_snapshot().coverage(items)
+    subtotal = sum((it['quantity'] * it['price'] for it in items), Decimal('0.00'))
+    quantity = sum(it['quantity'] for it in items)
+    today = timezone.localdate()
+
+    quotes = []
+    for addr_id in address_ids:
+        addr = addresses[addr_id]
+        try:
+            check_coordinates(addr)
+            fees = fee_schedule(fee_code, quantity, addr.province_id, addr.district_id)
+            plan = select_stores_for_order(items, addr.latitude, addr.longitude, fees, coverage=coverage)
+        except ValidationError as exc:
+            quotes.append({'shipping_address_id': addr_id, 'available': False, 'error': _error_detail(exc)})
+            continue
+
+        max_dist = max(alloc['distance'] for alloc in plan)
+        fee = shipping_fee(fee_code, max_dist, quantity, addr.province_id, addr.district_id)
+        days = delivery_days(max_dist)
+        quotes.append({
+            'shipping_address_id': addr_id,
+            'available': True,
+            'allocation': [
+                {
+                    'store_id': alloc['store'].id,
+                    'store_name': alloc['store'].name,
+                    'distance_km': round(alloc['distance'], 3),
+                    'items': [
+                        {'variant_id': vid, 'quantity': qty}
+                        for vid, qty in sorted(alloc['quantities'].items())
+                    ],
+                }
+                for alloc in plan
+            ],
+            'subtotal': subtotal,
+            'shipping_fee': fee,
+            'total': subtotal + fee,
+            'eta_days': days,
+            'eta_date': (today + timedelta(days=days)).isoformat(),
+        })
+    return quotes
@@ -0,0 +1,240 @@
+import datetime
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.utils import timezone
+
+from .analytics import ROLLUP_GENERATION, add_months, month_generation, month_start
+from .cache import get_generation, get_generations
+from .models import SalesRollup
+
+# Số bit 1 của mỗi giá trị uint8 (khi NumPy chưa có bitwise_count)
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(bitmap: np.ndarray) -> int:
+    """Số bit 1 của một bitmap (mảng uint8)."""
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(bitmap).sum(dtype=np.int64))
+    return int(_POPCOUNT_TABLE[bitmap].sum(dtype=np.int64))
+
+
+def to_bitmap(ids, size: int) -> np.ndarray:
+    """Bitmap `size` byte có bit `id` bật cho mỗi id (bit thấp trước)."""
+    flags = np.zeros(size * 8, dtype=bool)
+    flags[np.asarray(ids, dtype=np.int64)] = True
+    return np.packbits(flags, bitorder='little')
+
+
+def bitmap_size(max_id: int) -> int:
+    return (int(max_id) >> 3) + 1
+
+
+class ActivityIndex:
+    """
+    Hoạt động mua hàng của khách theo tháng, mỗi tháng hai bitmap trên Customer.id:
+      active: khách có ít nhất 1 đơn (không huỷ) trong tháng
+      multi:  khách có từ 2 đơn trở lên trong tháng
+    1 triệu khách tốn ~125KB mỗi bitmap. Nạp từ rollup tháng chiều `customer`
+    (app/analytics.py), mỗi tháng nạp lại độc lập khi rollup của tháng đó đổi.
+    Churn / cohort / mua lại tính bằng phép OR / AND / NOT trên cả mảng.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.size = 1
+        self.months: Dict[datetime.date, Tuple[np.ndarray, np.ndarray]] = {}
+        self.generations: Dict[datetime.date, int] = {}
+
+    def __len__(self):
+        return len(self.months)
+
+    def set_month(self, month: datetime.date, active_ids, multi_ids=()):
+        active_ids = np.asarray(active_ids, dtype=np.int64)
+        multi_ids = np.asarray(multi_ids, dtype=np.int64)
+        with self.lock:
+            if active_ids.size:
+                self._grow(bitmap_size(active_ids.max()))
+            self.months[month] = (to_bitmap(active_ids, self.size), to_bitmap(multi_ids, self.size))
+
+    def drop_month(self, month: datetime.date):
+        with self.lock:
+            self.months.pop(month, None)
+            self.generations.pop(month, None)
+
+    def _grow(self, size: int):
+        """Nới mọi bitmap lên `size` byte (id khách mới lớn hơn id lớn nhất đã gặp)."""
+        if size <= self.size:
+            return
+        pad = size - self.size
+        self.months = {
+            month: (np.pad(active, (0, pad)), np.pad(multi, (0, pad)))
+            for month, (active, multi) in self.months.items()
+        }
+        self.size = size
+
+    # -- truy vấn ----------------------------------------------------------
+
+    def _empty(self) -> np.ndarray:
+        return np.zeros(self.size, dtype=np.uint8)
+
+    def active(self, month: datetime.date) -> np.ndarray:
+        entry = self.months.get(month)
+        return entry[0] if entry is not None else self._empty()
+
+    def active_between(self, first: datetime.date, last: datetime.date) -> np.ndarray:
+        """Khách có mua trong ít nhất một tháng thuộc [first, last]."""
+        result = self._empty()
+        for month, (active, _) in self.months.items():
+            if first <= month <= last:
+                np.bitwise_or(result, active, out=result)
+        return result
+
+    def repeat_between(self, first: datetime.date, last: datetime.date) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (khách có mua, khách mua từ 2 đơn trở lên) trong [first, last]:
+        mua lại = có mua ở 2 tháng khác nhau, hoặc 2 đơn trong cùng một tháng.
+        """
+        seen = self._empty()
+        repeat = self._empty()
+        for month in sorted(self.months):
+            if first <= month <= last:
+                active, multi = self.months[month]
+                np.bitwise_or(repeat, np.bitwise_and(seen, active), out=repeat)
+                np.bitwise_or(repeat, multi, out=repeat)
+                np.bitwise_or(seen, active, out=seen)
+        return seen, repeat
+
+
+_index_lock = threading.Lock()
+_index: Optional[ActivityIndex] = None
+_index_generation = None
+
+
+def load_month(index: ActivityIndex, month: datetime.date):
+    rows = (
+        SalesRollup.objects
+        .filter(period='month', dimension='customer', period_start=month)
+        .values_list('dimension_id', 'orders_count')
+    )
+    data = np.array(list(rows), dtype=np.int64).reshape(-1, 2)
+    index.set_month(month, data[:, 0], data[data[:, 1] >= 2, 0])
+
+
+def get_activity_index() -> ActivityIndex:
+    """
+    Bitmap hoạt động dùng chung trong tiến trình. Khi rollup đổi (generation
+    `sales-rollups`), chỉ nạp lại những tháng có generation riêng thay đổi.
+    """
+    global _index, _index_generation
+    generation = get_generation(ROLLUP_GENERATION)
+    if _index is not None and _index_generation == generation:
+        return _index
+
+    with _index_lock:
+        if _index is None:
+            _index = ActivityIndex()
+        if _index_generation != generation:
+            months = set(
+                SalesRollup.objects
+                .filter(period='month', dimension='all')
+                .values_list('period_start', flat=True)
+            )
+            for month in set(_index.months) - months:
+                _index.drop_month(month)
+            current = get_generations([month_generation(m) for m in months])
+            for month in months:
+                month_gen = current[month_generation(month)]
+                if month not in _index.months or _index.generations.get(month) != month_gen:
+                    load_month(_index, month)
+                    _index.generations[month] = month_gen
+            _index_generation = generation
+        return _index
+
+
+# ---------------------------------------------------------------------------
+# Báo cáo
+# ---------------------------------------------------------------------------
+
+def churn(today: Optional[datetime.date] = None, window_months: int = 6,
+          index: Optional[ActivityIndex] = None) -> dict:
+    """
+    Tỷ lệ rời bỏ: trong số khách có mua ở `window_months` tháng trước kỳ gần nhất,
+    bao nhiêu % không mua lại trong `window_months` tháng gần nhất (tính cả tháng này).
+    """
+    index = index or get_activity_index()
+    today = today or timezone.localdate()
+    recent_from = add_months(month_start(today), -(window_months - 1))
+    previous_from = add_months(recent_from, -window_months)
+    previous_to = recent_from - datetime.timedelta(days=1)
+
+    with index.lock:
+        previous = index.active_between(previous_from, previous_to)
+        recent = index.active_between(recent_from, today)
+        churned = np.bitwise_and(previous, np.invert(recent))
+        previous_count = popcount(previous)
+        churned_count = popcount(churned)
+    return {
+        'window_months': window_months,
+        'previous_period': [previous_from, previous_to],
+        'recent_period': [recent_from, today],
+        'previous_customers': previous_count,
+        'churned_customers': churned_count,
+        'churn_rate_percent': round(churned_count * 100.0 / previous_count, 2) if previous_count else 0,
+    }
+
+
+def cohorts(first: datetime.date, months: int = 12,
+            index: Optional[ActivityIndex] = None) -> List[dict]:
+    """
+    Cohort theo tháng mua đầu tiên, từ tháng `first` trong `months` tháng.
+    `retention[k]` = % khách của cohort có mua ở tháng thứ k sau tháng đầu.
+    """
+    index = index or get_activity_index()
+    first = month_start(first)
+    result = []
+    with index.lock:
+        ordered = sorted(m for m in index.months if m < add_months(first, months))
+        # khách đã mua trước tháng đang xét
+        seen = index._empty()
+        newcomers = {}
+        for month in ordered:
+            if month >= first:
+                newcomers[month] = np.bitwise_and(index.active(month), np.invert(seen))
+            np.bitwise_or(seen, index.active(month), out=seen)
+
+        last = month_start(timezone.localdate())
+        for k in range(months):
+            month = add_months(first, k)
+            if month > last:
+                break
+            cohort = newcomers.get(month)
+            size = popcount(cohort) if cohort is not None else 0
+            retention = []
+            offset = 1
+            while size and add_months(month, offset) <= last:
+                later = add_months(month, offset)
+                back = popcount(np.bitwise_and(cohort, index.active(later)))
+                retention.append(round(back * 100.0 / size, 2))
+                offset += 1
+            result.append({'cohort': f'{month:%Y-%m}', 'customers': size, 'retention': retention})
+    return result
+
+
+def repeat_purchase(first: datetime.date, last: datetime.date,
+                    index: Optional[ActivityIndex] = None) -> dict:
+    """Tỷ lệ khách mua từ 2 đơn trở lên trong các tháng [first, last]."""
+    index = index or get_activity_index()
+    first, last = month_start(first), month_start(last)
+    with index.lock:
+        buyers, repeat = index.repeat_between(first, last)
+        buyers_count = popcount(buyers)
+        repeat_count = popcount(repeat)
+    return {
+        'from': f'{first:%Y-%m}',
+        'to': f'{last:%Y-%m}',
+        'customers': buyers_count,
+        'repeat_customers': repeat_count,
+        'repeat_rate_percent': round(repeat_count * 100.0 / buyers_count, 2) if buyers_count else 0,
+    }
@@ -0,0 +1,402 @@
+import bisect
+import math
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .cache import bump_generation, get_generation
+from .models import Product, ProductCategory, ProductSummary, RegionalAvailability
+from .outbox import enqueue_task
+
+SEARCH_GENERATION = 'search'
+SEARCH_SYNC_TASK = 'app.tasks.publish_search_updates'
+# Đã hẹn một lần báo các tiến trình khác dựng lại index trong cửa sổ SEARCH_SYNC_DELAY
+SEARCH_SYNC_SCHEDULED_KEY = 'search:sync-scheduled'
+
+# BM25
+K1 = 1.2
+B = 0.75
+# Token trong tên sản phẩm được tính nặng hơn mô tả
+NAME_WEIGHT = 2
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fold(text: str) -> str:
+    """
+    Bỏ dấu tiếng Việt và chữ hoa: "Giày Đỏ" -> "giay do".
+    Nhờ vậy người dùng gõ có dấu hay không dấu đều khớp.
+    """
+    text = unicodedata.normalize('NFD', text or '')
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    return text.replace('đ', 'd').replace('Đ', 'D').lower()
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(fold(text))
+
+
+class SearchIndex:
+    """
+    Inverted index trong bộ nhớ cho Product.
+      postings:    term -> {product_id: tf có trọng số}
+      doc_len:     product_id -> độ dài tài liệu (có trọng số)
+      categories:  category_id -> set(product_id)       (posting list cho bộ lọc)
+      prices:      product_id -> (giá min, giá max)
+      in_stock:    set(product_id) còn hàng ở ít nhất một store
+      regions:     province_id -> set(product_id) còn hàng ở store thuộc tỉnh đó
+    Cập nhật từng sản phẩm được (add/remove), mọi thao tác đều giữ `lock`.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_terms: Dict[int, Dict[str, int]] = {}
+        self.doc_len: Dict[int, int] = {}
+        self.total_len = 0
+        self.categories: Dict[int, set] = {}
+        self.prices: Dict[int, Tuple[Optional[float], Optional[float]]] = {}
+        self.in_stock = set()
+        self.regions: Dict[int, set] = {}
+        self._terms_sorted: Optional[List[str]] = None
+        self.built_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    # --- cập nhật -----------------------------------------------------------
+
+    def add_document(self, product_id: int, name: str, description: Optional[str]):
+        with self.lock:
+            self._remove_text(product_id)
+            terms: Dict[str, int] = {}
+            for tok in tokenize(name):
+                terms[tok] = terms.get(tok, 0) + NAME_WEIGHT
+            for tok in tokenize(description or ''):
+                terms[tok] = terms.get(tok, 0) + 1
+            for term, tf in terms.items():
+                bucket = self.postings.get(term)
+                if bucket is None:
+                    bucket = self.postings[term] = {}
+                    self._terms_sorted = None
+                bucket[product_id] = tf
+            length = sum(terms.values())
+            self.doc_terms[product_id] = terms
+            self.doc_len[product_id] = length
+            self.total_len += length
+
+    def _remove_text(self, product_id: int):
+        terms = self.doc_terms.pop(product_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            bucket = self.postings.get(term)
+            if bucket is not None:
+                bucket.pop(product_id, None)
+                if not bucket:
+                    del self.postings[term]
+                    self._terms_sorted = None
+        self.total_len -= self.doc_len.pop(product_id, 0)
+
+    def remove_document(self, product_id: int):
+        with self.lock:
+            self._remove_text(product_id)
+            for docs in self.categories.values():
+                docs.discard(product_id)
+            self.prices.pop(product_id, None)
+            self.in_stock.discard(product_id)
+            for docs in self.regions.values():
+                docs.discard(product_id)
+
+    def set_categories(self, product_id: int, category_ids: Iterable[int]):
+        with self.lock:
+            for docs in self.categories.values():
+                docs.discard(product_id)
+            for cid in category_ids:
+                self.categories.setdefault(cid, set()).add(product_id)
+
+    def set_offer(self, product_id: int, min_price, max_price, in_stock: bool,
+                  province_ids: Iterable[int] = ()):
+        with self.lock:
+            self.prices[product_id] = (
+                float(min_price) if min_price is not None else None,
+                float(max_price) if max_price is not None else None,
+            )
+            if in_stock:
+                self.in_stock.add(product_id)
+            else:
+                self.in_stock.discard(product_id)
+            for docs in self.regions.values():
+                docs.discard(product_id)
+            for pid in province_ids:
+                self.regions.setdefault(pid, set()).add(product_id)
+
+    # --- truy vấn -----------------------------------------------------------
+
+    def _expand_prefix(self, prefix: str) -> List[str]:
+        if self._terms_sorted is None:
+            self._terms_sorted = sorted(self.postings)
+        terms = self._terms_sorted
+        lo = bisect.bisect_left(terms, prefix)
+        hi = bisect.bisect_left(terms, prefix + '\U0010ffff')
+        return terms[lo:hi]
+
+    def _bm25(self, bucket: Dict[int, int], n_docs: int, avg_len: float) -> Dict[int, float]:
+        df = len(bucket)
+        idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        scores = {}
+        for doc, tf in bucket.items():
+            norm = K1 * (1 - B + B * self.doc_len[doc] / avg_len)
+            scores[doc] = idf * tf * (K1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, prefix: bool = True, category_ids: Optional[Iterable[int]] = None,
+               price_min=None, price_max=None, in_stock: Optional[bool] = None,
+               province_id: Optional[int] = None, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Tìm sản phẩm chứa TẤT CẢ các từ trong `query` (từ cuối được hiểu là
+        tiền tố nếu `prefix=True`, phục vụ autocomplete), xếp hạng BM25.
+        Bộ lọc được áp trên posting list trong bộ nhớ:
+          category_ids: thuộc ít nhất một category
+          price_min / price_max: có variant giá >= price_min / <= price_max
+          in_stock: True = còn hàng, False = hết hàng ở mọi store
+          province_id: còn hàng ở ít nhất một store thuộc tỉnh đó
+        Trả về [(product_id, score)] theo score giảm dần, id tăng dần.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        with self.lock:
+            n_docs = len(self.doc_len)
+            if not n_docs:
+                return []
+            avg_len = self.total_len / n_docs or 1.0
+
+            scores: Optional[Dict[int, float]] = None
+            for i, tok in enumerate(tokens):
+                if prefix and i == len(tokens) - 1:
+                    expanded = self._expand_prefix(tok)
+                else:
+                    expanded = [tok] if tok in self.postings else []
+                # với nhiều term cùng tiền tố, lấy điểm cao nhất của mỗi sản phẩm
+                term_scores: Dict[int, float] = {}
+                for term in expanded:
+                    for doc, sc in self._bm25(self.postings[term], n_docs, avg_len).items():
+                        if sc > term_scores.get(doc, 0.0):
+                            term_scores[doc] = sc
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {d: s + term_scores[d] for d, s in scores.items() if d in term_scores}
+                if not scores:
+                    return []
+
+            docs = set(scores)
+            if category_ids is not None:
+                allowed = set()
+                for cid in category_ids:
+                    allowed |= self.categories.get(cid, set())
+                docs &= allowed
+            if in_stock is True:
+                docs &= self.in_stock
+            elif in_stock is False:
+                docs -= self.in_stock
+            if province_id is not None:
+                docs &= self.regions.get(province_id, set())
+            if price_min is not None or price_max is not None:
+                lo = float(price_min) if price_min is not None else None
+                hi = float(price_max) if price_max is not None else None
+                kept = set()
+                for doc in docs:
+                    pmin, pmax = self.prices.get(doc, (None, None))
+                    if pmin is None:
+                        continue
+                    if lo is not None and pmax < lo:
+                        continue
+                    if hi is not None and pmin > hi:
+                        continue
+                    kept.add(doc)
+                docs = kept
+
+            ranked = sorted(((d, scores[d]) for d in docs), key=lambda x: (-x[1], x[0]))
+            return ranked[:limit] if limit else ranked
+
+
+# ---------------------------------------------------------------------------
+# Dựng index từ DB và cập nhật từ signal
+# ---------------------------------------------------------------------------
+
+def _offers(product_ids=None):
+    """
+    {product_id: (giá min, giá max, còn hàng, [tỉnh còn hàng])} — 2 truy vấn:
+    giá / còn hàng đọc từ product_summaries, tỉnh từ regional_availability.
+    Sản phẩm không có summary (vd vừa bị xoá) không có trong kết quả.
+    """
+    summaries = ProductSummary.objects.all()
+    regional = RegionalAvailability.objects.all()
+    if product_ids is not None:
+        summaries = summaries.filter(product_id__in=product_ids)
+        regional = regional.filter(product_id__in=product_ids)
+
+    offers = {
+        pid: (pmin, pmax, stocked, [])
+        for pid, pmin, pmax, stocked in summaries.values_list('product_id', 'min_price', 'max_price', 'in_stock')
+    }
+    for pid, province_id in regional.values_list('product_id', 'province_id').distinct():
+        if pid in offers:
+            offers[pid][3].append(province_id)
+    return offers
+
+
+def build_index() -> SearchIndex:
+    index = SearchIndex()
+    for pid, name, description in Product.objects.values_list('id', 'name', 'description').iterator():
+        index.add_document(pid, name, description)
+    cats: Dict[int, List[int]] = {}
+    for pid, cid in ProductCategory.objects.values_list('product_id', 'category_id'):
+        cats.setdefault(pid, []).append(cid)
+    for pid, cids in cats.items():
+        index.set_categories(pid, cids)
+    for pid, (pmin, pmax, stocked, provinces) in _offers().items():
+        index.set_offer(pid, pmin, pmax, stocked, provinces)
+    return index
+
+
+# _index_lock giữ việc thay _index và các cập nhật tăng dần; _build_lock đảm bảo
+# mỗi lúc chỉ một request dựng lại index (single-flight)
+_index_lock = threading.Lock()
+_build_lock = threading.Lock()
+_index: Optional[SearchIndex] = None
+_index_generation = None
+# cập nhật tăng dần xảy ra trong lúc đang dựng index mới, áp lại lên bản mới
+_pending: Optional[list] = None
+
+
+def _stale(generation, max_age) -> bool:
+    return (
+        _index is None
+        or _index_generation != generation
+        or time.monotonic() - _index.built_at >= max_age
+    )
+
+
+def _rebuild(generation):
+    global _index, _index_generation, _pending
+    with _index_lock:
+        _pending = []
+    try:
+        index = build_index()
+    except Exception:
+        with _index_lock:
+            _pending = None
+        raise
+    with _index_lock:
+        for update in _pending:
+            update(index)
+        _pending = None
+        _index = index
+        _index_generation = generation
+
+
+def get_search_index() -> SearchIndex:
+    """
+    Index dùng chung trong tiến trình. Dựng lại khi generation `search` đổi
+    (publish_updates sau các cập nhật tăng dần, import, hoặc lệnh
+    `search_index --rebuild`) hoặc khi quá SEARCH_INDEX_MAX_AGE giây (bắt các
+    thay đổi không phát signal, vd tồn kho bị trừ bằng UPDATE).
+    Chỉ một request dựng lại; trong lúc đó các request khác dùng bản cũ (lần
+    dựng đầu tiên thì chờ).
+    """
+    max_age = getattr(settings, 'SEARCH_INDEX_MAX_AGE', 300)
+    if not _stale(get_generation(SEARCH_GENERATION), max_age):
+        return _index
+
+    if not _build_lock.acquire(blocking=_index is None):
+        return _index
+    try:
+        generation = get_generation(SEARCH_GENERATION)
+        if _stale(generation, max_age):
+            _rebuild(generation)
+        return _index
+    finally:
+        _build_lock.release()
+
+
+def rebuild_index() -> SearchIndex:
+    """Buộc mọi tiến trình dựng lại index, và dựng ngay trong tiến trình này."""
+    bump_generation(SEARCH_GENERATION)
+    return get_search_index()
+
+
+def _update_local(update):
+    """Áp một cập nhật tăng dần lên index của tiến trình này (nếu đã dựng và chưa cũ)."""
+    with _index_lock:
+        if _pending is not None:
+            _pending.append(update)
+        if _index is not None and _index_generation == get_generation(SEARCH_GENERATION):
+            update(_index)
+
+
+def _after_commit(apply):
+    """
+    Cập nhật index SAU commit (transaction rollback thì index không đổi), rồi
+    hẹn báo các tiến trình khác: chỉ một lần tăng generation cho cả cửa sổ
+    SEARCH_SYNC_DELAY giây (schedule_search_sync), nên nhiều lần ghi liên tiếp
+    chỉ làm mỗi tiến trình dựng lại index một lần.
+    """
+    def run():
+        apply()
+        schedule_search_sync()
+    transaction.on_commit(run)
+
+
+def schedule_search_sync():
+    """Hẹn publish_search_updates sau SEARCH_SYNC_DELAY giây (mỗi cửa sổ chỉ hẹn một lần)."""
+    if cache.add(SEARCH_SYNC_SCHEDULED_KEY, 1, timeout=settings.SEARCH_SYNC_DELAY):
+        enqueue_task(SEARCH_SYNC_TASK, countdown=settings.SEARCH_SYNC_DELAY)
+
+
+def publish_updates() -> int:
+    """Tăng generation `search`: mọi tiến trình dựng lại index ở lượt tìm kiếm kế tiếp."""
+    # thay đổi từ giờ trở đi sẽ hẹn một lần publish mới
+    cache.delete(SEARCH_SYNC_SCHEDULED_KEY)
+    return bump_generation(SEARCH_GENERATION)
+
+
+def index_product(product: Product):
+    # chụp giá trị lúc lưu: instance có thể bị sửa tiếp trước khi commit
+    pid, name, description = product.id, product.name, product.description
+    _after_commit(lambda: _update_local(lambda index: index.add_document(pid, name, description)))
+
+
+def unindex_product(product_id: int):
+    _after_commit(lambda: _update_local(lambda index: index.remove_document(product_id)))
+
+
+def reindex_categories(product_id: int):
+    def apply():
+        cids = list(ProductCategory.objects.filter(product_id=product_id).values_list('category_id', flat=True))
+        _update_local(lambda index: index.set_categories(product_id, cids))
+    _after_commit(apply)
+
+
+def sync_offers(product_ids: Iterable[int]):
+    """
+    Cập nhật giá / còn hàng / tỉnh của các sản phẩm vào index local và hẹn báo
+    tiến trình khác. Gọi SAU commit, sau khi product_summaries đã được tính lại.
+    """
+    offers = _offers(list(product_ids))
+
+    def update(index):
+        for pid, (pmin, pmax, stocked, provinces) in offers.items():
+            index.set_offer(pid, pmin, pmax, stocked, provinces)
+    if offers:
+        _update_local(update)
+        schedule_search_sync()
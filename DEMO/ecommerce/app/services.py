@@ -1,105 +1,164 @@
-import math
-from typing import List, Dict, Any
-from django.db.models import F
-from .models import Store, Inventory
+from decimal import Decimal
+from typing import Any, Callable, Dict, List
+
+from django.conf import settings
+from django.db.models import Q
+from .models import Store, Inventory, ProductVariant
+from .inventory import get_sharded_keys, sharded_stock
+from .geo import get_store_index
+from .allocation import AllocationProblem, get_allocation_engine
 from rest_framework.exceptions import ValidationError
 
 
-def haversine(lat1, lon1, lat2, lon2):
+# Khung phí vận chuyển theo khoảng cách: (tới km, phí); xa hơn mốc cuối dùng phí mặc định
+SHIPPING_FEE_BANDS = [
+    (50, Decimal('15000')),
+    (200, Decimal('20000')),
+    (500, Decimal('30000')),
+]
+SHIPPING_FEE_OVER_LAST_BAND = Decimal('45000')
+
+
+def resolve_variants(keys):
+    """
+    Tra nhiều variant theo bộ ba (product_id, color, size) bằng một truy vấn.
+    Trả về {(product_id, color, size): ProductVariant}; nếu trùng bộ ba thì lấy
+    variant có id nhỏ nhất (giống `.first()`).
+    """
+    cond = Q()
+    for prod_id, color, size in set(keys):
+        cond |= Q(product_id=prod_id, color=color, size=size)
+    if not cond:
+        return {}
+
+    variants = {}
+    for variant in ProductVariant.objects.filter(cond).select_related('product').order_by('id'):
+        variants.setdefault((variant.product_id, variant.color, variant.size), variant)
+    return variants
+
+
+def build_coverage_matrix(items_data: List[Dict[str, Any]]):
     """
-    Tính khoảng cách giữa hai điểm (lat1, lon1) và (lat2, lon2) theo công thức Haversine.
-    Trả về khoảng cách (km).
+    Nạp toàn bộ tồn kho liên quan tới giỏ hàng bằng MỘT truy vấn và dựng
+    ma trận store × variant trong bộ nhớ, thay vì gọi `.exists()` cho từng
+    cặp (store, item).
 
-    Tham số:
-      lat1, lon1: toạ độ điểm thứ nhất (radian)
-      lat2, lon2: toạ độ điểm thứ hai (radian)
+    Trả về bộ ba (demand, stores, stock):
+      demand: {variant_id: tổng số lượng cần}  (gộp các dòng trùng variant)
+      stores: {store_id: Store instance}
+      stock:  {store_id: {variant_id: quantity}}
+    Chỉ những store có ít nhất một variant còn hàng mới xuất hiện trong kết quả.
+    Với các cặp (store, variant) đang chia shard, tồn kho lấy từ tổng các shard
+    (thêm 1 truy vấn, chỉ khi giỏ hàng có variant như vậy).
     """
-    # Bán kính Trái đất ~ 6_371 km
-    R = 6371.0
+    demand = {}
+    for item in items_data:
+        vid = item['variant'].id
+        demand[vid] = demand.get(vid, 0) + item['quantity']
+
+    hot = {(sid, vid) for sid, vid in get_sharded_keys() if vid in demand}
+    hot_variants = {vid for _, vid in hot}
+
+    stores = {}
+    stock = {}
+    rows = (
+        Inventory.objects
+        .filter(variant_id__in=demand.keys())
+        .filter(Q(quantity__gt=0) | Q(variant_id__in=hot_variants))
+        .select_related('store')
+        .order_by('store_id', 'variant_id')
+    )
+    for inv in rows:
+        stores[inv.store_id] = inv.store
+        stock.setdefault(inv.store_id, {})[inv.variant_id] = inv.quantity
 
-    # Chuyển độ sang radian
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
+    if hot:
+        for key, qty in sharded_stock(hot).items():
+            sid, vid = key
+            if sid in stock:
+                stock[sid][vid] = qty
 
-    # Công thức haversine
-    a = math.sin(dphi/2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return demand, stores, stock
 
-    return R * c
+
+def covered_variants(row: Dict[int, int], demand: Dict[int, int]):
+    """
+    Tập variant mà một dòng của ma trận tồn kho (một store) đáp ứng đủ số lượng.
+    """
+    return {vid for vid, qty in demand.items() if row.get(vid, 0) >= qty}
+
+
+def nearest_candidates(user_lat, user_lon, demand: Dict[int, int], stock, limit: int):
+    """
+    Store ứng viên cho allocation engine: duyệt các store có hàng theo thứ tự
+    gần -> xa trên KD-tree (StoreIndex.nearest), dừng khi đã lấy ít nhất `limit`
+    store VÀ các store đã lấy đủ hàng cho cả giỏ. Store xa hơn không cần tính
+    khoảng cách. Trả về [(store_id, km, {variant_id: tồn kho})].
+    """
+    remaining = dict(demand)
+    candidates = []
+    for sid, dist in get_store_index().nearest(user_lat, user_lon, predicate=stock.__contains__):
+        row = stock[sid]
+        candidates.append((sid, dist, row))
+        for vid, need in remaining.items():
+            remaining[vid] = max(0, need - row.get(vid, 0))
+        if len(candidates) >= limit and not any(remaining.values()):
+            break
+    return candidates
 
 
-def select_stores_for_order(items_data: List[Dict[str, Any]], user_lat: float, user_lon: float):
+def select_stores_for_order(items_data: List[Dict[str, Any]], user_lat: float, user_lon: float,
+                            fee_for_distances: Callable, coverage=None):
     """
     Chọn store(s) phù hợp để lấy toàn bộ items_data.
-    1. Kiểm tra xem có store nào chứa đủ tất cả variant hay không.
-    2. Nếu không, dùng giải pháp greedy:
-       - Sắp xếp các store theo khoảng cách tăng dần.
-       - Lần lượt chọn store gần nhất có ít nhất một variant còn thiếu.
-       - Dừng khi đã bao phủ tất cả variant.
+    1. Dựng ma trận tồn kho store × variant (1 truy vấn), rồi lấy các store có
+       hàng gần nhất (KD-tree, tối đa ALLOCATION_MAX_CANDIDATES store nếu chừng
+       đó đã đủ hàng) làm ứng viên.
+    2. Giao cho allocation engine (app/allocation.py) tìm phương án có chi phí
+       thấp nhất theo phí ship + số chuyến; một variant có thể được chia cho
+       nhiều store nếu không store nào đủ số lượng.
+    `fee_for_distances` là biểu phí của đơn (fees.fee_schedule: mã phí, số món,
+    tỉnh / huyện giao tới) — allocation tối ưu theo đúng phí khách sẽ trả.
+    `coverage` là bộ ba (demand, stores, stock) dựng sẵn (vd từ snapshot tồn kho
+    của báo giá, app/quotes.py); mặc định đọc tồn kho hiện tại từ DB.
     Trả về danh sách các dict:
       [
         {
           'store': Store instance,
           'distance': float,
-          'variants': set(variant_ids)
+          'variants': set(variant_ids),
+          'quantities': {variant_id: số lượng lấy từ store này}
         },
         ...
       ]
     """
-    # Tập variant cần lấy
-    all_variants = {item['variant'].id for item in items_data}
-
-    # 1. Map store -> set variants it can cover
-    store_cover = {}
-    for store in Store.objects.all():
-        covered = set()
-        for item in items_data:
-            exists = Inventory.objects.filter(
-                store=store,
-                variant=item['variant'],
-                quantity__gte=item['quantity']
-            ).exists()
-            if exists:
-                covered.add(item['variant'].id)
-        if covered:
-            store_cover[store.id] = {
-                'store': store,
-                'variants': covered,
-                'distance': haversine(user_lat, user_lon, store.latitude, store.longitude)
-            }
-
-    # 2. Xem nếu có store đơn lẻ cover all
-    for info in store_cover.values():
-        if info['variants'] >= all_variants:
-            return [{
-                'store': info['store'],
-                'distance': info['distance'],
-                'variants': all_variants
-            }]
-
-    # 3. Greedy cover: sort stores by distance
-    sorted_stores = sorted(store_cover.values(), key=lambda x: x['distance'])
-    uncovered = set(all_variants)
-    selected = []
-    for info in sorted_stores:
-        cover = info['variants'] & uncovered
-        if cover:
-            selected.append({
-                'store': info['store'],
-                'distance': info['distance'],
-                'variants': cover
-            })
-            uncovered -= cover
-            if not uncovered:
-                break
-
-    if uncovered:
+    # 1. Ma trận tồn kho + các store có hàng gần nhất
+    demand, stores, stock = coverage or build_coverage_matrix(items_data)
+    problem = AllocationProblem(
+        demand,
+        nearest_candidates(user_lat, user_lon, demand, stock,
+                           getattr(settings, 'ALLOCATION_MAX_CANDIDATES', 20)),
+    )
+
+    shortage = problem.shortage()
+    if shortage:
         missing = []
-        for vid in uncovered:
+        for vid in shortage:
             var = next(item['variant'] for item in items_data if item['variant'].id == vid)
             missing.append(f"{var.product.name} - {var.size} - {var.color}")
         raise ValidationError(f"Không đủ tồn kho cho: {', '.join(missing)}")
 
-    return selected
+    # 2. Tìm phương án phân bổ
+    allocation = get_allocation_engine().allocate(problem, fee_for_distances)
+    if allocation is None:
+        raise ValidationError("Không tìm được phương án lấy hàng cho đơn này")
+
+    return [
+        {
+            'store': stores[shipment['store_id']],
+            'distance': shipment['distance'],
+            'variants': set(shipment['quantities']),
+            'quantities': shipment['quantities'],
+        }
+        for shipment in allocation.shipments
+    ]
@@ -0,0 +1,206 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import bump_generation, catalog_cache
+from .geo import STORES_GENERATION
+from .models import (
+    Category,
+    FeeRate,
+    FeeType,
+    Inventory,
+    Order,
+    Product,
+    ProductCategory,
+    ProductVariant,
+    Store,
+    Voucher,
+)
+from . import search, vouchers
+from .analytics import schedule_rollup
+from .availability import assign_store_province, refresh_availability, refresh_store_availability
+from .categories import CATEGORIES_GENERATION, check_parent, sync_path
+from .emails import FRAGMENTS_GENERATION, STATUS_EMAILS, enqueue_order_email
+from .fees import FEES_GENERATION
+from .summaries import refresh_product_summaries
+
+
+# Cache / index trong bộ nhớ chỉ mất hiệu lực SAU commit: làm ngay trong
+# post_save thì request khác có thể nạp lại dữ liệu cũ (chưa commit) vào cache
+# trước khi transaction ghi xong, và bản cũ đó sống hết TTL.
+
+def bump_after_commit(name: str):
+    transaction.on_commit(lambda: bump_generation(name))
+
+
+@receiver(post_save, sender=Store)
+@receiver(post_delete, sender=Store)
+def invalidate_store_index(sender, **kwargs):
+    bump_after_commit(STORES_GENERATION)
+
+
+@receiver(post_init, sender=Store)
+def remember_store_location(sender, instance, **kwargs):
+    instance._loaded_location = instance.__dict__.get('location')
+    instance._loaded_province = instance.__dict__.get('province_id')
+
+
+@receiver(pre_save, sender=Store)
+def assign_province_from_location(sender, instance, raw=False, **kwargs):
+    if not raw:
+        assign_store_province(instance, instance.location != getattr(instance, '_loaded_location', None))
+
+
+@receiver(post_save, sender=Store)
+def refresh_store_regions(sender, instance, created, **kwargs):
+    """Store đổi tỉnh: tồn kho của nó chuyển sang tỉnh mới trong regional_availability."""
+    previous = getattr(instance, '_loaded_province', None)
+    instance._loaded_location = instance.location
+    instance._loaded_province = instance.province_id
+    if not created and previous != instance.province_id:
+        store_id = instance.id
+        transaction.on_commit(lambda: refresh_store_availability([store_id]))
+
+
+@receiver(post_save, sender=FeeType)
+@receiver(post_delete, sender=FeeType)
+@receiver(post_save, sender=FeeRate)
+@receiver(post_delete, sender=FeeRate)
+def invalidate_fee_tables(sender, **kwargs):
+    bump_after_commit(FEES_GENERATION)
+
+
+@receiver(pre_save, sender=Category)
+def validate_category_parent(sender, instance, **kwargs):
+    # chặn cả những chỗ lưu thẳng không qua full_clean() (form / admin gọi Category.clean())
+    check_parent(instance)
+
+
+@receiver(post_save, sender=Category)
+def maintain_category_path(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sync_path(instance)
+    bump_after_commit(CATEGORIES_GENERATION)
+
+
+@receiver(post_delete, sender=Category)
+def forget_category(sender, instance, **kwargs):
+    # các category con bị SET_NULL parent: dựng lại path cho cây con đó
+    orphans = Category.objects.filter(path__startswith=instance.path, parent__isnull=True).exclude(id=instance.id)
+    for child in orphans:
+        sync_path(child)
+    bump_after_commit(CATEGORIES_GENERATION)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def invalidate_email_fragments(sender, **kwargs):
+    bump_after_commit(FRAGMENTS_GENERATION)
+
+
+@receiver(post_init, sender=Order)
+def remember_order_status(sender, instance, **kwargs):
+    # đọc qua __dict__ để không kích hoạt truy vấn khi status bị defer
+    instance._loaded_status = instance.__dict__.get('status')
+    instance._rollup_status = instance._loaded_status
+
+
+@receiver(post_save, sender=Order)
+def notify_order_status(sender, instance, created, **kwargs):
+    """Đơn chuyển sang shipped / cancelled thì xếp email thông báo (sau commit)."""
+    previous = getattr(instance, '_loaded_status', None)
+    instance._loaded_status = instance.status
+    if created or previous == instance.status:
+        return
+    kind = STATUS_EMAILS.get(instance.status)
+    if kind:
+        order_id = instance.id
+        transaction.on_commit(lambda: enqueue_order_email(order_id, kind))
+
+
+@receiver(post_save, sender=Order)
+def schedule_sales_rollup(sender, instance, created, raw=False, **kwargs):
+    """Đơn mới hoặc đổi trạng thái: hẹn tổng hợp lại doanh số (app/analytics.py)."""
+    if raw:
+        return
+    if created or getattr(instance, '_rollup_status', None) != instance.status:
+        instance._rollup_status = instance.status
+        transaction.on_commit(schedule_rollup)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def invalidate_catalog_cache(sender, **kwargs):
+    transaction.on_commit(catalog_cache.invalidate)
+
+
+@receiver(post_save, sender=Product)
+def create_product_summary(sender, instance, created, **kwargs):
+    if created:
+        refresh_product_summaries([instance.id])
+
+
+# Tính lại summary sau commit: khi xoá Product, post_delete của variant /
+# inventory chạy giữa lúc cascade (Product chưa bị xoá), upsert ngay sẽ ghi lại
+# dòng product_summaries vừa bị xoá và vỡ khoá ngoại. Sau commit, sản phẩm đã
+# xoá bị refresh_product_summaries bỏ qua.
+
+def refresh_offers(product_ids):
+    """Sau commit: tính lại summary rồi cập nhật giá / còn hàng trong index tìm kiếm từ summary đó."""
+    def run():
+        refresh_product_summaries(product_ids)
+        search.sync_offers(product_ids)
+    transaction.on_commit(run)
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def refresh_variant_offer(sender, instance, **kwargs):
+    refresh_offers([instance.product_id])
+
+
+@receiver(post_save, sender=Inventory)
+@receiver(post_delete, sender=Inventory)
+def refresh_inventory_offer(sender, instance, **kwargs):
+    # tỉnh còn hàng ghi ngay trong transaction (index tìm kiếm đọc lại sau commit);
+    # tra product_id ngay: sau commit variant có thể đã bị xoá cùng sản phẩm
+    refresh_availability([instance.variant_id])
+    product_ids = list(
+        ProductVariant.objects.filter(id=instance.variant_id).values_list('product_id', flat=True)
+    )
+    if product_ids:
+        refresh_offers(product_ids)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    search.index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.unindex_product(instance.id)
+
+
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+def reindex_product_categories(sender, instance, **kwargs):
+    search.reindex_categories(instance.product_id)
+
+
+@receiver(post_save, sender=Voucher)
+def index_voucher(sender, instance, **kwargs):
+    vouchers.index_voucher(instance)
+
+
+@receiver(post_delete, sender=Voucher)
+def unindex_voucher(sender, instance, **kwargs):
+    vouchers.unindex_voucher(instance.id)
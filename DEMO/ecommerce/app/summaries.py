@@ -0,0 +1,104 @@
+from typing import Iterable, Optional
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+
+from .bulk import upsert
+from .cache import catalog_cache
+from .inventory import get_sharded_keys, pairs_q, sharded_keys_for, sharded_stock
+from .models import Inventory, Product, ProductSummary, ProductVariant
+
+SUMMARY_FIELDS = ['min_price', 'max_price', 'total_stock', 'in_stock', 'variant_count', 'updated_at']
+
+# Các cột mà response danh sách đã cache phụ thuộc vào (lọc in_stock, lọc / sắp theo giá).
+# total_stock chỉ dùng cho sort_by=stock: thứ tự lệch tạm thời, hết khi entry hết TTL.
+LISTING_FIELDS = ('min_price', 'max_price', 'in_stock')
+
+
+def compute_summaries(product_ids: Iterable[int]):
+    """
+    Tính ProductSummary (chưa lưu) cho các sản phẩm, 3 truy vấn gộp nhóm (thêm
+    2 nếu sản phẩm có cặp store/variant đang chia shard).
+    Sản phẩm chưa có variant vẫn có summary (giá NULL, hết hàng).
+    Trả về (summaries, changed): changed là tập id sản phẩm có LISTING_FIELDS
+    khác dòng đang lưu (hoặc chưa có dòng).
+    """
+    product_ids = list(product_ids)
+    summaries = {pid: ProductSummary(product_id=pid) for pid in product_ids}
+    stored = {
+        row[0]: row[1:]
+        for row in ProductSummary.objects.filter(product_id__in=product_ids).values_list('product_id', *LISTING_FIELDS)
+    }
+
+    variants = (
+        ProductVariant.objects
+        .filter(product_id__in=product_ids)
+        .values('product_id')
+        .annotate(pmin=Min('price'), pmax=Max('price'), n=Count('id'))
+    )
+    for r in variants:
+        s = summaries[r['product_id']]
+        s.min_price, s.max_price, s.variant_count = r['pmin'], r['pmax'], r['n']
+
+    # cặp đang chia shard: Inventory.quantity không bị trừ khi đặt hàng, đọc tổng shard
+    hot_products = {}
+    sharded_variants = {vid for _, vid in get_sharded_keys()}
+    if sharded_variants:
+        hot_products = dict(
+            ProductVariant.objects
+            .filter(id__in=sharded_variants, product_id__in=product_ids)
+            .values_list('id', 'product_id')
+        )
+    hot = sharded_keys_for(hot_products)
+
+    stock = Inventory.objects.filter(variant__product_id__in=product_ids, quantity__gt=0)
+    if hot:
+        stock = stock.exclude(pairs_q(hot))
+    for r in stock.values('variant__product_id').annotate(total=Sum('quantity')):
+        summaries[r['variant__product_id']].total_stock = r['total'] or 0
+    for (_, vid), qty in sharded_stock(hot).items():
+        summaries[hot_products[vid]].total_stock += max(qty, 0)
+    for s in summaries.values():
+        s.in_stock = s.total_stock > 0
+
+    changed = {
+        pid for pid, s in summaries.items()
+        if stored.get(pid) != tuple(getattr(s, f) for f in LISTING_FIELDS)
+    }
+    return list(summaries.values()), changed
+
+
+def refresh_product_summaries(product_ids: Iterable[int]) -> int:
+    """
+    Tính lại và upsert summary cho các sản phẩm (bỏ qua id không tồn tại).
+    Cache catalog chỉ mất hiệu lực (sau commit) khi còn hàng / giá min-max của
+    ít nhất một sản phẩm đổi — đơn hàng chỉ trừ bớt tồn kho thì cache giữ nguyên.
+    """
+    ids = set(Product.objects.filter(id__in=set(product_ids)).values_list('id', flat=True))
+    if not ids:
+        return 0
+    summaries, changed = compute_summaries(ids)
+    upsert(ProductSummary, summaries, unique_fields=['product'], update_fields=SUMMARY_FIELDS)
+    if changed:
+        transaction.on_commit(catalog_cache.invalidate)
+    return len(ids)
+
+
+def rebuild_product_summaries(batch_size: int = 1000, after_id: Optional[int] = None) -> int:
+    """Dựng lại toàn bộ bảng summary theo từng lô sản phẩm."""
+    done = 0
+    dirty = False
+    last = after_id or 0
+    while True:
+        ids = list(
+            Product.objects.filter(id__gt=last).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            if dirty:
+                catalog_cache.invalidate()
+            return done
+        summaries, changed = compute_summaries(ids)
+        upsert(ProductSummary, summaries, unique_fields=['product'], update_fields=SUMMARY_FIELDS)
+        dirty = dirty or bool(changed)
+        done += len(ids)
+        last = ids[-1]
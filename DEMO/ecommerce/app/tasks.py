@@ -1,95 +1,104 @@
 # app/tasks.py
 
-import datetime
 from celery import shared_task
-from django.core.mail import send_mail
-from django.utils import timezone
+from celery.utils.log import get_task_logger
 
-from django.conf import settings
-from .models import Order
+from . import analytics, checkout, emails, outbox, search
+from .emails import enqueue_order_confirmation
+from .models import Order, InventoryShard
+from .availability import refresh_availability
+from .inventory import sync_sharded_inventory
+from .summaries import refresh_product_summaries
+
+logger = get_task_logger(__name__)
 
 @shared_task
 def send_order_confirmation_email(order_id):
-    try:
-        # Lấy order kèm các quan hệ cần thiết
-        order = (
-            Order.objects
-            .select_related('customer__account')
-            .prefetch_related('orderitem_set__variant__product',
-                              'ordervoucher_set__voucher',
-                              'payment_set')
-            .get(id=order_id)
-        )
+    """
+    Xếp email xác nhận đơn vào hàng đợi gom lô (app/emails.py) thay vì mở
+    một kết nối SMTP riêng cho từng đơn.
+    """
+    if not Order.objects.filter(id=order_id).exists():
+        return False
+    enqueue_order_confirmation(order_id)
+    return True
+
 
-        # Tiêu đề
-        subject = f"Xác nhận đơn hàng #{order.id}"
-
-        # 1. Chi tiết sản phẩm
-        items = order.orderitem_set.all()
-        lines = []
-        for item in items:
-            prod = item.variant.product
-            lines.append(
-                f"- {prod.name} (Màu: {item.variant.color}, Size: {item.variant.size}) "
-                f"x{item.quantity} @ {item.price:,}₫ = {item.quantity * item.price:,}₫"
-            )
-        items_detail = "\n".join(lines)
-
-        # 2. Thông tin voucher (nếu có)
-        vouchers = order.ordervoucher_set.all()
-        if vouchers:
-            vlines = []
-            for ov in vouchers:
-                code = ov.voucher.code
-                amt  = ov.discount_amount
-                vlines.append(f"{code}: -{amt:,}₫")
-            vouchers_detail = "\n".join(vlines)
-        else:
-            vouchers_detail = "Không có"
-
-        # 3. Thông tin thanh toán
-        payment = order.payment_set.last()
-        payment_detail = (
-            f"Phương thức: {payment.method}\n"
-            f"Trạng thái: {payment.status}\n"
-            f"Số tiền: {payment.amount:,}₫"
+@shared_task
+def flush_email_jobs(batch_size=None):
+    """
+    Gửi các email đang chờ theo lô qua một kết nối dùng lại.
+    Được hẹn tự động khi có job mới; celery beat chạy thêm định kỳ
+    (CELERY_BEAT_SCHEDULE) để gửi lại các thư lỗi đã tới hạn.
+    """
+    results = emails.flush_email_jobs(batch_size)
+    for stats in results:
+        logger.info(
+            "email batch: %(sent)s gửi, %(retry)s hẹn lại, %(failed)s lỗi "
+            "trong %(seconds)ss (%(per_second)s thư/giây)", stats
         )
+    return results
 
-        # 4. Ước tính thời gian giao hàng
-        dist = order.nearest_store_distance_km or 0
-
-        # tùy khoảng cách <100km → 2 ngày, còn lại 3 ngày
-        days = 2 if dist <= 100 else 3
-        eta_date = timezone.localdate() + datetime.timedelta(days=days)
-        eta_detail = f"Ước tính giao hàng trong {days} ngày (trước {eta_date})"
-
-        # 5. Trạng thái đơn hàng
-        status_detail = f"Trạng thái hiện tại: {order.status}"
-
-        # Nội dung email
-        message = (
-            f"Xin chào {order.customer.full_name or order.customer.account.email},\n\n"
-            f"Bạn vừa đặt thành công đơn hàng #{order.id} vào {order.created_at:%d/%m/%Y %H:%M}.\n\n"
-            f"--- Chi tiết đơn hàng ---\n"
-            f"{items_detail}\n\n"
-            f"Voucher áp dụng:\n{vouchers_detail}\n\n"
-            f"--- Thông tin thanh toán ---\n"
-            f"{payment_detail}\n\n"
-            f"{eta_detail}\n"
-            f"{status_detail}\n\n"
-            f"Cảm ơn bạn đã tin tưởng và sử dụng dịch vụ của chúng tôi!\n"
+
+@shared_task
+def relay_outbox_task():
+    """
+    Đẩy các task trong outbox lên broker. Relay chính là lệnh `relay_outbox --loop`;
+    task này chạy định kỳ qua celery beat (CELERY_BEAT_SCHEDULE) làm lưới an toàn.
+    """
+    return outbox.relay_outbox()
+
+
+@shared_task(bind=True, max_retries=5)
+def allocate_checkout(self, intent_id):
+    """Bước 1 của checkout bất đồng bộ: chọn store, lưu phương án vào intent."""
+    try:
+        return checkout.run_allocate_stage(intent_id)
+    except Exception as exc:
+        checkout.release_intent(intent_id)
+        raise self.retry(exc=exc, countdown=2 ** self.request.retries)
+
+
+@shared_task(bind=True, max_retries=5)
+def commit_checkout(self, intent_id):
+    """Bước 2 của checkout bất đồng bộ: trừ kho, tính tiền, tạo Order."""
+    try:
+        return checkout.run_commit_stage(intent_id)
+    except Exception as exc:
+        checkout.release_intent(intent_id)
+        raise self.retry(exc=exc, countdown=2 ** self.request.retries)
+
+
+@shared_task
+def sync_sharded_inventory_task():
+    """
+    Cập nhật Inventory.quantity từ tổng các shard (cho báo cáo / bộ lọc in_stock, province_id).
+    Chạy định kỳ qua celery beat (CELERY_BEAT_SCHEDULE).
+    """
+    updated = sync_sharded_inventory()
+    if updated:
+        refresh_product_summaries(
+            InventoryShard.objects.values_list('variant__product_id', flat=True).distinct()
         )
+        refresh_availability(InventoryShard.objects.values_list('variant_id', flat=True).distinct())
+    return updated
+
 
-        # Gửi mail
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [order.customer.account.email],
-            fail_silently=False,
+@shared_task
+def refresh_sales_rollups():
+    """
+    Tổng hợp doanh số cho các đơn mới / đổi trạng thái kể từ watermark.
+    Được hẹn khi đơn đổi trạng thái; celery beat chạy thêm định kỳ (CELERY_BEAT_SCHEDULE).
+    """
+    stats = analytics.refresh_sales_rollups()
+    if stats:
+        logger.info(
+            "sales rollup: %(orders)s đơn, %(days)s ngày, %(rows)s dòng trong %(seconds)ss", stats
         )
-        return True
+    return stats
 
-    except Order.DoesNotExist:
-        return False
 
+@shared_task
+def publish_search_updates():
+    """Báo các tiến trình dựng lại index tìm kiếm sau một loạt cập nhật tăng dần."""
+    return search.publish_updates()
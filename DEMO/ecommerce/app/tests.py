@@ -1,3 +1,626 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+import threading
+import uuid
+
+from django.db import OperationalError, connection, transaction
+from django.core import mail
+from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    Account, Category, Commune, Customer, District, EmailJob, FeeRate, FeeType, Inventory, Order, OrderItem, OutboxMessage,
+    Product, ProductSummary, ProductVariant, Province, RegionalAvailability, Store, UserAddress, UserVoucher,
+    Voucher,
+)
+from .allocation import AllocationProblem, get_allocation_engine
+from .availability import refresh_availability
+from .cache import bump_generation
+from .checkout import run_allocate_stage, run_commit_stage, submit_checkout
+from .emails import FLUSH_SCHEDULED_KEY, enqueue_order_confirmation, flush_email_jobs
+from .fees import fee_schedule
+from .idempotency import IN_FLIGHT, _cache_key
+from .inventory import disable_sharding, enable_sharding, reserve_stock, sharded_stock
+from .outbox import InMemoryPublisher, enqueue_task, relay_outbox
+from .search import SEARCH_GENERATION, get_search_index
+from .services import nearest_candidates
+from .summaries import refresh_product_summaries
+from .vouchers import claim_user_voucher, get_voucher_index
+
+
+class CascadeDeleteTests(TestCase):
+    """Xoá Product / ProductVariant / Store kéo theo inventory mà summary vẫn đúng."""
+
+    def setUp(self):
+        Province.objects.create(name='Hà Nội')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(name='Giày chạy bộ')
+            self.variant = ProductVariant.objects.create(
+                product=self.product, color='red', size='40', price=Decimal('100000.00'))
+            self.store = Store.objects.create(name='Kho A', location='Hà Nội, Hoàn Kiếm')
+            Inventory.objects.create(store=self.store, variant=self.variant, quantity=5)
+
+    def test_summary_tracks_inventory(self):
+        summary = ProductSummary.objects.get(product=self.product)
+        self.assertEqual(summary.total_stock, 5)
+        self.assertTrue(summary.in_stock)
+
+    def test_delete_product(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertFalse(ProductSummary.objects.filter(product_id=self.product.id).exists())
+        self.assertFalse(Inventory.objects.exists())
+        self.assertFalse(RegionalAvailability.objects.exists())
+
+    def test_delete_variant(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.variant.delete()
+        summary = ProductSummary.objects.get(product=self.product)
+        self.assertEqual(summary.variant_count, 0)
+        self.assertEqual(summary.total_stock, 0)
+        self.assertFalse(summary.in_stock)
+
+    def test_delete_store(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.store.delete()
+        summary = ProductSummary.objects.get(product=self.product)
+        self.assertEqual(summary.variant_count, 1)
+        self.assertEqual(summary.total_stock, 0)
+        self.assertFalse(RegionalAvailability.objects.exists())
+
+    def test_stock_change_keeps_catalog_cache(self):
+        Inventory.objects.filter(variant=self.variant).update(quantity=3)
+        with self.captureOnCommitCallbacks() as callbacks:
+            refresh_product_summaries([self.product.id])
+        self.assertEqual(callbacks, [])
+        self.assertEqual(ProductSummary.objects.get(product=self.product).total_stock, 3)
+
+        Inventory.objects.filter(variant=self.variant).update(quantity=0)
+        with self.captureOnCommitCallbacks() as callbacks:
+            refresh_product_summaries([self.product.id])
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(ProductSummary.objects.get(product=self.product).in_stock)
+
+    def test_quantity_change_keeps_availability_rows(self):
+        row = RegionalAvailability.objects.get(variant=self.variant)
+        Inventory.objects.filter(variant=self.variant).update(quantity=2)
+        with self.captureOnCommitCallbacks() as callbacks:
+            refresh_availability([self.variant.id])
+        self.assertEqual(callbacks, [])
+        self.assertEqual(RegionalAvailability.objects.get(id=row.id).quantity, 2)
+
+        Inventory.objects.filter(variant=self.variant).update(quantity=0)
+        with self.captureOnCommitCallbacks() as callbacks:
+            refresh_availability([self.variant.id])
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(RegionalAvailability.objects.exists())
+
+
+class VoucherIndexTests(TestCase):
+    """Index voucher trong bộ nhớ chỉ đổi sau commit."""
+
+    def test_rollback_leaves_no_phantom_voucher(self):
+        get_voucher_index()
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Voucher.objects.create(code='GHOST', voucher_type='discount', discount_amount=Decimal('10000'))
+                raise RuntimeError
+        self.assertIsNone(get_voucher_index().get('GHOST'))
+
+    def test_commit_indexes_voucher(self):
+        get_voucher_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            voucher = Voucher.objects.create(code='SALE', voucher_type='discount', discount_amount=Decimal('10000'))
+        self.assertEqual(get_voucher_index().get('SALE').id, voucher.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            voucher.delete()
+        self.assertIsNone(get_voucher_index().get('SALE'))
+
+
+class SearchIndexTests(TestCase):
+    """Index tìm kiếm trong bộ nhớ chỉ đổi sau commit."""
+
+    def setUp(self):
+        # index là biến toàn tiến trình: không giữ sản phẩm của test trước
+        bump_generation(SEARCH_GENERATION)
+
+    def test_rollback_leaves_product_unsearchable(self):
+        get_search_index()
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Product.objects.create(name='Áo khoác gió')
+                raise RuntimeError
+        self.assertEqual(get_search_index().search('khoac'), [])
+
+    def test_commit_indexes_product_and_offer(self):
+        Province.objects.create(name='Đà Nẵng')
+        get_search_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Áo khoác gió')
+            variant = ProductVariant.objects.create(
+                product=product, color='blue', size='M', price=Decimal('250000.00'))
+            store = Store.objects.create(name='Kho B', location='Đà Nẵng')
+            Inventory.objects.create(store=store, variant=variant, quantity=2)
+        index = get_search_index()
+        self.assertEqual([pid for pid, _ in index.search('khoac', in_stock=True)], [product.id])
+        self.assertEqual([pid for pid, _ in index.search('khoac', province_id=store.province_id)], [product.id])
+
+
+class NearestCandidatesTests(TestCase):
+    """Ứng viên phân bổ lấy theo thứ tự gần -> xa trên KD-tree, dừng khi đủ hàng."""
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.near = Store.objects.create(name='Gần', latitude=21.03, longitude=105.85)
+            self.mid = Store.objects.create(name='Vừa', latitude=20.0, longitude=105.8)
+            self.far = Store.objects.create(name='Xa', latitude=10.8, longitude=106.7)
+
+    def test_stops_once_demand_is_covered(self):
+        stock = {self.far.id: {1: 5}, self.mid.id: {1: 1}, self.near.id: {1: 1}}
+        found = nearest_candidates(21.0, 105.8, {1: 2}, stock, limit=1)
+        self.assertEqual([sid for sid, _, _ in found], [self.near.id, self.mid.id])
+        self.assertLess(found[0][1], found[1][1])
+
+    def test_limit_keeps_extra_candidates(self):
+        stock = {self.far.id: {1: 5}, self.near.id: {1: 5}}
+        found = nearest_candidates(21.0, 105.8, {1: 2}, stock, limit=2)
+        self.assertEqual([sid for sid, _, _ in found], [self.near.id, self.far.id])
+
+
+class AllocationFeeTests(TestCase):
+    """Allocation tối ưu theo đúng biểu phí FeeRate của địa chỉ giao."""
+
+    def setUp(self):
+        self.province = Province.objects.create(name='Cần Thơ')
+        with self.captureOnCommitCallbacks(execute=True):
+            FeeType.objects.create(code='standard', name='Tiêu chuẩn')
+            # tỉnh này: giao gần đắt, giao xa rẻ (ngược khung mặc định)
+            FeeRate.objects.create(fee_type_id='standard', province=self.province,
+                                   max_distance_km=Decimal('100'), min_quantity=1, amount=Decimal('60000'))
+            FeeRate.objects.create(fee_type_id='standard', province=self.province,
+                                   max_distance_km=None, min_quantity=1, amount=Decimal('15000'))
+
+    def allocate(self, fees):
+        problem = AllocationProblem({1: 2}, [(1, 10.0, {1: 1}), (2, 20.0, {1: 1}), (3, 300.0, {1: 2})])
+        allocation = get_allocation_engine().allocate(problem, fees)
+        return sorted(s['store_id'] for s in allocation.shipments)
+
+    def test_default_bands_prefer_near_stores(self):
+        self.assertEqual(self.allocate(fee_schedule('standard', 2)), [1, 2])
+
+    def test_province_rates_change_the_plan(self):
+        self.assertEqual(self.allocate(fee_schedule('standard', 2, self.province.id)), [3])
+
+
+class ShardedReservationStressTests(TransactionTestCase):
+    """Nhiều writer song song giữ hàng trên một SKU chia shard: không oversell."""
+
+    STOCK = 60
+    SHARDS = 4
+
+    def setUp(self):
+        Province.objects.create(name='Hà Nội')
+        self.store = Store.objects.create(name='Kho A', location='Hà Nội')
+        self.product = Product.objects.create(name='Giày chạy bộ')
+        self.variant = ProductVariant.objects.create(
+            product=self.product, color='red', size='40', price=Decimal('100000.00'))
+        Inventory.objects.create(store=self.store, variant=self.variant, quantity=self.STOCK)
+        enable_sharding(self.store.id, self.variant.id, self.SHARDS)
+        self.key = (self.store.id, self.variant.id)
+
+    def left(self):
+        return sharded_stock([self.key]).get(self.key, 0)
+
+    def run_writers(self, writers, qty):
+        sold = []
+        errors = []
+
+        def writer():
+            try:
+                while True:
+                    try:
+                        with transaction.atomic():
+                            ok = reserve_stock([(self.store.id, self.variant.id, qty)])
+                            if not ok:
+                                transaction.set_rollback(True)
+                    except OperationalError:
+                        # database is locked / deadlock: thử lại
+                        continue
+                    if ok:
+                        sold.append(qty)
+                    elif self.left() < qty:
+                        break
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer) for _ in range(writers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        return sum(sold)
+
+    def reset_stock(self):
+        disable_sharding(self.store.id, self.variant.id)
+        Inventory.objects.filter(store=self.store, variant=self.variant).update(quantity=self.STOCK)
+        enable_sharding(self.store.id, self.variant.id, self.SHARDS)
+
+    def test_no_oversell(self):
+        for qty in (1, 7):
+            with self.subTest(qty=qty):
+                self.reset_stock()
+                sold = self.run_writers(4, qty)
+                left = self.left()
+                self.assertGreaterEqual(left, 0)
+                self.assertLess(left, qty)
+                self.assertEqual(sold + left, self.STOCK)
+
+    def test_summary_reads_shard_totals(self):
+        # 20 > 60 / 4: không shard nào đủ một mình, đi nhánh khoá theo thứ tự
+        with transaction.atomic():
+            self.assertTrue(reserve_stock([(self.store.id, self.variant.id, 20)]))
+            self.assertTrue(reserve_stock([(self.store.id, self.variant.id, 3)]))
+        refresh_product_summaries([self.product.id])
+        refresh_availability([self.variant.id])
+        self.assertEqual(self.left(), self.STOCK - 23)
+        self.assertEqual(ProductSummary.objects.get(product=self.product).total_stock, self.STOCK - 23)
+        self.assertEqual(RegionalAvailability.objects.get(variant=self.variant).quantity, self.STOCK - 23)
+        # Inventory.quantity chưa đồng bộ (sync_sharded_inventory chạy định kỳ)
+        self.assertEqual(Inventory.objects.get(store=self.store, variant=self.variant).quantity, self.STOCK)
+
+
+class CheckoutFixture:
+    """Khách + địa chỉ ở Quận 1, một store gần có 10 đôi giày, mã phí `shipping`."""
+
+    def setUp(self):
+        super().setUp()
+        province = Province.objects.create(name='Hồ Chí Minh')
+        district = District.objects.create(province=province, name='Quận 1')
+        commune = Commune.objects.create(district=district, name='Bến Nghé')
+        account = Account.objects.create(email='khach@example.com', password_hash='x', role='customer')
+        self.customer = Customer.objects.create(account=account, full_name='Lê Thanh', phone='0912000000')
+        self.address = UserAddress.objects.create(
+            customer=self.customer, province=province, district=district, commune=commune,
+            address_line='1 Lê Lợi', latitude=Decimal('10.773454'), longitude=Decimal('106.700983'),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            FeeType.objects.create(code='shipping', name='Giao hàng')
+            self.store = Store.objects.create(
+                name='Kho Quận 1', location='Hồ Chí Minh, Quận 1',
+                latitude=Decimal('10.776530'), longitude=Decimal('106.700981'),
+            )
+            self.product = Product.objects.create(name='Giày chạy bộ')
+            self.variant = ProductVariant.objects.create(
+                product=self.product, color='red', size='40', price=Decimal('100000.00'))
+            Inventory.objects.create(store=self.store, variant=self.variant, quantity=10)
+
+    def payload(self, quantity=1, **extra):
+        data = {
+            'customer': self.customer.id,
+            'shipping_address_id': self.address.id,
+            'payment_method': 'COD',
+            'shipping_fee_type': 'shipping',
+            'items': [{'product_id': self.product.id, 'color': 'red', 'size': '40', 'quantity': quantity}],
+        }
+        data.update(extra)
+        return data
+
+    def stock(self):
+        return Inventory.objects.get(store=self.store, variant=self.variant).quantity
+
+    def create_order(self):
+        return Order.objects.create(customer=self.customer, status='pending', total_amount=Decimal('100000.00'))
+
+
+class EmailBatchTests(CheckoutFixture, TestCase):
+    """Email xác nhận xếp hàng theo đơn rồi gửi theo lô (backend locmem)."""
+
+    def setUp(self):
+        super().setUp()
+        cache.delete(FLUSH_SCHEDULED_KEY)
+
+    def test_flush_sends_each_pending_job_once(self):
+        orders = [self.create_order() for _ in range(3)]
+        for order in orders:
+            enqueue_order_confirmation(order.id)
+        # đơn đã có job đang chờ thì không xếp thêm
+        self.assertIsNone(enqueue_order_confirmation(orders[0].id))
+
+        results = flush_email_jobs(batch_size=2)
+        self.assertEqual([r['sent'] for r in results], [2, 1])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            sorted(m.subject for m in mail.outbox),
+            sorted(f"Xác nhận đơn hàng #{o.id}" for o in orders),
+        )
+        self.assertEqual(mail.outbox[0].to, ['khach@example.com'])
+        self.assertFalse(EmailJob.objects.exclude(status='sent').exists())
+
+        self.assertEqual(flush_email_jobs(), [])
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_rolled_back_job_schedules_nothing(self):
+        order = self.create_order()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    enqueue_order_confirmation(order.id)
+                    raise RuntimeError
+        self.assertFalse(EmailJob.objects.exists())
+        self.assertIsNone(cache.get(FLUSH_SCHEDULED_KEY))
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=False, OUTBOX_MAX_ATTEMPTS=2)
+class OutboxRelayTests(TestCase):
+    """Relay đẩy message đã commit qua publisher, đúng thứ tự, gửi lại khi lỗi."""
+
+    def test_relays_committed_messages_in_order(self):
+        with self.captureOnCommitCallbacks():
+            enqueue_task('app.tasks.a', args=[1])
+            enqueue_task('app.tasks.b', kwargs={'x': 2})
+        publisher = InMemoryPublisher()
+        results = relay_outbox(publisher=publisher)
+        self.assertEqual(results[0]['sent'], 2)
+        self.assertEqual([(task, args, kwargs) for _, task, args, kwargs in publisher.published],
+                         [('app.tasks.a', [1], {}), ('app.tasks.b', [], {'x': 2})])
+        self.assertFalse(OutboxMessage.objects.exclude(status='sent').exists())
+
+        self.assertEqual(relay_outbox(publisher=publisher), [])
+        self.assertEqual(len(publisher.published), 2)
+
+    def test_rolled_back_task_is_never_sent(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                enqueue_task('app.tasks.a')
+                raise RuntimeError
+        publisher = InMemoryPublisher()
+        relay_outbox(publisher=publisher)
+        self.assertEqual(publisher.published, [])
+
+    def test_countdown_delays_message(self):
+        enqueue_task('app.tasks.a', countdown=60)
+        publisher = InMemoryPublisher()
+        self.assertEqual(relay_outbox(publisher=publisher), [])
+        OutboxMessage.objects.update(available_at=timezone.now())
+        relay_outbox(publisher=publisher)
+        self.assertEqual(len(publisher.published), 1)
+
+    def test_failed_publish_is_retried_then_failed(self):
+        enqueue_task('app.tasks.broken')
+        enqueue_task('app.tasks.a')
+        publisher = InMemoryPublisher(fail_tasks=['app.tasks.broken'])
+
+        relay_outbox(publisher=publisher)
+        broken = OutboxMessage.objects.get(task='app.tasks.broken')
+        self.assertEqual((broken.status, broken.attempts), ('pending', 1))
+        self.assertGreater(broken.available_at, timezone.now())
+        self.assertEqual([task for _, task, _, _ in publisher.published], ['app.tasks.a'])
+
+        OutboxMessage.objects.filter(id=broken.id).update(available_at=timezone.now())
+        relay_outbox(publisher=publisher)
+        broken.refresh_from_db()
+        self.assertEqual((broken.status, broken.attempts), ('failed', 2))
+        self.assertIn('ConnectionError', broken.last_error)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=False)
+class AsyncCheckoutTests(CheckoutFixture, TestCase):
+    """Pipeline checkout bất đồng bộ: allocate -> commit, phân bổ lại khi tồn kho đổi."""
+
+    def intent(self, quantity=2):
+        intent = submit_checkout(self.payload(quantity))
+        self.assertEqual((intent.stage, intent.status), ('received', 'pending'))
+        return intent
+
+    def test_allocate_then_commit_creates_order(self):
+        intent = self.intent()
+        self.assertEqual(run_allocate_stage(intent.id), 'allocated')
+        intent.refresh_from_db()
+        self.assertEqual(intent.stage, 'allocated')
+        self.assertEqual(intent.plan[0]['store_id'], self.store.id)
+
+        self.assertEqual(run_commit_stage(intent.id), 'completed')
+        intent.refresh_from_db()
+        self.assertEqual((intent.stage, intent.status), ('completed', 'completed'))
+        self.assertEqual(OrderItem.objects.get(order=intent.order).quantity, 2)
+        self.assertEqual(self.stock(), 8)
+
+        # message bị giao lại: bước đã xong thì bỏ qua
+        self.assertIsNone(run_allocate_stage(intent.id))
+        self.assertIsNone(run_commit_stage(intent.id))
+        self.assertEqual(self.stock(), 8)
+
+    def test_stock_change_reallocates(self):
+        intent = self.intent()
+        run_allocate_stage(intent.id)
+        Inventory.objects.filter(store=self.store).update(quantity=1)
+
+        self.assertEqual(run_commit_stage(intent.id), 'reallocating')
+        intent.refresh_from_db()
+        self.assertEqual((intent.stage, intent.status, intent.reallocations), ('received', 'pending', 1))
+        self.assertIsNone(intent.plan)
+        self.assertFalse(Order.objects.exists())
+
+        Inventory.objects.filter(store=self.store).update(quantity=5)
+        self.assertEqual(run_allocate_stage(intent.id), 'allocated')
+        self.assertEqual(run_commit_stage(intent.id), 'completed')
+        self.assertEqual(self.stock(), 3)
+
+    @override_settings(CHECKOUT_MAX_REALLOCATIONS=0)
+    def test_gives_up_after_max_reallocations(self):
+        intent = self.intent()
+        run_allocate_stage(intent.id)
+        Inventory.objects.filter(store=self.store).update(quantity=1)
+
+        self.assertEqual(run_commit_stage(intent.id), 'failed')
+        intent.refresh_from_db()
+        self.assertEqual(intent.status, 'failed')
+        self.assertIn('Tồn kho vừa thay đổi', intent.error)
+        self.assertEqual(self.stock(), 1)
+
+
+class IdempotentOrderTests(CheckoutFixture, TestCase):
+    """POST /api/orders/ kèm Idempotency-Key: gửi lại không tạo đơn lần hai."""
+
+    def setUp(self):
+        super().setUp()
+        self.key = uuid.uuid4().hex
+
+    def post(self, quantity=1):
+        return self.client.post(
+            reverse('order-list'), self.payload(quantity), content_type='application/json',
+            headers={'Idempotency-Key': self.key},
+        )
+
+    def test_replay_returns_first_response(self):
+        first = self.post()
+        self.assertEqual(first.status_code, 201)
+        second = self.post()
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.json()['order_id'], first.json()['order_id'])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(self.stock(), 9)
+
+    def test_same_key_other_body_is_rejected(self):
+        self.assertEqual(self.post().status_code, 201)
+        response = self.post(quantity=2)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0)
+    def test_in_flight_request_conflicts(self):
+        self.assertEqual(self.post().status_code, 201)
+        # giả lập request đầu vẫn đang chạy (cùng nội dung)
+        cache_key = _cache_key(f'orders:{self.customer.id}', self.key)
+        cache.set(cache_key, (IN_FLIGHT, cache.get(cache_key)[1]))
+
+        response = self.post()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(self.stock(), 9)
+
+
+class MissingCoordinatesTests(CheckoutFixture, TestCase):
+    """Địa chỉ chưa có toạ độ: báo lỗi cho địa chỉ đó thay vì 500."""
+
+    def setUp(self):
+        super().setUp()
+        self.no_coords = UserAddress.objects.create(
+            customer=self.customer, province=self.address.province, district=self.address.district,
+            commune=self.address.commune, address_line='2 Lê Lợi',
+        )
+
+    def test_quote_marks_address_unavailable(self):
+        data = self.payload(shipping_address_ids=[self.address.id, self.no_coords.id])
+        response = self.client.post(reverse('shipping-quote'), data, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        quotes = {q['shipping_address_id']: q for q in response.json()['quotes']}
+        self.assertTrue(quotes[self.address.id]['available'])
+        self.assertEqual(
+            quotes[self.no_coords.id],
+            {'shipping_address_id': self.no_coords.id, 'available': False,
+             'error': "Địa chỉ giao hàng chưa có toạ độ"},
+        )
+
+    def test_order_is_rejected(self):
+        for query in ('', '?async=true'):
+            with self.subTest(query=query):
+                response = self.client.post(
+                    reverse('order-list') + query, self.payload(shipping_address_id=self.no_coords.id),
+                    content_type='application/json',
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("chưa có toạ độ", str(response.json()))
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.stock(), 10)
+
+
+class ConcurrentVoucherClaimTests(TransactionTestCase):
+    """Nhiều checkout song song dùng cùng voucher: UPDATE có điều kiện chỉ cho một bên thắng."""
+
+    def setUp(self):
+        account = Account.objects.create(email='khach@example.com', password_hash='x', role='customer')
+        self.customer = Customer.objects.create(account=account, full_name='Lê Thanh', phone='0912000000')
+        self.voucher = Voucher.objects.create(code='SALE', voucher_type='discount', discount_amount=Decimal('10000'))
+
+    def claim_concurrently(self, workers, user_voucher_id=None):
+        barrier = threading.Barrier(workers)
+        claimed = []
+        errors = []
+
+        def worker():
+            try:
+                barrier.wait()
+                while True:
+                    try:
+                        claimed.append(claim_user_voucher(self.customer.id, self.voucher.id, user_voucher_id))
+                        break
+                    except OperationalError:
+                        # database is locked: thử lại
+                        continue
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        return claimed
+
+    def test_one_copy_is_used_once(self):
+        uv = UserVoucher.objects.create(user=self.customer, voucher=self.voucher)
+        claimed = self.claim_concurrently(8, uv.id)
+        self.assertEqual(claimed.count(uv.id), 1)
+        self.assertEqual(claimed.count(None), 7)
+        uv.refresh_from_db()
+        self.assertTrue(uv.used)
+
+    def test_each_copy_goes_to_one_claim(self):
+        copies = [UserVoucher.objects.create(user=self.customer, voucher=self.voucher).id for _ in range(2)]
+        claimed = self.claim_concurrently(4)
+        self.assertEqual(sorted(c for c in claimed if c is not None), copies)
+        self.assertEqual(claimed.count(None), 2)
+        self.assertFalse(UserVoucher.objects.filter(used=False).exists())
+
+
+class CatalogCacheStatsTests(TestCase):
+    """Số liệu cache catalog chỉ dành cho admin."""
+
+    def test_requires_admin(self):
+        response = self.client.get(reverse('catalog-cache-stats'))
+        self.assertIn(response.status_code, (401, 403))
+
+
+class CategoryParentTests(TestCase):
+    """Đặt parent tạo vòng trong cây category là lỗi validation, không phải 500."""
+
+    def setUp(self):
+        self.root = Category.objects.create(name='Giày')
+        self.child = Category.objects.create(name='Giày chạy bộ', parent=self.root)
+
+    def test_clean_rejects_cycles(self):
+        for parent in (self.root, self.child):
+            with self.subTest(parent=parent.name):
+                self.root.parent = parent
+                with self.assertRaises(ValidationError) as ctx:
+                    self.root.full_clean()
+                self.assertIn('parent', ctx.exception.message_dict)
+
+    def test_save_rejects_cycles(self):
+        self.root.parent = self.child
+        with self.assertRaises(ValidationError):
+            self.root.save()
+        self.root.refresh_from_db()
+        self.assertIsNone(self.root.parent_id)
@@ -1,6 +1,18 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, ProductViewSet, OrderViewSet
+from .views import (
+    CategoryViewSet,
+    ProductViewSet,
+    OrderViewSet,
+    CatalogCacheStatsView,
+    CheckoutIntentView,
+    ShippingQuoteView,
+    SalesRollupListView,
+    MonthlyAOVReportView,
+    ChurnReportView,
+    CohortReportView,
+    RepeatPurchaseReportView,
+)
 
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet, basename='category')
@@ -9,4 +21,12 @@ router.register(r'orders', OrderViewSet, basename='order')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('checkout/<uuid:token>/', CheckoutIntentView.as_view(), name='checkout-intent'),
+    path('quotes/shipping/', ShippingQuoteView.as_view(), name='shipping-quote'),
+    path('reports/sales/', SalesRollupListView.as_view(), name='report-sales'),
+    path('reports/aov/', MonthlyAOVReportView.as_view(), name='report-aov'),
+    path('reports/churn/', ChurnReportView.as_view(), name='report-churn'),
+    path('reports/cohorts/', CohortReportView.as_view(), name='report-cohorts'),
+    path('reports/repeat-purchase/', RepeatPurchaseReportView.as_view(), name='report-repeat-purchase'),
+    path('catalog-cache/stats/', CatalogCacheStatsView.as_view(), name='catalog-cache-stats'),
 ]
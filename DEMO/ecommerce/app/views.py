@@ -1,107 +1,299 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny
-from django.db.models import Q
+from rest_framework.generics import ListAPIView
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.views import APIView
+from rest_framework.exceptions import ValidationError
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from django.db.models import F, Q
+import datetime
+import hashlib
+from decimal import Decimal, InvalidOperation
 
-from .models import Category, Product, Order, ProductCategory
+from .models import Category, CheckoutIntent, Product, Order, ProductCategory, SalesRollup
 from .serializers import (
     CategorySerializer,
     ProductSerializer,
     OrderCreateSerializer,
+    CheckoutIntentSerializer,
+    ShippingQuoteSerializer,
+    SalesRollupSerializer,
 )
-from app.tasks import send_order_confirmation_email
+from app import exports
+from app.emails import enqueue_order_confirmation
+from app.checkout import submit_checkout
+from app.idempotency import idempotent_response
+from app.quotes import quote_shipping
+from app.analytics import add_months, month_start, monthly_aov
+from app.retention import churn, cohorts, repeat_purchase
+from app.cache import catalog_cache
+from app.pagination import CatalogPagination
+from app.search import get_search_index
+from app.categories import breadcrumbs, get_category_tree, subtree_product_ids
+from app.availability import in_stock_product_ids
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+
+# sort_by cho phép -> cột sắp xếp (giá / tồn kho lấy từ product_summaries)
+PRODUCT_SORT_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'price': 'summary__min_price',
+    'max_price': 'summary__max_price',
+    'stock': 'summary__total_stock',
+}
+
+
+def order_products(qs, sort_by):
+    """
+    Sắp xếp theo `sort_by` (vd `price`, `-price`, `name`), luôn kèm `id` để
+    thứ tự ổn định giữa các trang.
+    """
+    if not sort_by:
+        return qs.order_by('id')
+    desc = sort_by.startswith('-')
+    field = PRODUCT_SORT_FIELDS.get(sort_by.lstrip('-'))
+    if field is None:
+        raise ValidationError(
+            f"sort_by không hợp lệ, chỉ nhận: {', '.join(sorted(PRODUCT_SORT_FIELDS))}"
+        )
+    if field == 'id':
+        return qs.order_by('-id' if desc else 'id')
+    key = F(field).desc(nulls_last=True) if desc else F(field).asc(nulls_last=True)
+    return qs.order_by(key, '-id' if desc else 'id')
+
+
+def parse_province_id(params):
+    province_id = params.get('province_id')
+    if not province_id:
+        return None
+    try:
+        return int(province_id)
+    except ValueError:
+        raise ValidationError("Tham số province_id không hợp lệ")
+
+
+def filter_by_summary(qs, params):
+    """
+    Lọc price_min / price_max / in_stock trên bảng product_summaries
+    (một join 1-1, không nhân dòng như join variant/inventory):
+      - price_min: có variant giá >= price_min  <=> max_price >= price_min
+      - price_max: có variant giá <= price_max  <=> min_price <= price_max
+      - in_stock:  true = còn hàng ở ít nhất một store, false = hết hàng
+      - province_id: còn hàng ở store thuộc tỉnh đó (bảng regional_availability,
+        id IN (subquery) trên index (province, product))
+    """
+    price_min = params.get('price_min')
+    price_max = params.get('price_max')
+    try:
+        if price_min:
+            qs = qs.filter(summary__max_price__gte=Decimal(price_min))
+        if price_max:
+            qs = qs.filter(summary__min_price__lte=Decimal(price_max))
+    except InvalidOperation:
+        raise ValidationError("Tham số price_min/price_max không hợp lệ")
+
+    in_stock = params.get('in_stock')
+    if in_stock is not None:
+        qs = qs.filter(summary__in_stock=in_stock.lower() in ['true', '1'])
+
+    province_id = parse_province_id(params)
+    if province_id is not None:
+        qs = qs.filter(id__in=in_stock_product_ids(province_id))
+    return qs
+
+
+class CachedCatalogMixin:
+    """
+    Cache response của list / retrieve (và các action gọi `cached_response`)
+    qua `catalog_cache`. Key = URL đầy đủ (kèm query string, nên các trang /
+    bộ lọc khác nhau là các key khác nhau). Cache tự mất hiệu lực khi
+    Product/Category/ProductCategory/ProductVariant thay đổi (xem signals.py).
+    """
+    cache_ttl = None
+
+    def cached_response(self, request, compute):
+        key = hashlib.sha1(request.build_absolute_uri().encode('utf-8')).hexdigest()
+        data = catalog_cache.get_or_compute(key, lambda: compute().data, ttl=self.cache_ttl)
+        return Response(data)
+
+    def list(self, request, *args, **kwargs):
+        parent = super().list
+        return self.cached_response(request, lambda: parent(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        parent = super().retrieve
+        return self.cached_response(request, lambda: parent(request, *args, **kwargs))
+
+
+class CategoryViewSet(CachedCatalogMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.all().order_by('id')
     serializer_class = CategorySerializer
     permission_classes = [AllowAny]
+    pagination_class = CatalogPagination
+
+    def list(self, request, *args, **kwargs):
+        """
+        GET /api/categories/
+        - Lấy từ ảnh chụp cây trong bộ nhớ (app/categories.py), không truy vấn DB
+        """
+        def compute():
+            rows = [
+                {'id': r['id'], 'name': r['name'], 'description': r['description']}
+                for r in get_category_tree().flat()
+            ]
+            return self.get_paginated_response(self.paginate_queryset(rows))
+        return self.cached_response(request, compute)
+
+    @action(detail=False, methods=['get'], url_path='tree')
+    def tree(self, request):
+        """
+        GET /api/categories/tree/?root_id=...
+        - Toàn bộ cây category (lồng nhau qua `children`), hoặc cây con của root_id
+        """
+        root_id = request.query_params.get('root_id')
+        try:
+            root_id = int(root_id) if root_id else None
+        except ValueError:
+            raise ValidationError("root_id không hợp lệ")
+        return Response(get_category_tree().nested(root_id))
+
+    @action(detail=True, methods=['get'], url_path='breadcrumbs')
+    def breadcrumbs(self, request, pk=None):
+        """
+        GET /api/categories/{pk}/breadcrumbs/
+        - Chuỗi category từ gốc tới category hiện tại
+        """
+        category = self.get_object()
+        serializer = CategorySerializer(breadcrumbs(category), many=True)
+        return Response(serializer.data)
 
     @action(detail=True, methods=['get'], url_path='products')
     def products(self, request, pk=None):
         """
         GET /api/categories/{pk}/products/
-        - Lọc theo price_min, price_max, sort_by
+        - Gồm sản phẩm của mọi category con cháu (?descendants=false: chỉ gắn trực tiếp)
+        - Lọc theo price_min, price_max, in_stock, province_id (còn hàng trong tỉnh), sort_by
+        - ?pagination=cursor cho keyset, ?count=false bỏ đếm tổng
         """
-        category = self.get_object()
-
-        # Lấy tất cả product thuộc category đó
-        qs = Product.objects.filter(
-            productcategory__category=category
-        ).distinct()
+        return self.cached_response(request, lambda: self._products(request))
 
-        price_min = request.query_params.get('price_min')
-        price_max = request.query_params.get('price_max')
-        if price_min:
-            qs = qs.filter(productvariant__price__gte=price_min)
-        if price_max:
-            qs = qs.filter(productvariant__price__lte=price_max)
+    def _products(self, request):
+        category = self.get_object()
+        descendants = request.query_params.get('descendants', 'true').lower() not in ['false', '0']
 
-        sort_by = request.query_params.get('sort_by')
-        if sort_by:
-            qs = qs.order_by(sort_by)
-        else: 
-            qs.order_by('id')
+        # Lấy tất cả product thuộc category đó (và cây con của nó)
+        # dạng id IN (subquery) nên sản phẩm gắn nhiều category con không bị lặp
+        qs = Product.objects.filter(id__in=subtree_product_ids(category, descendants))
+        qs = filter_by_summary(qs, request.query_params)
+        qs = order_products(qs, request.query_params.get('sort_by'))
 
-        page = self.paginate_queryset(qs.distinct())
+        page = self.paginate_queryset(qs)
         serializer = ProductSerializer(page, many=True)
         return self.get_paginated_response(serializer.data)
 
 
-class ProductViewSet(viewsets.ReadOnlyModelViewSet):
+class ProductViewSet(CachedCatalogMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Product.objects.all().order_by('id')
     serializer_class = ProductSerializer
     permission_classes = [AllowAny]
+    pagination_class = CatalogPagination
 
     @action(detail=False, methods=['get'], url_path='search')
     def search(self, request):
         """
-        GET /api/products/search/?q=...&category_id=...&price_min=...&in_stock=...&sort_by=...
+        GET /api/products/search/?q=...&category_id=...&price_min=...&in_stock=...&province_id=...&sort_by=...
         - full-text search trên name & description
-        - filter theo category, price, in_stock
-        - sort & pagination
+        - filter theo category, price, in_stock, province_id (còn hàng ở store trong tỉnh)
+        - sort & pagination (?pagination=cursor cho keyset, ?count=false bỏ đếm tổng)
         """
         q = request.query_params.get('q')
 
-        # lọc theo tên và description
+        # có từ khoá: tra inverted index (app/search.py) thay vì LIKE '%q%'
         if q:
-            qs = Product.objects.filter(
-                Q(name__icontains=q) |
-                Q(description__icontains=q)
-            )
-        else: qs = Product.objects.all()
+            return self._search_index(request, q)
+
+        qs = Product.objects.all()
 
-        # lọc theo category
+        # lọc theo category (gồm cả category con cháu)
         cat = request.query_params.get('category_id')
         if cat:
-            qs = qs.filter(productcategory__category=cat)
+            try:
+                cat_ids = get_category_tree().descendant_ids(int(cat))
+            except ValueError:
+                raise ValidationError("Tham số category_id không hợp lệ")
+            qs = qs.filter(id__in=ProductCategory.objects.filter(category_id__in=cat_ids).values('product_id'))
 
-        # lọc theo giá
-        price_min = request.query_params.get('price_min')
-        price_max = request.query_params.get('price_max')
-        if price_min:
-            qs = qs.filter(productvariant__price__gte=price_min)
-        if price_max:
-            qs = qs.filter(productvariant__price__lte=price_max)
-
-        # lọc theo tồn kho
-        in_stock = request.query_params.get('in_stock')
-        if in_stock is not None:
-            if in_stock.lower() in ['true', '1']:
-                qs = qs.filter(productvariant__inventory__quantity__gt=0)
-            else:
-                qs = qs.filter(productvariant__inventory__quantity__lte=0)
+        # lọc theo giá, tồn kho (trên bảng product_summaries)
+        qs = filter_by_summary(qs, request.query_params)
 
         # sort
-        sort_by = request.query_params.get('sort_by')
+        qs = order_products(qs, request.query_params.get('sort_by'))
+
+        page = self.paginate_queryset(qs)
+        serializer = ProductSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def _search_index(self, request, q):
+        """
+        Tìm bằng inverted index: BM25, không phân biệt dấu, từ cuối là tiền tố.
+        Bộ lọc category/price/in_stock/province_id áp trên posting list trong bộ nhớ.
+        Không có sort_by thì giữ thứ tự theo độ liên quan; có sort_by thì chỉ sắp
+        SEARCH_SORT_LIMIT kết quả liên quan nhất (không đưa cả danh sách id vào IN (...)).
+        """
+        params = request.query_params
+        sort_by = params.get('sort_by')
+        cat = params.get('category_id')
+        in_stock = params.get('in_stock')
+        province_id = parse_province_id(params)
+        try:
+            ranked = get_search_index().search(
+                q,
+                category_ids=get_category_tree().descendant_ids(int(cat)) if cat else None,
+                price_min=float(params['price_min']) if params.get('price_min') else None,
+                price_max=float(params['price_max']) if params.get('price_max') else None,
+                in_stock=None if in_stock is None else in_stock.lower() in ['true', '1'],
+                province_id=province_id,
+                limit=settings.SEARCH_SORT_LIMIT if sort_by else None,
+            )
+        except ValueError:
+            raise ValidationError("Tham số category_id/price_min/price_max không hợp lệ")
+        ids = [pid for pid, _ in ranked]
+
         if sort_by:
-            qs = qs.order_by(sort_by)
-        else: qs.order_by('id')
+            page = self.paginate_queryset(order_products(Product.objects.filter(id__in=ids), sort_by))
+        else:
+            page_ids = self.paginate_queryset(ids)
+            products = Product.objects.in_bulk(page_ids)
+            page = [products[pid] for pid in page_ids if pid in products]
 
-        page = self.paginate_queryset(qs.distinct())
         serializer = ProductSerializer(page, many=True)
         return self.get_paginated_response(serializer.data)
 
+    @action(detail=False, methods=['get'], url_path='suggest')
+    def suggest(self, request):
+        """
+        GET /api/products/suggest/?q=gia&limit=10
+        - gợi ý sản phẩm khi đang gõ (khớp tiền tố, không phân biệt dấu)
+        """
+        q = request.query_params.get('q', '')
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            limit = 10
+        ranked = get_search_index().search(q, limit=limit)
+        products = Product.objects.in_bulk([pid for pid, _ in ranked])
+        data = [
+            {'id': pid, 'name': products[pid].name}
+            for pid, _ in ranked if pid in products
+        ]
+        return Response(data)
+
 
 class OrderViewSet(viewsets.ModelViewSet):
     queryset = Order.objects.all()
@@ -112,11 +304,28 @@ class OrderViewSet(viewsets.ModelViewSet):
         """
         POST /api/orders/
         - Tạo order, tạo payment record
-        - Xếp job gửi email bất đồng bộ
+        - Xếp email xác nhận vào hàng đợi gửi theo lô
+        - ?async=true (hoặc CHECKOUT_ASYNC) : nhận đơn, trả 202 kèm URL tra trạng thái
+        - header Idempotency-Key: gửi lại cùng key trả lại đúng response lần đầu,
+          không tạo đơn / trừ kho / gửi email lần nữa
         """
+        key = request.headers.get('Idempotency-Key')
+        if key:
+            scope = f"orders:{request.data.get('customer', '')}"
+            return idempotent_response(request, key, scope, lambda: self._create(request))
+        return self._create(request)
+
+    def _create(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        order = serializer.save()
+        if settings.CHECKOUT_ASYNC or request.query_params.get('async', '').lower() in ['true', '1']:
+            return self._create_async(request, serializer)
+
+        # đơn hàng, job email và message outbox nằm chung một transaction;
+        # relay đẩy task lên broker sau commit, request không chờ broker
+        with transaction.atomic():
+            order = serializer.save()
+            enqueue_order_confirmation(order.id)
         headers = self.get_success_headers(serializer.data)
 
         data = {
@@ -124,15 +333,49 @@ class OrderViewSet(viewsets.ModelViewSet):
             "order_id": order.id
         }
 
-        # dispatch async email task
-        send_order_confirmation_email.delay(order.id)
-
         return Response(
             data,
             status=status.HTTP_201_CREATED,
             headers=headers
         )
 
+    def _create_async(self, request, serializer):
+        intent = submit_checkout(serializer.to_payload())
+        status_url = request.build_absolute_uri(
+            reverse('checkout-intent', kwargs={'token': intent.token})
+        )
+        return Response(
+            {
+                "message": "Đơn hàng đã được tiếp nhận và đang xử lý",
+                "token": str(intent.token),
+                "status_url": status_url,
+            },
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': status_url},
+        )
+
+    @action(detail=False, methods=['get'], url_path='export', permission_classes=[IsAdminUser])
+    def export(self, request):
+        """
+        GET /api/orders/export/?output=csv|ndjson&from=YYYY-MM-DD&to=YYYY-MM-DD&status=...
+        - Xuất đơn kèm dòng hàng, phí, voucher, thanh toán; ghi dần từng đơn
+          (StreamingHttpResponse) nên bộ nhớ không tăng theo số đơn
+        """
+        params = request.query_params
+        fmt = params.get('output', exports.CSV)
+        if fmt not in exports.FORMATS:
+            raise ValidationError(f"output chỉ nhận: {', '.join(exports.FORMATS)}")
+        status_filter = params.get('status')
+        if status_filter and status_filter not in dict(Order.STATUS_CHOICES):
+            raise ValidationError("status không hợp lệ")
+        qs = exports.export_queryset(
+            parse_date_param(params, 'from'), parse_date_param(params, 'to'), status_filter
+        )
+        response = StreamingHttpResponse(exports.stream_orders(fmt, qs), content_type=exports.FORMATS[fmt])
+        filename = f"orders-{timezone.localdate():%Y%m%d}.{fmt}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
     @action(detail=True, methods=['post'], url_path='send-confirmation')
     def send_confirmation(self, request, pk=None):
         """
@@ -140,8 +383,171 @@ class OrderViewSet(viewsets.ModelViewSet):
         - Gửi lại email xác nhận (nếu cần)
         """
         order = self.get_object()
-        send_order_confirmation_email.delay(order.id)
+        enqueue_order_confirmation(order.id)
         return Response(
             {'status': 'email_queued'},
             status=status.HTTP_202_ACCEPTED
         )
+
+
+class CheckoutIntentView(APIView):
+    """
+    GET /api/checkout/{token}/
+    - Trạng thái đơn đặt bất đồng bộ: pending / processing / completed (kèm order_id) / failed (kèm error)
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request, token):
+        intent = get_object_or_404(CheckoutIntent, token=token)
+        return Response(CheckoutIntentSerializer(intent).data)
+
+
+class ShippingQuoteView(APIView):
+    """
+    POST /api/quotes/shipping/
+    - Báo giá giỏ hàng trước khi đặt: phương án lấy hàng, phí ship, thời gian giao
+    - Một địa chỉ (shipping_address_id) hoặc nhiều địa chỉ (shipping_address_ids)
+    - Chỉ đọc: không tạo đơn, không giữ hàng; tồn kho lấy từ snapshot vài giây
+    """
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        serializer = ShippingQuoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        quotes = quote_shipping(
+            customer_id=data['customer'].id,
+            address_ids=data['address_ids'],
+            raw_items=data['items'],
+            fee_code=data['shipping_fee_type'],
+        )
+        return Response({'quotes': quotes})
+
+
+def parse_date_param(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValidationError(f"{name} phải có dạng YYYY-MM-DD")
+
+
+def parse_month_param(params, name, default=None):
+    value = params.get(name)
+    if not value:
+        return default
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise ValidationError(f"{name} phải có dạng YYYY-MM")
+
+
+def parse_int_param(params, name, default, low, high):
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise ValidationError(f"{name} không hợp lệ")
+    if not low <= value <= high:
+        raise ValidationError(f"{name} phải trong khoảng {low}-{high}")
+    return value
+
+
+class SalesRollupListView(ListAPIView):
+    """
+    GET /api/reports/sales/
+    - Doanh số tổng hợp sẵn (app/analytics.py), lọc theo:
+      period=day|month (mặc định month), dimension=all|customer|store|category,
+      dimension_id, from / to (YYYY-MM-DD, theo period_start)
+    """
+    serializer_class = SalesRollupSerializer
+    permission_classes = [IsAdminUser]
+
+    def get_queryset(self):
+        params = self.request.query_params
+        period = params.get('period', 'month')
+        dimension = params.get('dimension', 'all')
+        if period not in dict(SalesRollup.PERIOD_CHOICES):
+            raise ValidationError("period chỉ nhận day hoặc month")
+        if dimension not in dict(SalesRollup.DIMENSION_CHOICES):
+            raise ValidationError("dimension chỉ nhận all, customer, store hoặc category")
+
+        qs = SalesRollup.objects.filter(period=period, dimension=dimension)
+        if params.get('dimension_id'):
+            qs = qs.filter(dimension_id=parse_int_param(params, 'dimension_id', None, 0, 2 ** 31 - 1))
+        date_from = parse_date_param(params, 'from')
+        date_to = parse_date_param(params, 'to')
+        if date_from:
+            qs = qs.filter(period_start__gte=date_from)
+        if date_to:
+            qs = qs.filter(period_start__lte=date_to)
+        return qs.order_by('period_start', 'dimension_id')
+
+
+class MonthlyAOVReportView(APIView):
+    """
+    GET /api/reports/aov/?year=2025
+    - Giá trị trung bình đơn hàng theo tháng (mặc định năm hiện tại), đọc từ rollup tháng
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        year = parse_int_param(request.query_params, 'year', timezone.localdate().year, 1970, 9999)
+        return Response({'year': year, 'months': monthly_aov(year)})
+
+
+class ChurnReportView(APIView):
+    """
+    GET /api/reports/churn/?months=6
+    - Tỷ lệ khách mua ở kỳ trước nhưng không mua lại ở kỳ gần nhất
+      (bitmap hoạt động theo tháng, app/retention.py)
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        months = parse_int_param(request.query_params, 'months', 6, 1, 60)
+        return Response(churn(window_months=months))
+
+
+class CohortReportView(APIView):
+    """
+    GET /api/reports/cohorts/?from=2025-01&months=12
+    - Cohort theo tháng mua đầu tiên và % quay lại mua ở từng tháng sau đó
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = request.query_params
+        months = parse_int_param(params, 'months', 12, 1, 120)
+        default = add_months(month_start(timezone.localdate()), -(months - 1))
+        first = parse_month_param(params, 'from', default)
+        return Response({'cohorts': cohorts(first, months)})
+
+
+class RepeatPurchaseReportView(APIView):
+    """
+    GET /api/reports/repeat-purchase/?from=2025-01&to=2025-12
+    - % khách mua từ 2 đơn trở lên trong các tháng [from, to] (mặc định 12 tháng gần nhất)
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = request.query_params
+        last = parse_month_param(params, 'to', month_start(timezone.localdate()))
+        first = parse_month_param(params, 'from', add_months(last, -11))
+        if first > last:
+            raise ValidationError("from phải không sau to")
+        return Response(repeat_purchase(first, last))
+
+
+class CatalogCacheStatsView(APIView):
+    """
+    GET /api/catalog-cache/stats/
+    - Hit ratio, số entry, độ trễ trung bình hit/miss của cache catalog
+      (số liệu của tiến trình đang phục vụ request)
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(catalog_cache.stats())
@@ -0,0 +1,293 @@
+import datetime
+import threading
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .cache import bump_generation, get_generation
+from .models import UserVoucher, Voucher
+
+VOUCHERS_GENERATION = 'vouchers'
+
+CENT = Decimal('0.01')
+
+SHIPPING = 'shipping'
+DISCOUNT = 'discount'
+
+
+class ActiveVoucher:
+    """Bản sao gọn của một Voucher đang hiệu lực (không giữ model instance)."""
+    __slots__ = ('id', 'code', 'voucher_type', 'discount_amount', 'discount_percent',
+                 'valid_from', 'valid_to')
+
+    def __init__(self, voucher: Voucher):
+        self.id = voucher.id
+        self.code = voucher.code
+        self.voucher_type = voucher.voucher_type
+        self.discount_amount = voucher.discount_amount or Decimal('0')
+        self.discount_percent = voucher.discount_percent or Decimal('0')
+        self.valid_from = voucher.valid_from
+        self.valid_to = voucher.valid_to
+
+    def active_on(self, day: datetime.date) -> bool:
+        return (self.valid_from is None or self.valid_from <= day) and \
+               (self.valid_to is None or day <= self.valid_to)
+
+    def discount_for(self, base: Decimal) -> Decimal:
+        """
+        Số tiền giảm trên `base` (tiền hàng với voucher discount, phí ship với
+        voucher shipping). Voucher shipping không ghi số tiền/phần trăm nghĩa
+        là miễn phí ship toàn bộ.
+        """
+        if self.discount_amount:
+            disc = self.discount_amount
+        elif self.discount_percent:
+            disc = (base * self.discount_percent / Decimal('100')).quantize(CENT)
+        elif self.voucher_type == SHIPPING:
+            disc = base
+        else:
+            disc = Decimal('0')
+        return min(disc, base)
+
+
+class VoucherIndex:
+    """Các voucher hiệu lực trong ngày `day`, tra theo code."""
+
+    def __init__(self, day: datetime.date):
+        self.day = day
+        self.lock = threading.RLock()
+        self.by_code: Dict[str, ActiveVoucher] = {}
+
+    def __len__(self):
+        return len(self.by_code)
+
+    def put(self, voucher: Voucher):
+        self.put_active(ActiveVoucher(voucher))
+
+    def put_active(self, active: ActiveVoucher):
+        with self.lock:
+            # code có thể vừa bị đổi: bỏ bản cũ theo id
+            for code, current in list(self.by_code.items()):
+                if current.id == active.id:
+                    del self.by_code[code]
+            if active.active_on(self.day):
+                self.by_code[active.code] = active
+
+    def remove(self, voucher_id: int):
+        with self.lock:
+            for code, active in list(self.by_code.items()):
+                if active.id == voucher_id:
+                    del self.by_code[code]
+
+    def get(self, code: str) -> Optional[ActiveVoucher]:
+        return self.by_code.get(code)
+
+
+def build_voucher_index(day: datetime.date) -> VoucherIndex:
+    index = VoucherIndex(day)
+    rows = Voucher.objects.filter(
+        Q(valid_from__isnull=True) | Q(valid_from__lte=day),
+        Q(valid_to__isnull=True) | Q(valid_to__gte=day),
+    )
+    for voucher in rows:
+        index.put(voucher)
+    return index
+
+
+_index_lock = threading.Lock()
+_index: Optional[VoucherIndex] = None
+_index_generation = None
+
+
+def get_voucher_index() -> VoucherIndex:
+    """
+    Index dùng chung trong tiến trình. Dựng lại khi generation `vouchers` đổi
+    (Voucher được sửa ở tiến trình khác) hoặc khi sang ngày mới.
+    """
+    global _index, _index_generation
+    generation = get_generation(VOUCHERS_GENERATION)
+    today = timezone.localdate()
+    if _index is not None and _index.day == today and _index_generation == generation:
+        return _index
+
+    with _index_lock:
+        if _index is None or _index.day != today or _index_generation != generation:
+            _index = build_voucher_index(today)
+            _index_generation = generation
+        return _index
+
+
+def _apply(update):
+    """
+    Áp cập nhật lên index của tiến trình này (nếu đang dùng), rồi tăng
+    generation để các tiến trình khác dựng lại.
+    """
+    global _index_generation
+    with _index_lock:
+        current = _index is not None and _index_generation == get_generation(VOUCHERS_GENERATION)
+        if current:
+            update(_index)
+        generation = bump_generation(VOUCHERS_GENERATION)
+        if current:
+            _index_generation = generation
+
+
+def index_voucher(voucher: Voucher):
+    """
+    Gọi trong post_save: cập nhật index SAU commit (rollback thì không để lại
+    voucher ma). Chụp giá trị ngay lúc lưu vì instance có thể bị sửa tiếp
+    trước khi commit.
+    """
+    active = ActiveVoucher(voucher)
+    transaction.on_commit(lambda: _apply(lambda index: index.put_active(active)))
+
+
+def unindex_voucher(voucher_id: int):
+    transaction.on_commit(lambda: _apply(lambda index: index.remove(voucher_id)))
+
+
+# ---------------------------------------------------------------------------
+# Áp voucher cho đơn hàng
+# ---------------------------------------------------------------------------
+
+class AppliedVoucher:
+    __slots__ = ('voucher', 'user_voucher_id', 'discount')
+
+    def __init__(self, voucher: ActiveVoucher, user_voucher_id: int, discount: Decimal):
+        self.voucher = voucher
+        self.user_voucher_id = user_voucher_id
+        self.discount = discount
+
+
+def unused_user_vouchers(customer_id: int, voucher_ids: Iterable[int]) -> Dict[int, int]:
+    """{voucher_id: id UserVoucher chưa dùng} của khách, 1 truy vấn cho mọi voucher."""
+    result = {}
+    rows = (
+        UserVoucher.objects
+        .filter(user_id=customer_id, voucher_id__in=list(voucher_ids), used=False)
+        .order_by('id')
+        .values_list('voucher_id', 'id')
+    )
+    for voucher_id, uv_id in rows:
+        result.setdefault(voucher_id, uv_id)
+    return result
+
+
+def evaluate_vouchers(codes: Iterable[Optional[str]], customer_id: int,
+                      subtotal: Decimal, shipping_fee: Decimal) -> List[AppliedVoucher]:
+    """
+    Kiểm tra và tính giảm giá cho các mã voucher của một đơn:
+      - mã phải đang hiệu lực (tra index trong bộ nhớ, không truy vấn)
+      - tối đa 1 voucher `discount` (trừ vào tiền hàng) và 1 voucher `shipping`
+        (trừ vào phí ship)
+      - khách phải có UserVoucher chưa dùng cho từng mã (1 truy vấn cho cả đơn)
+    """
+    index = get_voucher_index()
+    chosen: Dict[str, ActiveVoucher] = {}
+    for code in codes:
+        if not code:
+            continue
+        voucher = index.get(code)
+        if voucher is None:
+            raise ValidationError(f"Voucher `{code}` không hợp lệ")
+        other = chosen.get(voucher.voucher_type)
+        if other is not None and other.id != voucher.id:
+            raise ValidationError(
+                "Mỗi đơn chỉ dùng được 1 voucher giảm giá và 1 voucher vận chuyển"
+            )
+        chosen[voucher.voucher_type] = voucher
+
+    if not chosen:
+        return []
+
+    owned = unused_user_vouchers(customer_id, [v.id for v in chosen.values()])
+    applied = []
+    # voucher giảm giá trước, voucher vận chuyển sau (thứ tự ghi OrderVoucher cố định)
+    for voucher_type, base in ((DISCOUNT, subtotal), (SHIPPING, shipping_fee)):
+        voucher = chosen.get(voucher_type)
+        if voucher is None:
+            continue
+        uv_id = owned.get(voucher.id)
+        if uv_id is None:
+            raise ValidationError(f"Voucher `{voucher.code}` đã dùng hoặc không phù hợp")
+        applied.append(AppliedVoucher(voucher, uv_id, voucher.discount_for(base)))
+    return applied
+
+
+# ---------------------------------------------------------------------------
+# Dùng voucher (mỗi UserVoucher chỉ dùng được một lần)
+# ---------------------------------------------------------------------------
+
+def claim_user_voucher(customer_id: int, voucher_id: int, user_voucher_id: Optional[int] = None,
+                       attempts: int = 3) -> Optional[int]:
+    """
+    Đánh dấu một UserVoucher của khách là đã dùng bằng MỘT câu UPDATE có điều kiện
+    `used = false`: hai checkout song song không thể cùng dùng một dòng (dòng thua
+    cập nhật 0 bản ghi). Nếu dòng đã chọn vừa bị dùng mà khách còn bản khác của
+    cùng voucher thì thử bản đó. Trả về id UserVoucher đã dùng, hoặc None.
+    """
+    uv_id = user_voucher_id
+    for _ in range(attempts):
+        if uv_id is None:
+            uv_id = (
+                UserVoucher.objects
+                .filter(user_id=customer_id, voucher_id=voucher_id, used=False)
+                .order_by('id')
+                .values_list('id', flat=True)
+                .first()
+            )
+            if uv_id is None:
+                return None
+        if UserVoucher.objects.filter(id=uv_id, used=False).update(used=True):
+            return uv_id
+        uv_id = None
+    return None
+
+
+def redeem_vouchers(customer_id: int, applied: List[AppliedVoucher]):
+    """Dùng các voucher đã áp cho đơn; lỗi nếu có voucher vừa bị đơn khác dùng mất."""
+    for a in applied:
+        uv_id = claim_user_voucher(customer_id, a.voucher.id, a.user_voucher_id)
+        if uv_id is None:
+            raise ValidationError(f"Voucher `{a.voucher.code}` vừa được dùng cho đơn hàng khác")
+        a.user_voucher_id = uv_id
+
+
+def assign_voucher(voucher_id: int, customer_ids: Iterable[int], chunk_size: int = 5000,
+                   skip_existing: bool = True) -> int:
+    """
+    Phát voucher cho nhiều khách (chiến dịch gửi hàng trăm nghìn khách):
+    ghi UserVoucher bằng bulk_create theo từng chunk, mỗi chunk một transaction.
+    `skip_existing` bỏ qua khách đã có voucher này chưa dùng (chạy lại lệnh không nhân đôi).
+    Trả về số dòng đã tạo.
+    """
+    created = 0
+    chunk = []
+
+    def flush(ids):
+        if skip_existing:
+            have = set(
+                UserVoucher.objects
+                .filter(voucher_id=voucher_id, user_id__in=ids, used=False)
+                .values_list('user_id', flat=True)
+            )
+            ids = [cid for cid in ids if cid not in have]
+        with transaction.atomic():
+            UserVoucher.objects.bulk_create(
+                [UserVoucher(user_id=cid, voucher_id=voucher_id) for cid in ids],
+                batch_size=chunk_size,
+            )
+        return len(ids)
+
+    for cid in customer_ids:
+        chunk.append(cid)
+        if len(chunk) >= chunk_size:
+            created += flush(chunk)
+            chunk = []
+    if chunk:
+        created += flush(chunk)
+    return created
@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 
 # load .env
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -37,6 +38,16 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', EMAIL_HOST_USER)
 
+# Gửi email theo lô (app/emails.py): gom tối đa EMAIL_BATCH_SIZE thư hoặc
+# EMAIL_BATCH_WINDOW giây rồi gửi qua một kết nối SMTP
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 100))
+EMAIL_BATCH_WINDOW = int(os.getenv('EMAIL_BATCH_WINDOW', 5))
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', 5))
+EMAIL_RETRY_DELAY = int(os.getenv('EMAIL_RETRY_DELAY', 60))
+EMAIL_SENDING_TIMEOUT = int(os.getenv('EMAIL_SENDING_TIMEOUT', 600))
+# Số đoạn mô tả variant đã dựng sẵn giữ trong mỗi worker
+EMAIL_FRAGMENT_CACHE_SIZE = int(os.getenv('EMAIL_FRAGMENT_CACHE_SIZE', 10000))
+
 
 # Application definition
 
@@ -70,6 +81,7 @@ MIDDLEWARE = [
 
 # CORS (cho phép frontend gọi API)
 CORS_ALLOW_ALL_ORIGINS = True  # hoặc chỉ định list: CORS_ALLOWED_ORIGINS = [...]
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 
 ROOT_URLCONF = 'ecommerce.urls'
 
@@ -90,7 +102,39 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'ecommerce.wsgi.application'
-CELERY_BROKER_URL = 'redis://localhost:6379/0'
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+# Chạy task ngay trong tiến trình (test cục bộ không cần broker)
+CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER', 'False') == 'True'
+
+# Outbox (app/outbox.py): task được ghi cùng transaction, relay đẩy lên broker theo lô
+OUTBOX_PUBLISHER = os.getenv('OUTBOX_PUBLISHER', 'app.outbox.CeleryPublisher')
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 500))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 1.0))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 10))
+OUTBOX_RETRY_DELAY = int(os.getenv('OUTBOX_RETRY_DELAY', 5))
+OUTBOX_SENDING_TIMEOUT = int(os.getenv('OUTBOX_SENDING_TIMEOUT', 300))
+
+# Lịch celery beat (`celery -A ecommerce beat`): lưới an toàn cho các việc vốn
+# được hẹn theo sự kiện — gửi lại email lỗi đã tới hạn, outbox khi relay không
+# chạy, đồng bộ tồn kho chia shard, rollup doanh số. Chu kỳ tính bằng giây.
+CELERY_BEAT_SCHEDULE = {
+    'flush-email-jobs': {
+        'task': 'app.tasks.flush_email_jobs',
+        'schedule': float(os.getenv('BEAT_EMAIL_FLUSH_INTERVAL', 60)),
+    },
+    'relay-outbox': {
+        'task': 'app.tasks.relay_outbox_task',
+        'schedule': float(os.getenv('BEAT_OUTBOX_RELAY_INTERVAL', 30)),
+    },
+    'sync-sharded-inventory': {
+        'task': 'app.tasks.sync_sharded_inventory_task',
+        'schedule': float(os.getenv('BEAT_SHARD_SYNC_INTERVAL', 60)),
+    },
+    'refresh-sales-rollups': {
+        'task': 'app.tasks.refresh_sales_rollups',
+        'schedule': float(os.getenv('BEAT_ROLLUP_INTERVAL', 900)),
+    },
+}
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -108,6 +152,74 @@ DATABASES = {
 }
 
 
+# Cache
+# Đặt REDIS_CACHE_URL (vd redis://localhost:6379/1) để các worker dùng chung cache;
+# không đặt thì mỗi tiến trình dùng LocMem riêng.
+REDIS_CACHE_URL = os.getenv('REDIS_CACHE_URL')
+if REDIS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Cache response catalog (app/cache.py): LRU trong tiến trình + tầng dùng chung
+CATALOG_CACHE = {
+    'MAX_ENTRIES': int(os.getenv('CATALOG_CACHE_MAX_ENTRIES', 1024)),
+    'TTL': int(os.getenv('CATALOG_CACHE_TTL', 300)),
+    'SHARED_ALIAS': 'default' if REDIS_CACHE_URL else None,
+}
+
+# Inverted index tìm kiếm sản phẩm (app/search.py): dựng lại sau tối đa N giây
+SEARCH_INDEX_MAX_AGE = int(os.getenv('SEARCH_INDEX_MAX_AGE', 300))
+# Cập nhật tăng dần của index: báo các tiến trình khác dựng lại tối đa một lần mỗi N giây
+SEARCH_SYNC_DELAY = int(os.getenv('SEARCH_SYNC_DELAY', 5))
+# Tìm kiếm có sort_by: chỉ sắp N kết quả liên quan nhất
+SEARCH_SORT_LIMIT = int(os.getenv('SEARCH_SORT_LIMIT', 1000))
+
+# Phân bổ đơn hàng cho store (app/allocation.py)
+ALLOCATION_SOLVERS = [
+    'app.allocation.NearestFillSolver',
+    'app.allocation.GreedySolver',
+    'app.allocation.ExactSolver',
+]
+ALLOCATION_TIME_BUDGET_MS = float(os.getenv('ALLOCATION_TIME_BUDGET_MS', 50))
+ALLOCATION_SHIPMENT_COST = float(os.getenv('ALLOCATION_SHIPMENT_COST', 10000))
+ALLOCATION_EXACT_MAX_STORES = int(os.getenv('ALLOCATION_EXACT_MAX_STORES', 20))
+# Số store có hàng gần nhất đưa vào bài toán phân bổ (lấy thêm nếu chừng đó chưa đủ hàng)
+ALLOCATION_MAX_CANDIDATES = int(os.getenv('ALLOCATION_MAX_CANDIDATES', 20))
+
+# Checkout bất đồng bộ (app/checkout.py): True thì POST /api/orders/ luôn trả 202
+CHECKOUT_ASYNC = os.getenv('CHECKOUT_ASYNC', 'False') == 'True'
+CHECKOUT_STAGE_TIMEOUT = int(os.getenv('CHECKOUT_STAGE_TIMEOUT', 120))
+CHECKOUT_MAX_REALLOCATIONS = int(os.getenv('CHECKOUT_MAX_REALLOCATIONS', 2))
+
+# Báo giá ship (app/quotes.py): tồn kho snapshot trong tiến trình, sống QUOTE_STOCK_TTL giây
+QUOTE_STOCK_TTL = float(os.getenv('QUOTE_STOCK_TTL', 5))
+QUOTE_STOCK_CACHE_SIZE = int(os.getenv('QUOTE_STOCK_CACHE_SIZE', 50000))
+QUOTE_MAX_ADDRESSES = int(os.getenv('QUOTE_MAX_ADDRESSES', 20))
+
+# Rollup doanh số (app/analytics.py)
+ROLLUP_DELAY = int(os.getenv('ROLLUP_DELAY', 60))
+ROLLUP_WATERMARK_OVERLAP = int(os.getenv('ROLLUP_WATERMARK_OVERLAP', 300))
+ROLLUP_LOCK_TIMEOUT = int(os.getenv('ROLLUP_LOCK_TIMEOUT', 600))
+
+# Export đơn hàng (app/exports.py): số đơn mỗi lượt đọc cursor / prefetch bảng con
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 2000))
+
+# Idempotency-Key cho POST /api/orders/ (app/idempotency.py)
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', 24 * 3600))
+IDEMPOTENCY_IN_FLIGHT_TTL = int(os.getenv('IDEMPOTENCY_IN_FLIGHT_TTL', 60))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv('IDEMPOTENCY_WAIT_TIMEOUT', 10))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -51,6 +51,7 @@ BEGIN
 	DECLARE v_pct DECIMAL(5,2);
 	DECLARE v_amt2           DECIMAL(12,2); 
 	DECLARE v_pct2           DECIMAL(5,2);
+	DECLARE v_radius_km      DOUBLE;
 
   -- Nếu có lỗi: rollback và báo ra ngoài
   DECLARE EXIT HANDLER FOR SQLEXCEPTION
@@ -97,16 +98,29 @@ BEGIN
 
 
   -- 5. Tìm kho gần nhất còn hàng & khoảng cách
-  SELECT
-    s.id,
-    haversine(v_user_lat, v_user_lon, s.latitude, s.longitude) AS distance_km
-  INTO v_store_id, v_min_distance
-  FROM stores s
-  JOIN inventory i ON i.store_id = s.id
-  WHERE i.variant_id = v_variant_id
-    AND i.quantity >= p_quantity
-  ORDER BY distance_km
-  LIMIT 1;
+  --    Lọc trước bằng bounding box quanh người mua (dùng index idx_stores_lat_lon),
+  --    chưa tìm thấy thì nới bán kính gấp đôi. Mọi store trong bán kính đều nằm
+  --    trong box nên store gần nhất tìm được cũng là gần nhất trên toàn bảng.
+  SET v_radius_km = 50;
+  SET v_store_id = NULL;
+  WHILE v_store_id IS NULL AND v_radius_km <= 20480 DO
+    SELECT
+      s.id,
+      haversine(v_user_lat, v_user_lon, s.latitude, s.longitude) AS distance_km
+    INTO v_store_id, v_min_distance
+    FROM stores s
+    JOIN inventory i ON i.store_id = s.id
+    WHERE i.variant_id = v_variant_id
+      AND i.quantity >= p_quantity
+      AND s.latitude  BETWEEN v_user_lat - v_radius_km / 111.0
+                          AND v_user_lat + v_radius_km / 111.0
+      AND s.longitude BETWEEN v_user_lon - v_radius_km / (111.0 * COS(RADIANS(v_user_lat)))
+                          AND v_user_lon + v_radius_km / (111.0 * COS(RADIANS(v_user_lat)))
+      AND haversine(v_user_lat, v_user_lon, s.latitude, s.longitude) <= v_radius_km
+    ORDER BY distance_km
+    LIMIT 1;
+    SET v_radius_km = v_radius_km * 2;
+  END WHILE;
   
    SELECT CONCAT('nearest distance=', ROUND(v_min_distance,3)) AS debug;
 